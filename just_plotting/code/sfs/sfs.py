@@ -1,19 +1,28 @@
 import argparse
 
 import os
-import re
+import sys
 import numpy as np
-import matplotlib.pyplot as plt
 from lmfit import Model, Parameters, Minimizer
 from scipy.special import erf
 from scipy.linalg import cholesky, cho_solve
 
+# Sample loading and band statistics are shared with the fits in lsd_out
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../../lsd_out")
+)
+import fit_bands  # noqa: E402
+import sample_files  # noqa: E402
+
 parser = argparse.ArgumentParser()
 parser.add_argument("--plot_styles", default="paperdraft.mplstyle")
+parser.add_argument(
+    "--no-plots",
+    action="store_true",
+    help="Only fit and print the results, without drawing the figure",
+)
 args = parser.parse_args()
 
-plt.style.use(args.plot_styles)
-
 CB_color_cycle = [
     "#377eb8",
     "#ff7f00",
@@ -29,46 +38,11 @@ CB_color_cycle = [
 V = 20**3
 
 
-def read_files_from_directory(directory):
-    files = os.listdir(directory)
-    files = [f for f in files if os.path.isfile(os.path.join(directory, f))]
-    files.sort()
-    return files
-
-
-def read_file_content(file_path):
-    with open(file_path, "r") as file:
-        content = file.readlines()
-    values = [float(line.split()[1]) for line in content]
-    return values
-
-
-def extract_energy_from_filename(filename):
-    match = re.search(r"E([\d.]+)sig", filename)
-    if match:
-        return float(match.group(1))
-    return None
-
-
 def fill_spectral_density_array(dir1, dir2):
-    files1 = read_files_from_directory(dir1)
-    files2 = read_files_from_directory(dir2)
-    num_files = len(files1)
-    sample_content = read_file_content(os.path.join(dir1, files1[0]))
-    num_bootstraps = len(sample_content)
-    spectral_density = np.zeros((num_bootstraps, 2, num_files))
-
-    energy_values = []
-
-    for file_index, (file1, file2) in enumerate(zip(files1, files2)):
-        content1 = read_file_content(os.path.join(dir1, file1))
-        content2 = read_file_content(os.path.join(dir2, file2))
-        energy = extract_energy_from_filename(file1)
-        energy_values.append(energy)
-
-        for bootstrap_index in range(num_bootstraps):
-            spectral_density[bootstrap_index][0][file_index] = content1[bootstrap_index]
-            spectral_density[bootstrap_index][1][file_index] = content2[bootstrap_index]
+    energy_values, samples1 = sample_files.read_samples(dir1)
+    _, samples2 = sample_files.read_samples(dir2)
+    spectral_density = np.stack([samples1, samples2], axis=1)
+    energy_values = list(energy_values)
 
     return spectral_density, energy_values
 
@@ -189,26 +163,33 @@ def plot_with_errors_single(
     spectral_density,
     mpi,
 ):
+    import matplotlib.pyplot as plt
+
+    plt.style.use(args.plot_styles)
+
     # Increase resolution for smoother curves
     energy_fine = np.linspace(min(energy) - 0.3, max(energy) + 0.3, 500)
 
-    # Calculate the fit curves and error bands for spectral_density_1
-    fit_curves_1 = np.array(
-        [spectral_density_1_single(energy_fine, *params) for params in fit_params_1]
+    # Fit curves of all bootstraps at once, (num_bootstraps, len(energy_fine))
+    fit_params_1 = np.asarray(fit_params_1)
+    fit_params_2 = np.asarray(fit_params_2)
+    band_1 = fit_bands.band_statistics(
+        spectral_density_1_single(
+            energy_fine, fit_params_1[:, 0:1], fit_params_1[:, 1:2]
+        )
     )
-    mean_fit_curve_1 = np.mean(fit_curves_1, axis=0)
-    std_fit_curve_1 = np.std(fit_curves_1, axis=0)
+    mean_fit_curve_1 = band_1.mean
+    std_fit_curve_1 = band_1.std
 
     # Calculate the fit curves and error bands for spectral_density_2
     E0 = fit_params_1[0][1]  # Use the E0 from the first set of parameters
-    fit_curves_2 = np.array(
-        [
-            spectral_density_2_single(energy_fine, c0, E0, fit_params_1[0][0])
-            for c0 in fit_params_2
-        ]
+    band_2 = fit_bands.band_statistics(
+        spectral_density_2_single(
+            energy_fine, fit_params_2[:, 0:1], E0, fit_params_1[0][0]
+        )
     )
-    mean_fit_curve_2 = np.mean(fit_curves_2, axis=0)
-    std_fit_curve_2 = np.std(fit_curves_2, axis=0)
+    mean_fit_curve_2 = band_2.mean
+    std_fit_curve_2 = band_2.std
 
     # Error calculation for the data points
     error_spectral_density1 = np.std(spectral_density[:, 0, :], axis=0)
@@ -355,16 +336,17 @@ def main():
     print('mpi: ', mpi)
     """
     # Plot the results
-    plot_with_errors_single(
-        energy,
-        avg_spectral_density1,
-        avg_spectral_density2,
-        fit_params_1,
-        fit_params_2,
-        spectral_density.shape[0],
-        spectral_density,
-        mpi,
-    )
+    if not args.no_plots:
+        plot_with_errors_single(
+            energy,
+            avg_spectral_density1,
+            avg_spectral_density2,
+            fit_params_1,
+            fit_params_2,
+            spectral_density.shape[0],
+            spectral_density,
+            mpi,
+        )
 
 
 if __name__ == "__main__":
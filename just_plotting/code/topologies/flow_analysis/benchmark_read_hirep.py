@@ -0,0 +1,97 @@
+from argparse import ArgumentParser
+import os
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+
+import numpy as np
+
+from flow_analysis.readers.read_hirep import read_flows_hirep, read_flows_hirep_lines
+
+
+def write_flow_log(filename, num_configurations, num_steps, ncnfg=False):
+    """Write a synthetic HiRep flow log with random energies and charges."""
+    rng = np.random.default_rng(1)
+    header = (
+        "(ncnfg,t,E,t2*E,Esym,t2*Esym,TC)" if ncnfg else "(t,E,t2*E,Esym,t2*Esym,TC)"
+    )
+    times = np.arange(num_steps) * 0.01
+    with open(filename, "w") as f:
+        print("[GEOMETRY][0]Global size is 48x24x24x24", file=f)
+        for configuration in range(num_configurations):
+            print(
+                f"[IO][0]Configuration [runs/run1_48x24x24x24nc4nf2b6.5m-0.71n{configuration}]"
+                " read [0 sec] Plaquette=0.5",
+                file=f,
+            )
+            Ep, Ec, Q = rng.random((3, num_steps))
+            for t, Ep_t, Ec_t, Q_t in zip(times, Ep, Ec, Q):
+                count = f"{configuration + 1} " if ncnfg else ""
+                print(
+                    f"[WILSONFLOW][0]WF {header} = {count}{t:.6e} {Ep_t:.12e} "
+                    f"{t * t * Ep_t:.12e} {Ec_t:.12e} {t * t * Ec_t:.12e} {Q_t:.12e}",
+                    file=f,
+                )
+            print("[MAIN][0]Configuration done", file=f)
+
+
+def measure(reader, filename):
+    """
+    Time one uncached read of filename, then measure the peak traced memory
+    of another (tracing slows the reader down too much to time it).
+    """
+    start = perf_counter()
+    flows = reader.__wrapped__(filename)
+    elapsed = perf_counter() - start
+
+    tracemalloc.start()
+    reader.__wrapped__(filename)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return flows, elapsed, peak
+
+
+def main():
+    parser = ArgumentParser(
+        description="Compare the streaming and line by line HiRep flow readers."
+    )
+    parser.add_argument(
+        "flow_log",
+        nargs="?",
+        default=None,
+        help="HiRep flow log to read (a synthetic one is written if not given)",
+    )
+    parser.add_argument("--num_configurations", type=int, default=500)
+    parser.add_argument("--num_steps", type=int, default=400)
+    parser.add_argument("--ncnfg", action="store_true")
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tmpdir:
+        filename = args.flow_log
+        if filename is None:
+            filename = os.path.join(tmpdir, "flow.log")
+            write_flow_log(
+                filename, args.num_configurations, args.num_steps, args.ncnfg
+            )
+        print(f"{filename}: {os.path.getsize(filename) / 2**20:.1f} MiB")
+
+        results = {}
+        for name, reader in [
+            ("line by line", read_flows_hirep_lines),
+            ("streaming", read_flows_hirep),
+        ]:
+            flows, elapsed, peak = measure(reader, filename)
+            results[name] = flows
+            print(f"{name:>12}: {elapsed:7.2f} s, peak {peak / 2**20:7.1f} MiB")
+
+    old, new = results.values()
+    for attribute in ["ensemble_names", "trajectories", "times", "Eps", "Ecs", "Qs"]:
+        if not np.array_equal(getattr(old, attribute), getattr(new, attribute)):
+            raise ValueError(f"Readers disagree on {attribute}.")
+    if old.metadata != new.metadata:
+        raise ValueError("Readers disagree on metadata.")
+    print("Results agree.")
+
+
+if __name__ == "__main__":
+    main()
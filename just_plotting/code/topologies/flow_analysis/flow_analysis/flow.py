@@ -81,6 +81,28 @@ class FlowEnsemble:
 
         self._frozen = True
 
+    def fill(self, ensemble_names, trajectories, times, Eps, Ecs, Qs):
+        """
+        Set the data for all configurations at once, and freeze.
+
+        Arguments:
+            ensemble_names, trajectories: One element per configuration.
+            times: The flow times, shared by all configurations.
+            Eps, Ecs, Qs: Arrays with one row per configuration and one
+                          column per flow time.
+        """
+        if self._frozen:
+            raise TypeError("Can't append to a frozen ensemble.")
+
+        self.ensemble_names = asarray(ensemble_names)
+        self.trajectories = asarray(trajectories)
+        self.times = asarray(times)
+        self.Eps = asarray(Eps)
+        self.Ecs = asarray(Ecs)
+        self.Qs = asarray(Qs)
+
+        self._frozen = True
+
     def group(self, observable):
         return [
             observable[self.ensemble_names == ensemble_name]
@@ -1,11 +1,40 @@
 #!/usr/bin/env python3
 
 from functools import lru_cache
-from re import match
+from io import BytesIO
+from re import compile as compile_regex, match, MULTILINE
+
+from numpy import diff, empty, loadtxt
 
 from ..flow import FlowStep, Flow, FlowEnsemble
 
 
+WF_PREFIX = b"[WILSONFLOW][0]WF"
+
+# The lines of a flow log that read_flows_hirep needs, matching the tokens
+# that read_flows_hirep_lines uses after split(). They start with a literal
+# rather than ^, which lets re search for them far faster; whether a match
+# is at the start of a line is checked separately.
+CONFIGURATION_PATTERN = compile_regex(
+    rb"\[IO\]\[0\]Configuration[ \t]+(\S+)[ \t]+read(?:\s|$)", MULTILINE
+)
+GEOMETRY_PATTERN = compile_regex(
+    rb"\[GEOMETRY(?:_INIT)?\]\[0\]Global[ \t]+\S+[ \t]+\S+[ \t]+"
+    rb"([0-9]+)x([0-9]+)x([0-9]+)x([0-9]+)"
+)
+# There are two versions of HiRep flow logs
+# One has an extra field, after the "=", that is skipped here
+FLOW_STEP_PATTERN = compile_regex(
+    rb"\[WILSONFLOW\]\[0\]WF[ \t]+"
+    rb"(?:\(ncnfg\S*[ \t]+\S+[ \t]+\S+|\S+[ \t]+\S+)([^\n]*)"
+)
+
+# Columns of t, Ep, Ec and Q among the values of a flow step line
+FLOW_STEP_COLUMNS = [0, 1, 3, 5]
+
+CHUNK_SIZE = 2**20
+
+
 def add_metadata(metadata, line_contents):
     if (
         line_contents[0] == "[GEOMETRY][0]Global"
@@ -42,8 +71,108 @@ def parse_cfg_filename(filename):
     return run_name, int(cfg_index)
 
 
+def read_chunks(f, chunk_size=CHUNK_SIZE):
+    """
+    Read a binary file in chunks of about chunk_size bytes, each extended
+    to the end of its last line.
+    """
+    while chunk := f.read(chunk_size):
+        yield chunk + f.readline()
+
+
+def count_flow_steps(chunk, start=0, end=None):
+    """Count the flow steps in chunk[start:end]."""
+    return chunk.count(WF_PREFIX, start, end)
+
+
+def lines_matching(pattern, chunk):
+    """Matches of pattern in a chunk that start a line."""
+    return [
+        line
+        for line in pattern.finditer(chunk)
+        if line.start() == 0 or chunk[line.start() - 1] == ord("\n")
+    ]
+
+
+def store_flow_steps(steps, start, chunk):
+    """
+    Parse the flow steps in a chunk of a log into steps[:, start:], and
+    return the index after the last one.
+    """
+    values = FLOW_STEP_PATTERN.findall(chunk)
+    if len(values) != count_flow_steps(chunk):
+        raise ValueError("Unrecognised flow step line.")
+    if not values:
+        return start
+
+    parsed = loadtxt(BytesIO(b"\n".join(values)), usecols=FLOW_STEP_COLUMNS, ndmin=2)
+    steps[:, start : start + len(values)] = parsed.T
+    return start + len(values)
+
+
+@lru_cache(maxsize=8)
+def read_flows_hirep(filename, chunk_size=CHUNK_SIZE):
+    """
+    Read a HiRep gradient flow log into a frozen FlowEnsemble.
+
+    The log is read in chunks; the flow steps of each chunk are found and
+    parsed as a whole, into arrays allocated after counting them in a first
+    pass. Memory use is that of the result and a few chunks.
+    """
+    flows = FlowEnsemble(filename)
+
+    with open(filename, "rb") as f:
+        total_steps = sum(map(count_flow_steps, read_chunks(f, chunk_size)))
+
+    # t, Ep, Ec and Q of every flow step in the file
+    steps = empty((len(FLOW_STEP_COLUMNS), total_steps))
+    num_steps = 0
+    configurations = []
+    first_steps = []
+
+    with open(filename, "rb") as f:
+        for chunk in read_chunks(f, chunk_size):
+            position = 0
+            chunk_steps = num_steps
+            for line in lines_matching(CONFIGURATION_PATTERN, chunk):
+                chunk_steps += count_flow_steps(chunk, position, line.start())
+                position = line.start()
+                configurations.append(parse_cfg_filename(line[1].decode()))
+                first_steps.append(chunk_steps)
+            for line in lines_matching(GEOMETRY_PATTERN, chunk):
+                NT, NX, NY, NZ = map(int, line.groups())
+                flows.metadata.update(NT=NT, NX=NX, NY=NY, NZ=NZ)
+            num_steps = store_flow_steps(steps, num_steps, chunk)
+
+    if not configurations or first_steps[0] != 0:
+        raise ValueError(f"Flow steps with no configuration in {filename}.")
+
+    ensemble_names, trajectories = zip(*configurations)
+    lengths = diff(first_steps + [num_steps])
+    if (lengths != lengths[0]).any():
+        trajectory = trajectories[(lengths != lengths[0]).nonzero()[0][0]]
+        raise ValueError(f"Flow for trajectory {trajectory} not a consistent length.")
+
+    t, Ep, Ec, Q = steps.reshape(len(FLOW_STEP_COLUMNS), len(trajectories), -1)
+    mismatched = (t != t[0]).any(axis=1)
+    if mismatched.any():
+        trajectory = trajectories[mismatched.nonzero()[0][0]]
+        raise ValueError(
+            f"Times must match for all flows. (Failing at trajectory {trajectory})"
+        )
+    if (diff(t[0]) < 0).any():
+        raise ValueError("Flow goes backwards.")
+
+    flows.fill(ensemble_names, trajectories, t[0].copy(), Ep, Ec, Q)
+    return flows
+
+
 @lru_cache(maxsize=8)
-def read_flows_hirep(filename):
+def read_flows_hirep_lines(filename):
+    """
+    Line by line version of read_flows_hirep, which holds the whole log and
+    a Flow per configuration in memory; kept as a reference for it.
+    """
     flows = FlowEnsemble(filename)
     flow = None
 
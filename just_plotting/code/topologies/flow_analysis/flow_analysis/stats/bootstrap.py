@@ -1,12 +1,15 @@
 #!/usr/bin/env python3
 
-from numpy import mean, std, asarray, empty
+from numpy import mean, std, asarray, empty, ascontiguousarray, take
 from numpy.random import default_rng
 
 from uncertainties import ufloat
 
 BOOTSTRAP_SAMPLE_COUNT = 200
 
+# Largest array of resampled values gathered at once by sample_bootstrap_1d
+BOOTSTRAP_BLOCK_BYTES = 2**27
+
 # Note: Using default RNG will not give exactly reproducible output
 DEFAULT_RNG = default_rng()
 
@@ -19,31 +22,43 @@ def bootstrap_finalize_Nd(samples, axis=None):
     return mean(samples, axis=axis), std(samples, axis=axis)
 
 
-def basic_bootstrap(values, rng=DEFAULT_RNG):
+def bootstrap_resample(values, rng=DEFAULT_RNG):
+    """
+    All bootstrap resamplings of a 1D array, one per row.
+
+    Draws the same indices as BOOTSTRAP_SAMPLE_COUNT successive calls to
+    rng.choice(values, len(values)).
+    """
     values = asarray(values)
-    samples = []
-    for _ in range(BOOTSTRAP_SAMPLE_COUNT):
-        samples.append(mean(rng.choice(values, len(values))))
-    return bootstrap_finalize(samples)
+    return values[rng.integers(len(values), size=(BOOTSTRAP_SAMPLE_COUNT, len(values)))]
+
+
+def basic_bootstrap(values, rng=DEFAULT_RNG):
+    return bootstrap_finalize(bootstrap_resample(values, rng).mean(axis=1))
 
 
 def bootstrap_susceptibility(values, rng=DEFAULT_RNG):
-    values = asarray(values)
-    samples = []
-    for _ in range(BOOTSTRAP_SAMPLE_COUNT):
-        current_sample = rng.choice(values, len(values))
-        samples.append(mean(current_sample**2) - mean(current_sample) ** 2)
-    return bootstrap_finalize(samples)
+    current_samples = bootstrap_resample(values, rng)
+    return bootstrap_finalize(
+        mean(current_samples**2, axis=1) - mean(current_samples, axis=1) ** 2
+    )
 
 
-def sample_bootstrap_1d(values, rng=DEFAULT_RNG):
+def sample_bootstrap_1d(values, rng=DEFAULT_RNG, block_bytes=BOOTSTRAP_BLOCK_BYTES):
     values = asarray(values)
     bootstrap_sample_configurations = rng.integers(
         values.shape[0], size=(BOOTSTRAP_SAMPLE_COUNT, values.shape[0])
     )
-    bootstrap_samples = empty((BOOTSTRAP_SAMPLE_COUNT, values.shape[1]))
-    for t_index in range(values.shape[1]):
-        bootstrap_samples[:, t_index] = values[
-            bootstrap_sample_configurations, t_index
-        ].mean(axis=1)
-    return asarray(bootstrap_samples)
+    # One row per time slice, so that each mean is over a contiguous axis
+    # and sums in the same order as averaging one time slice at a time
+    values_by_t = ascontiguousarray(values.T)
+    block_size = max(1, block_bytes // bootstrap_sample_configurations.size // 8)
+    bootstrap_samples = empty((values.shape[1], BOOTSTRAP_SAMPLE_COUNT))
+    for start in range(0, values.shape[1], block_size):
+        # take, unlike fancy indexing, gives a C-ordered result
+        bootstrap_samples[start : start + block_size] = take(
+            values_by_t[start : start + block_size],
+            bootstrap_sample_configurations,
+            axis=1,
+        ).mean(axis=-1)
+    return ascontiguousarray(bootstrap_samples.T)
@@ -0,0 +1,89 @@
+import math
+
+from mpmath import mp, mpf
+from lsdensities.core import A0_mp, Smatrix_mp
+from lsdensities.transform import y_combine_sample_Eslice_mp
+from lsdensities.utils.rhoMath import invert_matrix_ge
+from lsdensities.utils.rhoUtils import LogMessage
+
+from batched_hlt import ft_vector
+
+# Digits kept on top of log10 of the condition number
+GUARD_DIGITS = 10
+# Largest difference between the low and high precision rho that is
+# accepted, in units of its statistical error
+VERIFY_TOLERANCE = 1e-3
+
+
+def estimate_digits(par, corr, max_prec):
+    """
+    Lowest precision at which the HLT linear systems can be trusted.
+
+    S + factor * B is never worse conditioned than the worse of S and
+    Cov[C], so the digits lost in the inversion are bounded by the log10 of
+    the larger of the two condition numbers.
+    """
+    S_ = Smatrix_mp(
+        tmax_=par.tmax,
+        alpha_=0,
+        e0_=par.mpe0,
+        type=par.periodicity,
+        T=par.time_extent,
+    )
+    cond_S = mp.cond(S_)
+    cond_cov = mp.cond(corr.mpcov)
+    digits = math.ceil(float(mp.log10(max(cond_S, cond_cov)))) + GUARD_DIGITS
+    print(
+        LogMessage(),
+        "Adaptive precision ::: Cond[S] = {:3.3e}, Cond[Cov C] = {:3.3e},".format(
+            float(cond_S), float(cond_cov)
+        ),
+        "using {:d} of at most {:d} digits".format(min(digits, max_prec), max_prec),
+    )
+    return min(digits, max_prec)
+
+
+def rho_at_precision(par, corr, cNorm, estar, lambda_, digits):
+    """rho and its bootstrap error at a single (energy, lambda), at the given precision"""
+    with mp.workdps(digits):
+        S_ = Smatrix_mp(
+            tmax_=par.tmax,
+            alpha_=0,
+            e0_=par.mpe0,
+            type=par.periodicity,
+            T=par.time_extent,
+        )
+        A0 = A0_mp(
+            e_=mpf(str(estar)),
+            sigma_=par.mpsigma,
+            alpha=mpf(0),
+            e0=par.mpe0,
+            ker_type=par.kerneltype,
+        )
+        _Bnorm = cNorm / (estar * estar)
+        _factor = (lambda_ * A0) / _Bnorm
+        _g_t_estar = invert_matrix_ge(S_ + (_factor * corr.mpcov)) * ft_vector(
+            par, estar
+        )
+        return y_combine_sample_Eslice_mp(_g_t_estar, corr.mpsample, par)
+
+
+def precision_is_sufficient(par, corr, cNorm, estar, lambda_, digits, max_prec):
+    """Compare one solve at the reduced precision with the same solve at max_prec."""
+    if digits >= max_prec:
+        return True
+    rho_low, _ = rho_at_precision(par, corr, cNorm, estar, lambda_, digits)
+    rho_high, drho_high = rho_at_precision(par, corr, cNorm, estar, lambda_, max_prec)
+    difference = abs(rho_low - rho_high)
+    sufficient = difference <= VERIFY_TOLERANCE * abs(drho_high)
+    print(
+        LogMessage(),
+        "Adaptive precision ::: E = {:2.4f}, lambda = {:2.2e}:".format(
+            float(estar), float(lambda_)
+        ),
+        "|rho({:d}) - rho({:d})| = {:2.2e}, stat = {:2.2e}".format(
+            digits, max_prec, float(difference), float(drho_high)
+        ),
+        "accepted" if sufficient else "rejected",
+    )
+    return sufficient
@@ -1,12 +1,15 @@
 import datetime
 
-import read_hdf
-import read_hdf2
 import translate
+import resample_cache
+import adaptive_precision
+import result_cache
+import task_scheduler
+import parallel_hlt
+from correlator_store import CorrelatorStore
 import numpy as np
 import csv
 import multiprocess
-import lsdensities.utils.rhoUtils as u
 from lsdensities.utils.rhoUtils import (
     init_precision,
     LogMessage,
@@ -16,28 +19,24 @@ from lsdensities.utils.rhoUtils import (
 )
 from lsdensities.utils.rhoParser import parseArgumentRhoFromData
 from lsdensities.utils.rhoUtils import create_out_paths
-from lsdensities.correlator.correlatorUtils import symmetrisePeriodicCorrelator
-from lsdensities.utils.rhoParallelUtils import ParallelBootstrapLoop
 import os
 from mpmath import mp, mpf
 import numpy as np
-from lsdensities.InverseProblemWrapper import AlgorithmParameters, InverseProblemWrapper
+from lsdensities.InverseProblemWrapper import AlgorithmParameters
 from lsdensities.utils.rhoUtils import MatrixBundle
 import random
+import shutil
+
+# HLT settings of process_channel, also used to estimate the cost of each task
+NBOOT = 300
+PREC = 105
+# Run at the lowest precision the conditioning allows, up to PREC
+ADAPTIVE_PREC = True
 
 
 def main():
     multiprocess.set_start_method("fork")
 
-    def get_directory_size(directory):
-        total_size = 0
-        for dirpath, dirnames, filenames in os.walk(directory):
-            for filename in filenames:
-                filepath = os.path.join(dirpath, filename)
-                if os.path.isfile(filepath):
-                    total_size += os.path.getsize(filepath)
-        return total_size
-
     def init_variables(
         datapath,
         outdir,
@@ -92,6 +91,9 @@ def main():
         Na,
         A0cut,
         mpi,
+        hltParams,
+        adaptive_prec=False,
+        energy_workers=1,
     ):
         print(LogMessage(), "Initialising")
         # args = parseArgumentRhoFromData()
@@ -118,81 +120,61 @@ def main():
         np.random.seed(random.randint(0, 2 ** (32) - 1))
 
         #   Reading datafile, storing correlator
-        rawcorr, par.time_extent, par.num_samples = u.read_datafile(par.datapath)
+        rawcorr, par.time_extent, par.num_samples = translate.read_datafile(
+            par.datapath
+        )
         par.tmax = int(par.time_extent / 2)
         par.assign_values()
         par.report()
         par.plotpath, par.logpath = create_out_paths(par)
 
-        #   Correlator
-        rawcorr.evaluate()
-        rawcorr.tmax = par.tmax
-        if par.periodicity == "COSH":
-            print(LogMessage(), "Folding correlator")
-            symCorr = symmetrisePeriodicCorrelator(corr=rawcorr, par=par)
-            symCorr.evaluate()
-
-        #   Resampling
-        if par.periodicity == "EXP":
-            corr = u.Obs(
-                T=par.time_extent, tmax=par.tmax, nms=par.num_boot, is_resampled=True
-            )
-            resample = ParallelBootstrapLoop(par, rawcorr.sample, is_folded=False)
-        if par.periodicity == "COSH":
-            corr = u.Obs(
-                T=symCorr.T,
-                tmax=symCorr.tmax,
-                nms=par.num_boot,
-                is_resampled=True,
-            )
-            resample = ParallelBootstrapLoop(par, symCorr.sample, is_folded=False)
-
-        corr.sample = resample.run()
-        corr.evaluate()
-        #   -   -   -   -   -   -   -   -   -   -   -
-
-        #   Covariance
-        print(LogMessage(), "Evaluate covariance")
-        corr.evaluate_covmatrix(plot=False)
-        corr.corrmat_from_covmat(plot=False)
+        #   Correlator: folded, resampled, with its covariance and mpmath
+        #   matrices, shared with printSamples through the cache
+        corr = resample_cache.get_resampled_correlator(par, rawcorr, seed)
         with open(os.path.join(par.logpath, "covarianceMatrix.txt"), "w") as output:
             for i in range(par.time_extent):
                 for j in range(par.time_extent):
                     print(i, j, corr.cov[i, j], file=output)
-        #   -   -   -   -   -   -   -   -   -   -   -
-
-        #   Turn correlator into mpmath variable
-        print(LogMessage(), "Converting correlator into mpmath type")
-        corr.fill_mp_sample()
         print(LogMessage(), "Cond[Cov C] = {:3.3e}".format(float(mp.cond(corr.mpcov))))
 
         #   Prepare
         cNorm = mpf(str(corr.central[1] ** 2))
-        lambdaMax = 1e0
         energies = np.linspace(par.emin, par.emax, par.Ne)
 
-        hltParams = AlgorithmParameters(
-            alphaA=0,
-            alphaB=1 / 2,
-            alphaC=+1.99,
-            lambdaMax=lambdaMax,
-            lambdaStep=lambdaMax / 2,
-            lambdaScanCap=8,
-            kfactor=0.1,
-            lambdaMin=5e-2,
-            comparisonRatio=0.3,
-        )
         matrix_bundle = MatrixBundle(Bmatrix=corr.mpcov, bnorm=cNorm)
 
-        HLT = InverseProblemWrapper(
-            par=par,
-            algorithmPar=hltParams,
-            matrix_bundle=matrix_bundle,
-            correlator=corr,
-            energies=energies,
-        )
-        HLT.prepareHLT()
-        HLT.run()
+        def run_HLT():
+            HLT = parallel_hlt.ParallelInverseProblemWrapper(
+                par=par,
+                algorithmPar=hltParams,
+                matrix_bundle=matrix_bundle,
+                correlator=corr,
+                energies=energies,
+                workers=energy_workers,
+            )
+            HLT.prepareHLT()
+            HLT.run()
+            return HLT
+
+        if adaptive_prec:
+            digits = adaptive_precision.estimate_digits(par, corr, prec)
+            init_precision(digits)
+        HLT = run_HLT()
+        if adaptive_prec:
+            # Check the smallest lambda, where S + factor * B is closest to S
+            e_i = int(np.argmin(HLT.lambdaResultHLT))
+            if not adaptive_precision.precision_is_sufficient(
+                par,
+                corr,
+                cNorm,
+                HLT.espace[e_i],
+                HLT.lambdaResultHLT[e_i],
+                digits,
+                prec,
+            ):
+                print(LogMessage(), f"Falling back to {prec} digits")
+                init_precision(prec)
+                HLT = run_HLT()
         """
         HLT.stabilityPlot(
             generateHLTscan=True,
@@ -278,37 +260,13 @@ def main():
         for ensemble in ensembles
     ]
 
-    def process_channel(
-        channel, k, index, rep, ensemble, kernel, matrix_4D, roots, file_path
-    ):
+    def process_channel(channel, k, index, rep, ensemble, kernel, matrix_4D):
         if rep == "fund":
             Nsource = matrix_4D[index][4][k]
             Nsink = matrix_4D[index][5][k]
         else:
             Nsource = matrix_4D[index][4][k + 6]
             Nsink = matrix_4D[index][5][k + 6]
-        group_prefixes = {
-            "gi": ["g1", "g2", "g3"],
-            "g0gi": ["g0g1", "g0g2", "g0g3"],
-            "g5gi": ["g5g1", "g5g2", "g5g3"],
-            "g0g5gi": ["g0g5g1", "g0g5g2", "g0g5g3"],
-        }
-        prefix = group_prefixes.get(channel, [channel])
-        datasets = []
-        dataset_path = f"{roots[index]}/source_N{Nsource}_sink_N{Nsink}/{channel}_re"
-        group1 = f"source_N{Nsource}_sink_N{Nsink}"
-        group2 = f"{channel}_re"
-        datasets.append(
-            read_hdf2.extract_dataset(file_path, group2, roots[index], group1)
-        )
-        with open("paths.log", "a") as file:
-            print(dataset_path, file=file)
-        dataset = sum(datasets) / len(datasets) if datasets else None
-
-        if dataset is not None:
-            translate.save_matrix_to_file2(
-                dataset, f"corr_to_analyse_{channel}_{rep}_{ensemble}.txt"
-            )
         mpi = matrix_4D[index][1][k]
         if kernel == "HALFNORMGAUSS":
             if rep == "fund":
@@ -324,61 +282,54 @@ def main():
         sigma = tmp
         decimal_part = tmp / matrix_4D[index][1][k] % 1
         decimal_as_int = int(decimal_part * 100)
-        datapath = f"./corr_to_analyse_{channel}_{rep}_{ensemble}.txt"
-        outdir = f"./{ensemble}_{channel}_s0p{decimal_as_int}_{kernel}_Nsource{Nsource}_Nsink{Nsink}"
+        datapath = f"./corr_to_analyse_{channel}_{rep}_{ensemble}.npy"
+        outdir = f"./{ensemble}_{rep}_{channel}_s0p{decimal_as_int}_{kernel}_Nsource{Nsource}_Nsink{Nsink}"
+        lambdaMax = 1e0
+        hltParams = AlgorithmParameters(
+            alphaA=0,
+            alphaB=1 / 2,
+            alphaC=+1.99,
+            lambdaMax=lambdaMax,
+            lambdaStep=lambdaMax / 2,
+            lambdaScanCap=8,
+            kfactor=0.1,
+            lambdaMin=5e-2,
+            comparisonRatio=0.3,
+        )
         ne = 12
         emin = 0.3
         emax = 2.4
         periodicity = "COSH"
-        prec = 105
-        nboot = 300
+        prec = PREC
+        adaptive_prec = ADAPTIVE_PREC
+        nboot = NBOOT
         e0 = 0.0
         Na = 1
         A0cut = 0.1
-        current_directory = os.getcwd()  # Get the current working directory
-        subdirectory_path = os.path.join(
-            current_directory, outdir
-        )  # Create the full path to the subdirectory
-
-        if os.path.isdir(subdirectory_path):
-            directory_size = get_directory_size(subdirectory_path)
-            size_in_megabytes = directory_size / (
-                1024 * 1024
-            )  # Convert bytes to megabytes
-            print(f"Size of the subdirectory '{outdir}': {size_in_megabytes:.2f} MB")
-            if size_in_megabytes >= 0.285:
-                print(
-                    f"The subdirectory '{outdir}' exists and its size is at least 0.285 MB."
-                )
-            else:
-                print(
-                    f"The subdirectory '{outdir}' does not exist or its size is less than 0.285 MB."
-                )
-                findRho(
-                    datapath,
-                    outdir,
-                    ne,
-                    emin,
-                    emax,
-                    periodicity,
-                    kernel,
-                    sigma,
-                    prec,
-                    nboot,
-                    e0,
-                    Na,
-                    A0cut,
-                    mpi,
-                )
+        key, description = result_cache.result_key(
+            datapath,
+            hltParams,
+            ne=ne,
+            emin=emin,
+            emax=emax,
+            periodicity=periodicity,
+            kernel=kernel,
+            sigma=sigma,
+            prec=prec,
+            adaptive_prec=adaptive_prec,
+            nboot=nboot,
+            e0=e0,
+            Na=Na,
+            A0cut=A0cut,
+            mpi=mpi,
+        )
+        if result_cache.is_cached(outdir, key):
+            print(f"Reusing the HLT result cached in '{outdir}'")
         else:
-            print(
-                f"The subdirectory '{outdir}' does not exist or its size is less than 0.285 MB."
-            )
-            directory_size = get_directory_size(subdirectory_path)
-            size_in_megabytes = directory_size / (
-                1024 * 1024
-            )  # Convert bytes to megabytes
-            print(f"Size of the subdirectory '{outdir}': {size_in_megabytes:.2f} MB")
+            if os.path.isdir(outdir):
+                # Partial, or produced with other inputs or parameters
+                print(f"Removing stale results in '{outdir}'")
+                shutil.rmtree(outdir)
             findRho(
                 datapath,
                 outdir,
@@ -394,7 +345,11 @@ def main():
                 Na,
                 A0cut,
                 mpi,
+                hltParams,
+                adaptive_prec=adaptive_prec,
+                energy_workers=energy_workers,
             )
+            result_cache.write_manifest(outdir, key, description)
 
     def get_cpu_count():
         try:
@@ -404,64 +359,59 @@ def main():
 
     def wrapper(args):
         # Unpack the arguments tuple
-        channel, k, index, rep, ensemble, kernel, matrix_4D, roots, file_path = args
-        return process_channel(
-            channel, k, index, rep, ensemble, kernel, matrix_4D, roots, file_path
-        )
+        channel, k, index, rep, ensemble, kernel, matrix_4D = args
+        return process_channel(channel, k, index, rep, ensemble, kernel, matrix_4D)
 
     ################# Download and use lsdensities on correlators ########################
     # Replace 'your_file.h5' with the path to your HDF5 file
     file_path = "../input_correlators/chimera_data_reduced.h5"
     # rep = reps[0]
+    store = CorrelatorStore(file_path, ensembles, roots)
+    # Each correlator is written once; process_channel reads it back for
+    # every kernel
+    for index, ensemble in enumerate(ensembles):
+        for rep in reps:
+            for k, channel in enumerate(mesonic_channels):
+                if rep == "fund":
+                    Nsource = matrix_4D[index][4][k]
+                    Nsink = matrix_4D[index][5][k]
+                else:
+                    Nsource = matrix_4D[index][4][k + 6]
+                    Nsink = matrix_4D[index][5][k + 6]
+                dataset = store.get(ensemble, rep, channel, Nsource, Nsink)
+                if dataset is not None:
+                    translate.save_matrix_to_npy(
+                        dataset, f"corr_to_analyse_{channel}_{rep}_{ensemble}.npy"
+                    )
+    store.close()
+
+    tasks, costs, labels = [], [], []
+    # All kernels are scheduled together, once the correlators are written
     for kernel in kerneltype:
         for index, ensemble in enumerate(ensembles):
             for rep in reps:
                 for k, channel in enumerate(mesonic_channels):
-                    if rep == "fund":
-                        Nsource = matrix_4D[index][4][k]
-                        Nsink = matrix_4D[index][5][k]
-                    else:
-                        Nsource = matrix_4D[index][4][k + 6]
-                        Nsink = matrix_4D[index][5][k + 6]
-                    group_prefixes = {
-                        "gi": ["g1", "g2", "g3"],
-                        "g0gi": ["g0g1", "g0g2", "g0g3"],
-                        "g5gi": ["g5g1", "g5g2", "g5g3"],
-                        "g0g5gi": ["g0g5g1", "g0g5g2", "g0g5g3"],
-                    }
-                    prefix = group_prefixes.get(channel, [channel])
-                    datasets = []
-                    dataset_path = (
-                        f"{roots[index]}/source_N{Nsource}_sink_N{Nsink}/{channel}_re"
-                    )
-                    group1 = f"source_N{Nsource}_sink_N{Nsink}"
-                    group2 = f"{channel}_re"
-                    datasets.append(
-                        read_hdf2.extract_dataset(
-                            file_path, group2, roots[index], group1
+                    tasks.append((channel, k, index, rep, ensemble, kernel, matrix_4D))
+                    costs.append(
+                        task_scheduler.estimate_cost(
+                            task_scheduler.time_extent(roots[index]),
+                            nboot=NBOOT,
+                            prec=PREC,
+                            adaptive_prec=ADAPTIVE_PREC,
                         )
                     )
-                    with open("paths.log", "a") as file:
-                        print(dataset_path, file=file)
-                    dataset = sum(datasets) / len(datasets) if datasets else None
-
-                    if dataset is not None:
-                        translate.save_matrix_to_file2(
-                            dataset, f"corr_to_analyse_{channel}_{rep}_{ensemble}.txt"
-                        )
-
-    for kernel in kerneltype:
-        # Prepare argument list
-        task_args = [
-            (channel, k, index, rep, ensemble, kernel, matrix_4D, roots, file_path)
-            for index, ensemble in enumerate(ensembles)
-            for rep in reps
-            for k, channel in enumerate(mesonic_channels)
-        ]
+                    labels.append(f"{ensemble} {rep} {channel} {kernel}")
 
-        num_workers = get_cpu_count()
-        with multiprocess.Pool(processes=num_workers) as pool:
-            pool.map(wrapper, task_args)
+    # Cores left idle by the channel pool, e.g. when rerunning a single
+    # channel, go to the energies of each findRho
+    energy_workers = parallel_hlt.energy_workers(get_cpu_count(), len(tasks))
+    task_scheduler.run_longest_first(
+        wrapper,
+        tasks,
+        costs,
+        labels,
+        processes=min(get_cpu_count(), len(tasks)),
+    )
 
     # Avoid needing to work out the full tangle of output files,
     # while still allowing a workflow dependency on completing this rule
@@ -0,0 +1,126 @@
+import os
+import time
+
+import numpy as np
+from mpmath import mp, mpf
+from lsdensities.core import ft_mp
+from lsdensities.utils.rhoStat import averageScalar_mp
+from lsdensities.utils.rhoUtils import LogMessage
+
+
+def ft_vector(par, estar, alpha=0):
+    """Kernel coefficients f_t(E*) for t = 1, ..., tmax."""
+    ft = mp.matrix(par.tmax, 1)
+    for t in range(par.tmax):
+        ft[t] = ft_mp(
+            e=estar,
+            t=mpf(t + 1),
+            sigma_=par.mpsigma,
+            alpha=mpf(alpha),
+            e0=par.mpe0,
+            type=par.periodicity,
+            T=par.time_extent,
+            ker_type=par.kerneltype,
+        )
+    return ft
+
+
+def dot(v, w):
+    return mp.fsum(v[i] * w[i] for i in range(v.rows))
+
+
+class ShiftedInverse:
+    """
+    Solves (S + factor * B) g = f for many values of factor.
+
+    With B = L L^T and L^-1 S L^-T = Q D Q^T, the matrix to invert is
+    L Q (D + factor) Q^T L^T. The Cholesky factorisation and the symmetric
+    eigendecomposition are done once, after which each solve is O(tmax^2)
+    instead of a fresh Gauss-Jordan inversion.
+    """
+
+    def __init__(self, S, B):
+        start_time = time.time()
+        L = mp.cholesky(B)
+        Linv = mp.inverse(L)
+        A = Linv * S * Linv.T
+        # Restore the exact symmetry lost to rounding
+        A = (A + A.T) / 2
+        self.eigenvalues, Q = mp.eigsy(A)
+        self.W = Linv.T * Q
+        print(
+            LogMessage(),
+            "Time ::: S + factor B factorised in {:4.4f}".format(
+                time.time() - start_time
+            ),
+            "s",
+        )
+
+    def solve(self, factor, f):
+        y = self.W.T * f
+        for i in range(y.rows):
+            y[i] = y[i] / (self.eigenvalues[i] + factor)
+        return self.W * y
+
+
+def y_combine_sample_Eslice(ht_sliced, mpmatrix, par):
+    """
+    Bootstrap samples of rho at one energy, sum_t g_t C_b(t) for each b.
+
+    The same mpmath sums as lsdensities' y_combine_sample_Eslice_mp_ToFile,
+    which in addition writes every sample to a text file.
+    """
+    rhob = mp.matrix(par.num_boot, 1)
+    for b in range(par.num_boot):
+        y = mpmatrix[b, :]
+        rhob[b] = 0
+        for i in range(par.tmax):
+            rhob[b] = mp.fadd(rhob[b], mp.fmul(ht_sliced[i], y[i]))
+    return rhob
+
+
+def write_sample_text(fpath, rhob):
+    """The lsdensitiesamplesE<E>sig<sigma> layout, one "<b> <rho>" line each."""
+    with open(fpath, "w") as output:
+        for b in range(rhob.rows):
+            print(b, float(rhob[b]), file=output)
+
+
+def lambda_to_rho_all_energies(
+    par, corr, S, A0set, cNorm, energies, lambdas, text_samples=True
+):
+    """
+    HLT coefficients and bootstrap samples of rho for every energy.
+
+    Everything that does not depend on the energy (S, the covariance, and
+    their joint factorisation) is built once. Returns rho, its bootstrap
+    error and the (nboot, n_energy) samples; with text_samples, the samples
+    of each energy are also written to lsdensitiesamplesE<E>sig<sigma> in
+    par.logpath, as before.
+    """
+    shifted_inverse = ShiftedInverse(S, corr.mpcov)
+    rho = np.zeros(len(energies))
+    drho = np.zeros(len(energies))
+    samples = np.zeros((par.num_boot, len(energies)))
+    for _e, estar_ in enumerate(energies):
+        fname = "lsdensitiesamplesE" + str(estar_) + "sig" + str(par.sigma)
+        fpath = os.path.join(par.logpath, fname)
+        _Bnorm = cNorm / (estar_ * estar_)
+        _factor = (lambdas[_e] * A0set[_e]) / _Bnorm
+
+        ft = ft_vector(par, estar_)
+        _g_t_estar = shifted_inverse.solve(_factor, ft)
+        rhob = y_combine_sample_Eslice(_g_t_estar, corr.mpsample, par)
+        if text_samples:
+            write_sample_text(fpath, rhob)
+        samples[:, _e] = [float(rhob[b]) for b in range(par.num_boot)]
+        rho[_e], drho[_e] = averageScalar_mp(rhob)
+
+        #   A = g^T S g - 2 g^T f + A0
+        gag_estar = dot(_g_t_estar, S * _g_t_estar) - 2 * dot(_g_t_estar, ft)
+        gag_estar += A0set[_e]
+        gBg_estar = dot(_g_t_estar, corr.mpcov * _g_t_estar) / _Bnorm
+
+        print(LogMessage(), "\t \t  B / Bnorm = ", float(gBg_estar))
+        print(LogMessage(), "\t \t  A / A0 = ", float(gag_estar / A0set[_e]))
+    return rho, drho, samples
@@ -0,0 +1,78 @@
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import lsdensities.utils.rhoUtils as u
+import translate
+from correlator_store import CorrelatorStore
+
+# Compare the text and binary hand-off between the HDF5 extraction and findRho,
+# on the M3 (T=96) correlators.
+# Usage (from lsd_out): python benchmark_correlator_io.py [--max_datasets N]
+
+M3_ROOT = "chimera_out_96x20x20x20nc4nf2nas3b6.5mf0.71mas1.01_APE0.4N50_smf0.2as0.12_s1"
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Benchmark text vs .npy correlator files"
+    )
+    parser.add_argument(
+        "--h5_file",
+        default="../input_correlators/chimera_data_reduced.h5",
+        help="HDF5 file containing the correlators",
+    )
+    parser.add_argument(
+        "--max_datasets",
+        type=int,
+        default=None,
+        help="Only use the first N M3 datasets",
+    )
+    return parser.parse_args()
+
+
+def time_round_trip(datasets, directory, extension, write, read):
+    bytes_on_disk = 0
+    start_time = time.perf_counter()
+    for index, dataset in enumerate(datasets):
+        write(dataset, os.path.join(directory, f"corr_{index}.{extension}"))
+    write_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
+    for index, dataset in enumerate(datasets):
+        datapath = os.path.join(directory, f"corr_{index}.{extension}")
+        corr, _, _ = read(datapath)
+        # Touch every element, so that memory-mapped reads are not deferred
+        if not np.array_equal(corr.sample, dataset.T):
+            print(f"Round trip mismatch for {datapath} ({extension})")
+        bytes_on_disk += os.path.getsize(datapath)
+    read_time = time.perf_counter() - start_time
+    return write_time, read_time, bytes_on_disk
+
+
+def main():
+    args = get_args()
+    with CorrelatorStore(args.h5_file, ["M3"], [M3_ROOT], log_path=os.devnull) as store:
+        paths = sorted(store.index.values())[: args.max_datasets]
+        datasets = [store._read(path) for path in paths]
+    print(f"{len(datasets)} M3 correlators of shape {datasets[0].shape}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for extension, write, read in [
+            ("txt", translate.save_matrix_to_file2, u.read_datafile),
+            ("npy", translate.save_matrix_to_npy, translate.read_datafile),
+        ]:
+            write_time, read_time, bytes_on_disk = time_round_trip(
+                datasets, directory, extension, write, read
+            )
+            print(
+                f"{extension}: write {write_time:.3f} s, read {read_time:.3f} s, "
+                f"{bytes_on_disk / (1024 * 1024):.2f} MB on disk"
+            )
+
+
+if __name__ == "__main__":
+    main()
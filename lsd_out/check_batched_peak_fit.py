@@ -0,0 +1,99 @@
+import argparse
+import time
+
+import numpy as np
+from lmfit import Minimizer, Parameters
+
+import peak_fitting
+
+# Compare peak_fitting.fit_bootstraps (BATCHED_FIT = True in fit_data_*.py)
+# with the per-bootstrap lmfit fits it replaces, on a synthetic two-peak
+# spectral density with correlated noise.
+# Usage (from lsd_out): python check_batched_peak_fit.py [--cauchy]
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Compare batched and per-bootstrap lmfit peak fits"
+    )
+    parser.add_argument("--nboot", type=int, default=200)
+    parser.add_argument("--noise", type=float, default=0.02)
+    parser.add_argument("--cauchy", action="store_true")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.1,
+        help="Largest accepted difference of the bootstrap averages, in standard deviations",
+    )
+    return parser.parse_args()
+
+
+def synthetic_samples(x, sigma, cauchy, nboot, noise, rng):
+    """Bootstrap samples of two peaks at 1 and 1.8, with 50% correlated noise."""
+    rho = peak_fitting.peak_sum(x, [1.0, 0.6], [1.0, 1.8], sigma, cauchy)
+    distance = np.abs(x[:, None] - x[None, :])
+    cov = (noise * rho[:, None]) * (noise * rho[None, :]) * 0.5 ** (distance / 0.2)
+    return rho, rng.multivariate_normal(rho, cov, size=nboot), cov
+
+
+def starting_parameters():
+    # As fit_data_*.py sets them for a two-peak fit
+    params = Parameters()
+    params.add("amplitude_1", value=0.9, min=0.9 * 0.6, max=0.9 * 1.4)
+    params.add("mean_1", value=1.0, min=0.99, max=1.01)
+    params.add("amplitude_2", value=0.5, min=0.5 * 0.6, max=0.5 * 1.4)
+    params.add("mean_2", value=1.79, min=1.77, max=1.81)
+    return params
+
+
+def main():
+    args = get_args()
+    rng = np.random.default_rng(1)
+    x = np.linspace(0.6, 2.6, 14)
+    sigma = 0.3
+    n_peaks = 2
+    _, samples, cov = synthetic_samples(
+        x, sigma, args.cauchy, args.nboot, args.noise, rng
+    )
+    whitening_matrix = peak_fitting.whitening(np.linalg.cholesky(cov))
+    params = starting_parameters()
+    fcn_args = (whitening_matrix, n_peaks, sigma, args.cauchy)
+
+    start = time.perf_counter()
+    lmfit_values = {name: np.empty(args.nboot) for name in params}
+    for k, y in enumerate(samples):
+        result = Minimizer(
+            peak_fitting.correlated_residual, params, fcn_args=(x, y, *fcn_args)
+        ).minimize()
+        for name in params:
+            lmfit_values[name][k] = result.params[name].value
+    lmfit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batched_values, failed = peak_fitting.fit_bootstraps(params, x, samples, *fcn_args)
+    batched_time = time.perf_counter() - start
+    print(f"lmfit: {lmfit_time:.2f} s, batched: {batched_time:.2f} s")
+    print(f"{np.count_nonzero(failed)} batched fits failed")
+
+    disagreements = []
+    for name in params:
+        old, new = lmfit_values[name], batched_values[name]
+        std = max(old.std(), np.finfo(float).tiny)
+        shift = abs(new.mean() - old.mean()) / std
+        differing = np.count_nonzero(np.abs(new - old) > 1e-3 * std)
+        print(
+            f"{name:>12}: average shifted by {shift:.3f} sigma, "
+            f"std ratio {new.std() / std:.3f}, "
+            f"largest sample difference {np.abs(new - old).max() / std:.3f} sigma, "
+            f"{differing} samples differ"
+        )
+        if shift > args.tolerance or abs(new.std() / std - 1) > args.tolerance:
+            disagreements.append(name)
+
+    if disagreements:
+        raise ValueError(f"Fits disagree on {', '.join(disagreements)}.")
+    print("Fits agree.")
+
+
+if __name__ == "__main__":
+    main()
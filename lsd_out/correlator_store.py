@@ -0,0 +1,93 @@
+import re
+from functools import lru_cache
+
+import h5py
+
+# Channels stored as separate spatial components, averaged on extraction
+GROUP_PREFIXES = {
+    "gi": ["g1", "g2", "g3"],
+    "g0gi": ["g0g1", "g0g2", "g0g3"],
+    "g5gi": ["g5g1", "g5g2", "g5g3"],
+    "g0g5gi": ["g0g5g1", "g0g5g2", "g0g5g3"],
+}
+
+SMEARING_GROUP = re.compile(r"source_N(\d+)_sink_N(\d+)$")
+
+
+def dataset_names(rep, channel):
+    """Names of the datasets making up a channel, as stored in the HDF5 file."""
+    if channel.startswith("Chimera_"):
+        return [f"{channel}_re"]
+    return [f"{rep} TRIPLET {g}" for g in GROUP_PREFIXES.get(channel, [channel])]
+
+
+class CorrelatorStore:
+    """
+    Read-only access to chimera_data_reduced.h5.
+
+    The file is opened once, and the source_N*_sink_N* groups of each ensemble
+    root are indexed up front, so that a correlator can be requested by
+    (ensemble, rep, channel, Nsource, Nsink) without walking the file again.
+    Results are kept in an LRU cache, so the same correlator requested for
+    several kernels is only read and averaged once.
+    """
+
+    def __init__(self, file_path, ensembles, roots, log_path="paths.log", maxsize=256):
+        self.file_path = file_path
+        self.roots = dict(zip(ensembles, roots))
+        self.log_path = log_path
+        self.hdf_file = h5py.File(file_path, "r")
+        self.index = self._build_index()
+        self.get = lru_cache(maxsize=maxsize)(self._get)
+
+    def _build_index(self):
+        index = {}
+        for root in self.roots.values():
+            if root not in self.hdf_file:
+                print(f"Root {root} not found in {self.file_path}")
+                continue
+            for group_name, group in self.hdf_file[root].items():
+                match = SMEARING_GROUP.match(group_name)
+                if match is None or not isinstance(group, h5py.Group):
+                    continue
+                Nsource, Nsink = (int(N) for N in match.groups())
+                for name in group:
+                    index[root, Nsource, Nsink, name] = f"{root}/{group_name}/{name}"
+        return index
+
+    def _read(self, dataset_path):
+        dataset = self.hdf_file[dataset_path][()]
+        # Check if dataset is 3D (e.g., shape (1, 48, 527)) or 2D (e.g., shape (48, 873))
+        if len(dataset.shape) == 3 and dataset.shape[0] == 1:
+            # Reshape (1, 48, 527) to (48, 527)
+            dataset = dataset.reshape(dataset.shape[1], dataset.shape[2])
+        return dataset
+
+    def _get(self, ensemble, rep, channel, Nsource, Nsink):
+        root = self.roots[ensemble]
+        datasets = []
+        for name in dataset_names(rep, channel):
+            dataset_path = self.index.get((root, int(Nsource), int(Nsink), name))
+            if dataset_path is None:
+                print(
+                    f"Dataset {root}/source_N{Nsource}_sink_N{Nsink}/{name} "
+                    f"not found in {self.file_path}"
+                )
+                return None
+            datasets.append(self._read(dataset_path))
+            with open(self.log_path, "a") as file:
+                print(dataset_path, file=file)
+        dataset = sum(datasets) / len(datasets)
+        # Cached arrays are shared between callers
+        dataset.setflags(write=False)
+        return dataset
+
+    def close(self):
+        self.get.cache_clear()
+        self.hdf_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,102 @@
+import os
+from collections import namedtuple
+
+import h5py
+import numpy as np
+
+import peak_fitting
+
+# Percentiles of a one standard deviation interval
+ONE_SIGMA_PERCENTILES = (15.865525393145708, 84.13447460685429)
+
+Band = namedtuple("Band", ["mean", "std", "lower", "upper"])
+
+
+def band_statistics(curves, percentiles=ONE_SIGMA_PERCENTILES):
+    """
+    Spread of a set of bootstrap curves.
+
+    curves has the bootstrap samples along its first axis, e.g. (nboot, n_x)
+    or (nboot, n_peaks, n_x); every field of the returned Band has the
+    remaining shape.
+    """
+    curves = np.asarray(curves, dtype=float)
+    lower, upper = np.percentile(curves, percentiles, axis=0)
+    return Band(curves.mean(axis=0), curves.std(axis=0), lower, upper)
+
+
+def peak_bands(x, amplitudes, means, sigma, cauchy=False):
+    """
+    Bands of each fitted peak and of their sum.
+
+    amplitudes and means hold one row of fitted parameters per bootstrap,
+    with shape (nboot, n_peaks). All components are evaluated for all
+    bootstraps as a single (nboot, n_peaks, len(x)) array.
+    """
+    components = peak_fitting.peak_components(x, amplitudes, means, sigma, cauchy)
+    return band_statistics(components), band_statistics(components.sum(axis=1))
+
+
+def write_sidecar(
+    path,
+    output_name,
+    x_data,
+    rho,
+    drho,
+    x,
+    amplitudes,
+    means,
+    component_bands,
+    sum_band,
+    sigma,
+    cauchy=False,
+    title="",
+):
+    """
+    Store what is needed to draw a peak fit later, without matplotlib.
+
+    Holds the data points, and on the grid x the curve of each peak at the
+    averaged parameters (amplitudes, means) and of their sum, each with its
+    band of one bootstrap standard deviation. output_name is where the
+    renderer saves the figure.
+    """
+    components = peak_fitting.peak_components(x, amplitudes, means, sigma, cauchy)
+    total = components.sum(axis=0)
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with h5py.File(path, "w") as sidecar:
+        sidecar.attrs["output_name"] = output_name
+        sidecar.attrs["title"] = title
+        sidecar["data/x"] = x_data
+        sidecar["data/rho"] = rho
+        sidecar["data/drho"] = drho
+        sidecar["x"] = x
+        sidecar["components/central"] = components
+        sidecar["components/lower"] = components - component_bands.std
+        sidecar["components/upper"] = components + component_bands.std
+        sidecar["sum/central"] = total
+        sidecar["sum/lower"] = total - sum_band.std
+        sidecar["sum/upper"] = total + sum_band.std
+
+
+def read_sidecar(path):
+    """Contents of a file from write_sidecar, as a dictionary of arrays."""
+    with h5py.File(path, "r") as sidecar:
+        contents = {
+            name: sidecar[name][()]
+            for name in [
+                "data/x",
+                "data/rho",
+                "data/drho",
+                "x",
+                "components/central",
+                "components/lower",
+                "components/upper",
+                "sum/central",
+                "sum/lower",
+                "sum/upper",
+            ]
+        }
+        contents["output_name"] = sidecar.attrs["output_name"]
+        contents["title"] = sidecar.attrs["title"]
+    return contents
@@ -4,9 +4,11 @@ import datetime
 import sys
 import numpy as np
 import re
-import matplotlib.pyplot as plt
 import os
 from lmfit import Parameters, Minimizer
+import peak_fitting
+import fit_bands
+import sample_files
 from lsdensities.utils.rhoUtils import LogMessage
 import csv
 from scipy.optimize import curve_fit
@@ -15,7 +17,29 @@ import csv
 
 parser = argparse.ArgumentParser()
 parser.add_argument("--ensembles", nargs="+")
+parser.add_argument("--threads", type=int, default=1)
+plots = parser.add_mutually_exclusive_group()
+plots.add_argument(
+    "--no-plots", action="store_true", help="Only fit and write the CSV results"
+)
+plots.add_argument(
+    "--plots-later",
+    action="store_true",
+    help="Write the fit bands to HDF5 sidecars, to be drawn by render_fit_plots.py",
+)
 args = parser.parse_args()
+if args.no_plots:
+    plot_mode = "none"
+elif args.plots_later:
+    plot_mode = "later"
+else:
+    plot_mode = "now"
+
+# Fit all bootstraps at once with peak_fitting.fit_bootstraps, rather than
+# with one lmfit Minimizer per bootstrap. Off by default: single bootstraps can
+# settle in a different local minimum than with lmfit (see fit_bootstraps),
+# which changes the CSV results. check_batched_peak_fit.py compares the two.
+BATCHED_FIT = False
 
 # Plot x-limits
 plot_min_lim = 0.20
@@ -137,6 +161,9 @@ def perform_fit(
     nboot,
     fit_peaks_switch,
     matrix_2D,
+    old_k_peaks,
+    new_k_peaks,
+    plot_mode,
 ):
     ####################################################################################
     """
@@ -159,16 +186,6 @@ def perform_fit(
     def gaussian(x, amplitude, mean):
         return amplitude * np.exp(-((x - mean) ** 2) / (2 * sigma**2))
 
-    # Define the sum of two Gaussian functions
-    def double_gaussian(x, params):
-        amplitude_1 = params["amplitude_1"].value
-        mean_1 = params["mean_1"].value
-        amplitude_2 = params["amplitude_2"].value
-        mean_2 = params["mean_2"].value
-
-        model = gaussian(x, amplitude_1, mean_1) + gaussian(x, amplitude_2, mean_2)
-        return model
-
     def double_gaussian2(x, amplitude1, mean1, amplitude2, mean2):
         model = gaussian(x, amplitude1, mean1) + gaussian(x, amplitude2, mean2)
         return model
@@ -201,15 +218,6 @@ def perform_fit(
     def cauchy(x, amplitude, mean):
         return amplitude * (sigma / ((x - mean) ** 2 + sigma**2))
 
-    def double_cauchy(x, params):
-        amplitude_1 = params["amplitude_1"].value
-        mean_1 = params["mean_1"].value
-        amplitude_2 = params["amplitude_2"].value
-        mean_2 = params["mean_2"].value
-
-        model = cauchy(x, amplitude_1, mean_1) + cauchy(x, amplitude_2, mean_2)
-        return model
-
     def double_cauchy2(x, amplitude1, mean1, amplitude2, mean2):
         model = cauchy(x, amplitude1, mean1) + cauchy(x, amplitude2, mean2)
         return model
@@ -258,18 +266,8 @@ def perform_fit(
         LogMessage(),
         "##################################################################",
     )
-    # Get a list of all the file names in the directory
-    file_names = os.listdir(path)
-    file_names = sorted(
-        file_names, key=lambda x: float(x.split("E")[1].split("sig")[0])
-    )
-    # print(file_names)
-
-    # Extract the energy values from the file names
-    energies = [file_name.split("E")[1].split("sig")[0] for file_name in file_names]
-
-    # Sort the energies in ascending order
-    energies.sort()
+    # Bootstrap samples of rho, one column per energy in ascending order
+    energies, rho_resampled = sample_files.read_samples(path, nboot)
 
     # Define the dimensions of the matrix
     ne = len(energies)
@@ -285,19 +283,6 @@ def perform_fit(
     amplitude_vals4 = []
     mean_vals4 = []
 
-    # Create an empty matrix
-    rho_resampled = np.zeros((nboot, ne))
-    # print()
-    # Fill the matrix using the values from the files
-    for i, energy in enumerate(energies):
-        file_name = file_names[i]
-        file_path = os.path.join(path, file_name)
-        with open(file_path, "r") as file:
-            lines = file.readlines()
-            for j, line in enumerate(lines[:nboot]):
-                values = line.split()
-                rho_resampled[j, i] = float(values[1])
-
     rho_T = rho_resampled.T
     # Compute covariance matrix
     cov_matrix = np.cov(rho_T, bias=False)
@@ -349,6 +334,10 @@ def perform_fit(
                 np.sqrt(sigmavec[vi]) * np.sqrt(sigmavec[vj])
             )
 
+    if plot_mode == "now" or plot_cov_mat or plot_corr_mat:
+        # pyplot is only needed for inline figures; the other plot modes skip it
+        import matplotlib.pyplot as plt
+
     if plot_cov_mat:
         plt.imshow(cov_matrix, cmap="viridis")
         plt.colorbar()
@@ -364,22 +353,23 @@ def perform_fit(
     x = np.array(energies, dtype=float) / mpi
     rho_central = np.zeros(ne)
     drho_central = np.zeros(ne)
-    # Create a new figure with a specific size (width, height) in inches
-    fig = plt.figure(figsize=(7, 4.5))  # Width: 8 inches, Height: 6 inches
     for ei in range(ne):
         rho_central[ei] = rho_T[ei].mean()
     drho_central = np.sqrt(cov_matrix.diagonal())
-    # Plot the data
-    plt.errorbar(
-        x,
-        rho_central,
-        yerr=drho_central,
-        fmt="o",
-        color="black",
-        markersize=3.0,
-        label="Spectral density",
-        elinewidth=1.2,
-    )
+    if plot_mode == "now":
+        # Create a new figure with a specific size (width, height) in inches
+        fig = plt.figure(figsize=(7, 4.5))  # Width: 8 inches, Height: 6 inches
+        # Plot the data
+        plt.errorbar(
+            x,
+            rho_central,
+            yerr=drho_central,
+            fmt="o",
+            color="black",
+            markersize=3.0,
+            label="Spectral density",
+            elinewidth=1.2,
+        )
 
     x_range = np.linspace(min(x), max(x), 1000)
     # Rough Initial guesses for parameters
@@ -620,7 +610,8 @@ def perform_fit(
                 mean2_fit = matrix_2D[ensemble_num][1][channel_num]
 
     # print(params)
-    plt.draw()
+    if plot_mode == "now":
+        plt.draw()
 
     ##################### Fitting initial parameter guesses #############################
     if fit_peaks_switch == 0:
@@ -699,40 +690,6 @@ def perform_fit(
     #####################################################################################
 
     #######################################################################
-    def chisq_correlated(params, x, data, cov):
-        assert len(x) == len(data)
-
-        e0 = params["mean_1"]
-        e1 = params["mean_2"]
-        ampl_1 = params["amplitude_1"]
-        ampl_2 = params["amplitude_2"]
-        if triple_fit is True:
-            e2 = params["mean_3"]
-            ampl_3 = params["amplitude_3"]
-        if four_fit is True:
-            e3 = params["mean_4"]
-            ampl_4 = params["amplitude_4"]
-
-        cov_inv = np.linalg.inv(cov)
-
-        model = double_gaussian2(x, ampl_1, e0, ampl_2, e1)
-
-        if cauchy_fit is True:
-            model = double_cauchy2(x, ampl_1, e0, ampl_2, e1)
-
-        if triple_fit is True:
-            model = triple_gaussian2(x, ampl_1, e0, ampl_2, e1, ampl_3, e2)
-            if cauchy_fit is True:
-                model = triple_cauchy2(x, ampl_1, e0, ampl_2, e1, ampl_3, e2)
-        if four_fit is True:
-            model = four_gaussian2(x, ampl_1, e0, ampl_2, e1, ampl_3, e2, ampl_4, e3)
-            if cauchy_fit is True:
-                model = four_cauchy2(x, ampl_1, e0, ampl_2, e1, ampl_3, e2, ampl_4, e3)
-
-        diff = abs(data - model)
-        residual = cov_inv.dot(diff)
-        return residual
-
     def correlated_residual(amplitude1, mean1, amplitude2, mean2, x, data, cov):
         cov_inv = np.linalg.inv(cov)
         model = double_gaussian2(x, amplitude1, mean1, amplitude2, mean2)
@@ -789,75 +746,106 @@ def perform_fit(
         return residual
 
     choleskyCov = np.linalg.cholesky(cov_matrix)
+    # Fixed for every bootstrap: the residual is one matrix-vector product
+    whitening_matrix = peak_fitting.whitening(choleskyCov)
+    n_peaks = 4 if four_fit is True else 3 if triple_fit is True else 2
 
-    for k in range(nboot):
-        y = rho_resampled[k, :]
-
-        FITWrapper_corr = Minimizer(
-            chisq_correlated, params, fcn_args=(x, y, choleskyCov)
-        )
-        try:
-            result = FITWrapper_corr.minimize()
-            fe = False
-        except RuntimeError as e:
-            result = AltResult(initial_guess)
-            fe = True
-        except Exception as e:
-            result = AltResult(initial_guess)
-            fe = True
+    if BATCHED_FIT is True:
         # Generate the fitted curve
         x_fit = np.linspace(plot_min_lim, plot_max_lim, 1000)
-
-        double_gaussian(x_fit, result.params)
-        if cauchy_fit is True:
-            double_cauchy(x_fit, result.params)
-
-        # Plot the fitted curve
-        #        plt.plot(x_fit, y_fit, label='Fitted Curve', linewidth=1.3, color='red', alpha=0.2)
-
-        amplitude_vals1.append(float(result.params["amplitude_1"]))
-        mean_vals1.append(float(result.params["mean_1"]))
-        amplitude_vals2.append(float(result.params["amplitude_2"]))
-        mean_vals2.append(float(result.params["mean_2"]))
-
+        fitted, failed = peak_fitting.fit_bootstraps(
+            params,
+            x,
+            rho_resampled,
+            whitening_matrix,
+            n_peaks,
+            sigma,
+            cauchy_fit,
+        )
+        # Failed fits keep the initial guess in params; as in the loop below,
+        # fe reports the fit of the last bootstrap
+        fe = bool(failed[-1])
+        amplitude_vals1 = list(fitted["amplitude_1"])
+        mean_vals1 = list(fitted["mean_1"])
+        amplitude_vals2 = list(fitted["amplitude_2"])
+        mean_vals2 = list(fitted["mean_2"])
         if triple_fit is True:
-            amplitude_vals3.append(float(result.params["amplitude_3"]))
-            mean_vals3.append(float(result.params["mean_3"]))
-
+            amplitude_vals3 = list(fitted["amplitude_3"])
+            mean_vals3 = list(fitted["mean_3"])
         if four_fit is True:
-            amplitude_vals4.append(float(result.params["amplitude_4"]))
-            mean_vals4.append(float(result.params["mean_4"]))
-
-        print(LogMessage(), "#############################")
-        if fit_peaks_switch == 0:
-            print(
-                LogMessage(),
-                f"Ens: {ensemble}, Repr: {rep}, Channel: {channel}, Kernel: {kernel}, No. Peaks: {old_k_peaks}, Bootstrap Fit number:",
-                k,
-                f"/ {nboot} done.",
-            )
-        elif fit_peaks_switch == 1:
-            print(
-                LogMessage(),
-                f"Ens: {ensemble}, Channel: {channel}, Kernel: {kernel}, No. Peaks: {new_k_peaks}, Bootstrap Fit number:",
-                k,
-                f"/{nboot} done.",
+            amplitude_vals4 = list(fitted["amplitude_4"])
+            mean_vals4 = list(fitted["mean_4"])
+        print(
+            LogMessage(),
+            f"Ens: {ensemble}, Repr: {rep}, Channel: {channel}, Kernel: {kernel}, {nboot} bootstrap fits done.",
+        )
+    else:
+        for k in range(nboot):
+            y = rho_resampled[k, :]
+
+            FITWrapper_corr = Minimizer(
+                peak_fitting.correlated_residual,
+                params,
+                fcn_args=(x, y, whitening_matrix, n_peaks, sigma, cauchy_fit),
             )
-        """
-        print(LogMessage(), "Amplitude_1: ", float(result.params["amplitude_1"]))
-        print(LogMessage(), "Mean_1: ", float(result.params["mean_1"]))
-        print(LogMessage(), "Amplitude_2: ", float(result.params["amplitude_2"]))
-        print(LogMessage(), "Mean_2: ", float(result.params["mean_2"]))
+            try:
+                result = FITWrapper_corr.minimize()
+                fe = False
+            except RuntimeError as e:
+                result = AltResult(initial_guess)
+                fe = True
+            except Exception as e:
+                result = AltResult(initial_guess)
+                fe = True
+            # Generate the fitted curve
+            x_fit = np.linspace(plot_min_lim, plot_max_lim, 1000)
+
+            # Plot the fitted curve
+            #        plt.plot(x_fit, y_fit, label='Fitted Curve', linewidth=1.3, color='red', alpha=0.2)
+
+            amplitude_vals1.append(float(result.params["amplitude_1"]))
+            mean_vals1.append(float(result.params["mean_1"]))
+            amplitude_vals2.append(float(result.params["amplitude_2"]))
+            mean_vals2.append(float(result.params["mean_2"]))
+
+            if triple_fit is True:
+                amplitude_vals3.append(float(result.params["amplitude_3"]))
+                mean_vals3.append(float(result.params["mean_3"]))
 
-        if triple_fit is True:
-            print(LogMessage(), "Amplitude_3: ", float(result.params["amplitude_3"]))
-            print(LogMessage(), "Mean_3: ", float(result.params["mean_3"]))
+            if four_fit is True:
+                amplitude_vals4.append(float(result.params["amplitude_4"]))
+                mean_vals4.append(float(result.params["mean_4"]))
+
+            print(LogMessage(), "#############################")
+            if fit_peaks_switch == 0:
+                print(
+                    LogMessage(),
+                    f"Ens: {ensemble}, Repr: {rep}, Channel: {channel}, Kernel: {kernel}, No. Peaks: {old_k_peaks}, Bootstrap Fit number:",
+                    k,
+                    f"/ {nboot} done.",
+                )
+            elif fit_peaks_switch == 1:
+                print(
+                    LogMessage(),
+                    f"Ens: {ensemble}, Channel: {channel}, Kernel: {kernel}, No. Peaks: {new_k_peaks}, Bootstrap Fit number:",
+                    k,
+                    f"/{nboot} done.",
+                )
+            """
+            print(LogMessage(), "Amplitude_1: ", float(result.params["amplitude_1"]))
+            print(LogMessage(), "Mean_1: ", float(result.params["mean_1"]))
+            print(LogMessage(), "Amplitude_2: ", float(result.params["amplitude_2"]))
+            print(LogMessage(), "Mean_2: ", float(result.params["mean_2"]))
 
-        if four_fit is True:
-            print(LogMessage(), "Amplitude_4: ", float(result.params["amplitude_4"]))
-            print(LogMessage(), "Mean_4: ", float(result.params["mean_4"]))
-        """
-        # print(LogMessage(), "#############################")
+            if triple_fit is True:
+                print(LogMessage(), "Amplitude_3: ", float(result.params["amplitude_3"]))
+                print(LogMessage(), "Mean_3: ", float(result.params["mean_3"]))
+
+            if four_fit is True:
+                print(LogMessage(), "Amplitude_4: ", float(result.params["amplitude_4"]))
+                print(LogMessage(), "Mean_4: ", float(result.params["mean_4"]))
+            """
+            # print(LogMessage(), "#############################")
     if fe is True:
         dmean1 = 0.008 * np.average(mean_vals1)
         dmean2 = 0.02 * np.average(mean_vals2)
@@ -892,118 +880,99 @@ def perform_fit(
         mean4 = np.average(mean_vals4)
         dmean4 = 0.75 * np.std(mean_vals4)
 
-    y_gaussian_1 = [[0] * len(x_fit) for _ in range(nboot)]
-    y_gaussian_2 = [[0] * len(x_fit) for _ in range(nboot)]
-    y_gaussian_3 = [[0] * len(x_fit) for _ in range(nboot)]
-    y_gaussian_4 = [[0] * len(x_fit) for _ in range(nboot)]
-    y_gaussian_sum = [[0] * len(x_fit) for _ in range(nboot)]
-    for k in range(nboot):
-        # Plot the individual Gaussian components
-        y_gaussian_1[k] = gaussian(x_fit, amplitude_vals1[k], mean_vals1[k])
-        y_gaussian_2[k] = gaussian(x_fit, amplitude_vals2[k], mean_vals2[k])
-        y_gaussian_sum[k] = y_gaussian_1[k] + y_gaussian_2[k]
-        # plt.plot(x_fit, gaussian(x_fit, amplitude_vals1_new[k], mean_vals1_new[k]), label='Gaussian 1', color='orange', linewidth=1.3, alpha=0.2)
-        # plt.plot(x_fit, gaussian(x_fit, amplitude_vals2_new[k], mean_vals2_new[k]), label='Gaussian 2', color='blue', linewidth=1.3, alpha=0.2)
-        if cauchy_fit is True:
-            y_gaussian_1[k] = cauchy(x_fit, amplitude_vals1[k], mean_vals1[k])
-            y_gaussian_2[k] = cauchy(x_fit, amplitude_vals2[k], mean_vals2[k])
-            y_gaussian_sum[k] = y_gaussian_1[k] + y_gaussian_2[k]
-
-        if triple_fit is True:
-            y_gaussian_3[k] = gaussian(x_fit, amplitude_vals3[k], mean_vals3[k])
-            y_gaussian_sum[k] = y_gaussian_1[k] + y_gaussian_2[k] + y_gaussian_3[k]
-            # plt.plot(x_fit, y_gaussian_3, label='Gaussian 3', color='gray', linewidth=1.6, alpha=0.2)
-            if cauchy_fit is True:
-                y_gaussian_3[k] = cauchy(x_fit, amplitude_vals3[k], mean_vals3[k])
-                y_gaussian_sum[k] = y_gaussian_1[k] + y_gaussian_2[k] + y_gaussian_3[k]
-        if four_fit is True:
-            y_gaussian_4[k] = gaussian(x_fit, amplitude_vals4[k], mean_vals4[k])
-            y_gaussian_sum[k] = (
-                y_gaussian_1[k] + y_gaussian_2[k] + y_gaussian_3[k] + y_gaussian_4[k]
-            )
-            # plt.plot(x_fit, y_gaussian_4, label='Gaussian 4', color='brown', linewidth=1.3, alpha=0.2)
-            if cauchy_fit is True:
-                y_gaussian_4[k] = cauchy(x_fit, amplitude_vals4[k], mean_vals4[k])
-                y_gaussian_sum[k] = (
-                    y_gaussian_1[k]
-                    + y_gaussian_2[k]
-                    + y_gaussian_3[k]
-                    + y_gaussian_4[k]
-                )
+    # Every component for every bootstrap, evaluated as one array
+    amplitude_samples = [amplitude_vals1, amplitude_vals2]
+    mean_samples = [mean_vals1, mean_vals2]
+    if triple_fit is True:
+        amplitude_samples.append(amplitude_vals3)
+        mean_samples.append(mean_vals3)
+    if four_fit is True:
+        amplitude_samples.append(amplitude_vals4)
+        mean_samples.append(mean_vals4)
+    component_bands, sum_band = fit_bands.peak_bands(
+        x_fit,
+        np.column_stack(amplitude_samples),
+        np.column_stack(mean_samples),
+        sigma,
+        cauchy_fit,
+    )
 
-    x1 = np.linspace(plot_min_lim, plot_max_lim, 1000)
+    if plot_mode == "now":
+        x1 = np.linspace(plot_min_lim, plot_max_lim, 1000)
 
-    if triple_fit is True:
-        if four_fit is True:
-            if cauchy_fit is False:
-                plt.plot(x1, gaussian(x1, amplitude4, mean4), color="mediumturquoise")
-            else:
-                plt.plot(x1, cauchy(x1, amplitude4, mean4), color="mediumturquoise")
-            if cauchy_fit is False:
-                plt.plot(
-                    x1,
-                    four_gaussian2(
+        if triple_fit is True:
+            if four_fit is True:
+                if cauchy_fit is False:
+                    plt.plot(
+                        x1, gaussian(x1, amplitude4, mean4), color="mediumturquoise"
+                    )
+                else:
+                    plt.plot(x1, cauchy(x1, amplitude4, mean4), color="mediumturquoise")
+                if cauchy_fit is False:
+                    plt.plot(
                         x1,
-                        amplitude1,
-                        mean1,
-                        amplitude2,
-                        mean2,
-                        amplitude3,
-                        mean3,
-                        amplitude4,
-                        mean4,
-                    ),
-                    color="gray",
-                )
+                        four_gaussian2(
+                            x1,
+                            amplitude1,
+                            mean1,
+                            amplitude2,
+                            mean2,
+                            amplitude3,
+                            mean3,
+                            amplitude4,
+                            mean4,
+                        ),
+                        color="gray",
+                    )
+                else:
+                    plt.plot(
+                        x1,
+                        four_cauchy2(
+                            x1,
+                            amplitude1,
+                            mean1,
+                            amplitude2,
+                            mean2,
+                            amplitude3,
+                            mean3,
+                            amplitude4,
+                            mean4,
+                        ),
+                        color="gray",
+                    )
             else:
-                plt.plot(
-                    x1,
-                    four_cauchy2(
+                if cauchy_fit is False:
+                    plt.plot(
                         x1,
-                        amplitude1,
-                        mean1,
-                        amplitude2,
-                        mean2,
-                        amplitude3,
-                        mean3,
-                        amplitude4,
-                        mean4,
-                    ),
-                    color="gray",
-                )
+                        triple_gaussian2(
+                            x1, amplitude1, mean1, amplitude2, mean2, amplitude3, mean3
+                        ),
+                        color="gray",
+                    )
+                else:
+                    plt.plot(
+                        x1,
+                        triple_cauchy2(
+                            x1, amplitude1, mean1, amplitude2, mean2, amplitude3, mean3
+                        ),
+                        color="gray",
+                    )
         else:
             if cauchy_fit is False:
                 plt.plot(
                     x1,
-                    triple_gaussian2(
-                        x1, amplitude1, mean1, amplitude2, mean2, amplitude3, mean3
-                    ),
-                    color="gray",
+                    double_gaussian2(x1, amplitude1, mean1, amplitude2, mean2),
+                    color="orange",
                 )
             else:
                 plt.plot(
                     x1,
-                    triple_cauchy2(
-                        x1, amplitude1, mean1, amplitude2, mean2, amplitude3, mean3
-                    ),
-                    color="gray",
+                    double_cauchy2(x1, amplitude1, mean1, amplitude2, mean2),
+                    color="orange",
                 )
-    else:
-        if cauchy_fit is False:
-            plt.plot(
-                x1,
-                double_gaussian2(x1, amplitude1, mean1, amplitude2, mean2),
-                color="orange",
-            )
-        else:
-            plt.plot(
-                x1,
-                double_cauchy2(x1, amplitude1, mean1, amplitude2, mean2),
-                color="orange",
-            )
 
-    plt.grid(linestyle="dashed", alpha=0.6)
-    # plt.legend()
+        plt.grid(linestyle="dashed", alpha=0.6)
+        # plt.legend()
 
     ############################# Print results ###################################################
     """
@@ -1157,261 +1126,248 @@ def perform_fit(
         if not isinstance(value, bool) and not isinstance(value, str)
     ]
 
-    # Assuming 'file' is your file object opened in write mode
-    with open(
-        f"../CSVs/{ensemble}_spectral_density_spectrum.csv", "a", newline=""
-    ) as csvfile:
-        csvwriter = csv.writer(csvfile)
-        formatted_values = [f"{float(val):.4f}" for val in values]
-        if fit_peaks_switch == 0:
-            csvwriter.writerow(
-                [ensemble, kernel, rep, channel, k_peaks] + formatted_values
-            )
-        elif fit_peaks_switch == 1:
-            csvwriter.writerow(
-                [ensemble, kernel, rep, channel, k_peaks + 1] + formatted_values[:-2]
-            )
-    result1 = gaussian(x1, amplitude1, mean1)
-    transpose_y_gaussian1 = [
-        [y_gaussian_1[j][i] for j in range(nboot)] for i in range(len(x1))
-    ]
-    if cauchy_fit is True:
-        result1 = cauchy(x1, amplitude1, mean1)
-        transpose_y_gaussian1 = [
-            [y_gaussian_1[j][i] for j in range(nboot)] for i in range(len(x1))
-        ]
-    upper_band1 = [0] * len(x1)
-    lower_band1 = [0] * len(x1)
-
-    for j in range(len(x1)):
-        error = 1.0 * np.std((transpose_y_gaussian1)[j])
-        upper_band1[j] = result1[j] + error
-        lower_band1[j] = result1[j] - error
-    if cauchy_fit is False:
-        plt.plot(x1, gaussian(x1, amplitude1, mean1), color="chocolate", linewidth=1.6)
-        plt.fill_between(
-            x1,
-            lower_band1,
-            upper_band1,
-            color="chocolate",
-            alpha=0.2,
-            label="Error Bands",
-        )
-    else:
-        plt.plot(x1, cauchy(x1, amplitude1, mean1), color="chocolate", linewidth=1.6)
-        plt.fill_between(
-            x1,
-            lower_band1,
-            upper_band1,
-            color="chocolate",
-            alpha=0.2,
-            label="Error Bands",
-        )
-    result2 = gaussian(x1, amplitude2, mean2)
-    transpose_y_gaussian2 = [
-        [y_gaussian_2[j][i] for j in range(nboot)] for i in range(len(x1))
-    ]
-    if cauchy_fit is True:
-        result2 = cauchy(x1, amplitude2, mean2)
-        transpose_y_gaussian2 = [
-            [y_gaussian_2[j][i] for j in range(nboot)] for i in range(len(x1))
-        ]
-    upper_band2 = [0] * len(x1)
-    lower_band2 = [0] * len(x1)
-    # print(transpose_y_gaussian2[500])
-    for j in range(len(x1)):
-        error = 1.0 * np.std((transpose_y_gaussian2)[j])
-        upper_band2[j] = result2[j] + error
-        lower_band2[j] = result2[j] - error
-
-    if cauchy_fit is False:
-        plt.plot(x1, gaussian(x1, amplitude2, mean2), color="olive", linewidth=1.6)
-        plt.fill_between(
-            x1, lower_band2, upper_band2, color="olive", alpha=0.25, label="Error Bands"
-        )
-    else:
-        plt.plot(x1, cauchy(x1, amplitude2, mean2), color="olive", linewidth=1.6)
-        plt.fill_between(
-            x1, lower_band2, upper_band2, color="olive", alpha=0.25, label="Error Bands"
-        )
-    if four_fit is True:
+    # Returned to the driver, which writes the rows of an ensemble together
+    formatted_values = [f"{float(val):.4f}" for val in values]
+    if fit_peaks_switch == 0:
+        row = [ensemble, kernel, rep, channel, k_peaks] + formatted_values
+    elif fit_peaks_switch == 1:
+        row = [ensemble, kernel, rep, channel, k_peaks + 1] + formatted_values[:-2]
+    if plot_mode == "now":
+        result1 = gaussian(x1, amplitude1, mean1)
+        if cauchy_fit is True:
+            result1 = cauchy(x1, amplitude1, mean1)
+        upper_band1 = result1 + component_bands.std[0]
+        lower_band1 = result1 - component_bands.std[0]
         if cauchy_fit is False:
-            plt.plot(x1, gaussian(x1, amplitude3, mean3), color="orange", linewidth=1.6)
-
-            result3 = gaussian(x1, amplitude3, mean3)
-            transpose_y_gaussian3 = [
-                [y_gaussian_3[j][i] for j in range(nboot)] for i in range(len(x1))
-            ]
-            upper_band3 = [0] * len(x1)
-            lower_band3 = [0] * len(x1)
-            for j in range(len(x1)):
-                error = 1.0 * np.std((transpose_y_gaussian3)[j])
-                upper_band3[j] = result3[j] + error
-                lower_band3[j] = result3[j] - error
-
+            plt.plot(
+                x1, gaussian(x1, amplitude1, mean1), color="chocolate", linewidth=1.6
+            )
             plt.fill_between(
                 x1,
-                lower_band3,
-                upper_band3,
-                color="orange",
-                alpha=0.25,
+                lower_band1,
+                upper_band1,
+                color="chocolate",
+                alpha=0.2,
                 label="Error Bands",
             )
-
-            result_sum = (
-                gaussian(x1, amplitude2, mean2)
-                + gaussian(x1, amplitude1, mean1)
-                + gaussian(x1, amplitude3, mean3)
-                + gaussian(x1, amplitude4, mean4)
+        else:
+            plt.plot(
+                x1, cauchy(x1, amplitude1, mean1), color="chocolate", linewidth=1.6
             )
+            plt.fill_between(
+                x1,
+                lower_band1,
+                upper_band1,
+                color="chocolate",
+                alpha=0.2,
+                label="Error Bands",
+            )
+        result2 = gaussian(x1, amplitude2, mean2)
+        if cauchy_fit is True:
+            result2 = cauchy(x1, amplitude2, mean2)
+        upper_band2 = result2 + component_bands.std[1]
+        lower_band2 = result2 - component_bands.std[1]
 
-            transpose_y_gaussian_sum = [
-                [y_gaussian_sum[j][i] for j in range(nboot)] for i in range(len(x1))
-            ]
-            upper_band5 = [0] * len(x1)
-            lower_band5 = [0] * len(x1)
-            # print(transpose_y_gaussian1[999])
-            for j in range(len(x1)):
-                error = 1.0 * np.std((transpose_y_gaussian_sum)[j])
-                upper_band5[j] = result_sum[j] + error
-                lower_band5[j] = result_sum[j] - error
-
-            plt.plot(x1, gaussian(x1, amplitude4, mean4), color="pink", linewidth=1.6)
-
-            result4 = gaussian(x1, amplitude4, mean4)
-            transpose_y_gaussian4 = [
-                [y_gaussian_4[j][i] for j in range(nboot)] for i in range(len(x1))
-            ]
-            upper_band4 = [0] * len(x1)
-            lower_band4 = [0] * len(x1)
-            for j in range(len(x1)):
-                error = 1.0 * np.std((transpose_y_gaussian4)[j])
-                upper_band4[j] = result4[j] + error
-                lower_band4[j] = result4[j] - error
-
+        if cauchy_fit is False:
+            plt.plot(x1, gaussian(x1, amplitude2, mean2), color="olive", linewidth=1.6)
             plt.fill_between(
                 x1,
-                lower_band4,
-                upper_band4,
-                color="pink",
+                lower_band2,
+                upper_band2,
+                color="olive",
                 alpha=0.25,
                 label="Error Bands",
             )
-
         else:
-            plt.plot(x1, cauchy(x1, amplitude3, mean3), color="orange", linewidth=1.6)
-
-            result3 = cauchy(x1, amplitude3, mean3)
-            transpose_y_gaussian3 = [
-                [y_gaussian_3[j][i] for j in range(nboot)] for i in range(len(x1))
-            ]
-            upper_band3 = [0] * len(x1)
-            lower_band3 = [0] * len(x1)
-            for j in range(len(x1)):
-                error = 1.0 * np.std((transpose_y_gaussian3)[j])
-                upper_band3[j] = result3[j] + error
-                lower_band3[j] = result3[j] - error
-
+            plt.plot(x1, cauchy(x1, amplitude2, mean2), color="olive", linewidth=1.6)
             plt.fill_between(
                 x1,
-                lower_band3,
-                upper_band3,
-                color="orange",
+                lower_band2,
+                upper_band2,
+                color="olive",
                 alpha=0.25,
                 label="Error Bands",
             )
+        if four_fit is True:
+            if cauchy_fit is False:
+                plt.plot(
+                    x1, gaussian(x1, amplitude3, mean3), color="orange", linewidth=1.6
+                )
 
-            result_sum = (
-                cauchy(x1, amplitude2, mean2)
-                + cauchy(x1, amplitude1, mean1)
-                + cauchy(x1, amplitude3, mean3)
-                + cauchy(x1, amplitude4, mean4)
-            )
+                result3 = gaussian(x1, amplitude3, mean3)
+                upper_band3 = result3 + component_bands.std[2]
+                lower_band3 = result3 - component_bands.std[2]
+
+                plt.fill_between(
+                    x1,
+                    lower_band3,
+                    upper_band3,
+                    color="orange",
+                    alpha=0.25,
+                    label="Error Bands",
+                )
+
+                result_sum = (
+                    gaussian(x1, amplitude2, mean2)
+                    + gaussian(x1, amplitude1, mean1)
+                    + gaussian(x1, amplitude3, mean3)
+                    + gaussian(x1, amplitude4, mean4)
+                )
 
-            transpose_y_gaussian_sum = [
-                [y_gaussian_sum[j][i] for j in range(nboot)] for i in range(len(x1))
-            ]
-            upper_band5 = [0] * len(x1)
-            lower_band5 = [0] * len(x1)
-            # print(transpose_y_gaussian1[999])
-            for j in range(len(x1)):
-                error = 1.0 * np.std((transpose_y_gaussian_sum)[j])
-                upper_band5[j] = result_sum[j] + error
-                lower_band5[j] = result_sum[j] - error
-
-            plt.plot(x1, cauchy(x1, amplitude4, mean4), color="pink", linewidth=1.6)
-
-            result4 = cauchy(x1, amplitude4, mean4)
-            transpose_y_gaussian4 = [
-                [y_gaussian_4[j][i] for j in range(nboot)] for i in range(len(x1))
-            ]
-            upper_band4 = [0] * len(x1)
-            lower_band4 = [0] * len(x1)
-            for j in range(len(x1)):
-                error = 1.0 * np.std((transpose_y_gaussian4)[j])
-                upper_band4[j] = result4[j] + error
-                lower_band4[j] = result4[j] - error
+                upper_band5 = result_sum + sum_band.std
+                lower_band5 = result_sum - sum_band.std
+
+                plt.plot(
+                    x1, gaussian(x1, amplitude4, mean4), color="pink", linewidth=1.6
+                )
+
+                result4 = gaussian(x1, amplitude4, mean4)
+                upper_band4 = result4 + component_bands.std[3]
+                lower_band4 = result4 - component_bands.std[3]
+
+                plt.fill_between(
+                    x1,
+                    lower_band4,
+                    upper_band4,
+                    color="pink",
+                    alpha=0.25,
+                    label="Error Bands",
+                )
+
+            else:
+                plt.plot(
+                    x1, cauchy(x1, amplitude3, mean3), color="orange", linewidth=1.6
+                )
+
+                result3 = cauchy(x1, amplitude3, mean3)
+                upper_band3 = result3 + component_bands.std[2]
+                lower_band3 = result3 - component_bands.std[2]
+
+                plt.fill_between(
+                    x1,
+                    lower_band3,
+                    upper_band3,
+                    color="orange",
+                    alpha=0.25,
+                    label="Error Bands",
+                )
+
+                result_sum = (
+                    cauchy(x1, amplitude2, mean2)
+                    + cauchy(x1, amplitude1, mean1)
+                    + cauchy(x1, amplitude3, mean3)
+                    + cauchy(x1, amplitude4, mean4)
+                )
+
+                upper_band5 = result_sum + sum_band.std
+                lower_band5 = result_sum - sum_band.std
+
+                plt.plot(x1, cauchy(x1, amplitude4, mean4), color="pink", linewidth=1.6)
+
+                result4 = cauchy(x1, amplitude4, mean4)
+                upper_band4 = result4 + component_bands.std[3]
+                lower_band4 = result4 - component_bands.std[3]
+
+                plt.fill_between(
+                    x1,
+                    lower_band4,
+                    upper_band4,
+                    color="pink",
+                    alpha=0.25,
+                    label="Error Bands",
+                )
 
             plt.fill_between(
                 x1,
-                lower_band4,
-                upper_band4,
-                color="pink",
+                lower_band5,
+                upper_band5,
+                color="gray",
                 alpha=0.25,
                 label="Error Bands",
             )
+        elif triple_fit is True:
+            if cauchy_fit is False:
+                plt.plot(
+                    x1, gaussian(x1, amplitude3, mean3), color="orange", linewidth=1.6
+                )
 
-        plt.fill_between(
-            x1, lower_band5, upper_band5, color="gray", alpha=0.25, label="Error Bands"
-        )
-    elif triple_fit is True:
-        if cauchy_fit is False:
-            plt.plot(x1, gaussian(x1, amplitude3, mean3), color="orange", linewidth=1.6)
+                result_sum = (
+                    gaussian(x1, amplitude2, mean2)
+                    + gaussian(x1, amplitude1, mean1)
+                    + gaussian(x1, amplitude3, mean3)
+                )
+                result3 = gaussian(x1, amplitude3, mean3)
+                upper_band3 = result3 + component_bands.std[2]
+                lower_band3 = result3 - component_bands.std[2]
 
-            result_sum = (
-                gaussian(x1, amplitude2, mean2)
-                + gaussian(x1, amplitude1, mean1)
-                + gaussian(x1, amplitude3, mean3)
-            )
-            result3 = gaussian(x1, amplitude3, mean3)
-            transpose_y_gaussian3 = [
-                [y_gaussian_3[j][i] for j in range(nboot)] for i in range(len(x1))
-            ]
-            upper_band3 = [0] * len(x1)
-            lower_band3 = [0] * len(x1)
-            for j in range(len(x1)):
-                error = 1.0 * np.std((transpose_y_gaussian3)[j])
-                upper_band3[j] = result3[j] + error
-                lower_band3[j] = result3[j] - error
+                plt.fill_between(
+                    x1,
+                    lower_band3,
+                    upper_band3,
+                    color="orange",
+                    alpha=0.25,
+                    label="Error Bands",
+                )
+
+            else:
+                plt.plot(
+                    x1, cauchy(x1, amplitude3, mean3), color="orange", linewidth=1.6
+                )
+
+                result_sum = (
+                    cauchy(x1, amplitude2, mean2)
+                    + cauchy(x1, amplitude1, mean1)
+                    + cauchy(x1, amplitude3, mean3)
+                )
+
+                result3 = cauchy(x1, amplitude3, mean3)
+                upper_band3 = result3 + component_bands.std[2]
+                lower_band3 = result3 - component_bands.std[2]
+
+                plt.fill_between(
+                    x1,
+                    lower_band3,
+                    upper_band3,
+                    color="orange",
+                    alpha=0.25,
+                    label="Error Bands",
+                )
+
+            upper_band4 = result_sum + sum_band.std
+            lower_band4 = result_sum - sum_band.std
 
             plt.fill_between(
                 x1,
-                lower_band3,
-                upper_band3,
-                color="orange",
+                lower_band4,
+                upper_band4,
+                color="gray",
                 alpha=0.25,
                 label="Error Bands",
             )
-
         else:
-            plt.plot(x1, cauchy(x1, amplitude3, mean3), color="orange", linewidth=1.6)
-
-            result_sum = (
-                cauchy(x1, amplitude2, mean2)
-                + cauchy(x1, amplitude1, mean1)
-                + cauchy(x1, amplitude3, mean3)
-            )
+            if cauchy_fit is False:
+                plt.plot(
+                    x1,
+                    double_gaussian2(x1, amplitude1, mean1, amplitude2, mean2),
+                    color="orange",
+                    linewidth=1.8,
+                )
+                result_sum = gaussian(x1, amplitude2, mean2) + gaussian(
+                    x1, amplitude1, mean1
+                )
+            else:
+                plt.plot(
+                    x1,
+                    double_cauchy2(x1, amplitude1, mean1, amplitude2, mean2),
+                    color="orange",
+                    linewidth=1.8,
+                )
+                result_sum = cauchy(x1, amplitude2, mean2) + cauchy(
+                    x1, amplitude1, mean1
+                )
 
-            result3 = cauchy(x1, amplitude3, mean3)
-            transpose_y_gaussian3 = [
-                [y_gaussian_3[j][i] for j in range(nboot)] for i in range(len(x1))
-            ]
-            upper_band3 = [0] * len(x1)
-            lower_band3 = [0] * len(x1)
-            for j in range(len(x1)):
-                error = 1.0 * np.std((transpose_y_gaussian3)[j])
-                upper_band3[j] = result3[j] + error
-                lower_band3[j] = result3[j] - error
+            upper_band3 = result_sum + sum_band.std
+            lower_band3 = result_sum - sum_band.std
 
             plt.fill_between(
                 x1,
@@ -1421,59 +1377,22 @@ def perform_fit(
                 alpha=0.25,
                 label="Error Bands",
             )
-
-        transpose_y_gaussian_sum = [
-            [y_gaussian_sum[j][i] for j in range(nboot)] for i in range(len(x1))
-        ]
-        upper_band4 = [0] * len(x1)
-        lower_band4 = [0] * len(x1)
-        # print(transpose_y_gaussian1[999])
-        for j in range(len(x1)):
-            error = 1.0 * np.std((transpose_y_gaussian_sum)[j])
-            upper_band4[j] = result_sum[j] + error
-            lower_band4[j] = result_sum[j] - error
-
-        plt.fill_between(
-            x1, lower_band4, upper_band4, color="gray", alpha=0.25, label="Error Bands"
-        )
-    else:
-        if cauchy_fit is False:
-            plt.plot(
-                x1,
-                double_gaussian2(x1, amplitude1, mean1, amplitude2, mean2),
-                color="orange",
-                linewidth=1.8,
-            )
-            result_sum = gaussian(x1, amplitude2, mean2) + gaussian(
-                x1, amplitude1, mean1
-            )
-        else:
-            plt.plot(
-                x1,
-                double_cauchy2(x1, amplitude1, mean1, amplitude2, mean2),
-                color="orange",
-                linewidth=1.8,
-            )
-            result_sum = cauchy(x1, amplitude2, mean2) + cauchy(x1, amplitude1, mean1)
-
-        transpose_y_gaussian_sum = [
-            [y_gaussian_sum[j][i] for j in range(nboot)] for i in range(len(x1))
-        ]
-        upper_band3 = [0] * len(x1)
-        lower_band3 = [0] * len(x1)
-        # print(transpose_y_gaussian1[999])
-        for j in range(len(x1)):
-            error = 1.0 * np.std((transpose_y_gaussian_sum)[j])
-            upper_band3[j] = result_sum[j] + error
-            lower_band3[j] = result_sum[j] - error
-
-        plt.fill_between(
-            x1,
-            lower_band3,
-            upper_band3,
-            color="orange",
-            alpha=0.25,
-            label="Error Bands",
+    elif plot_mode == "later":
+        # Everything render_fit_plots.py needs to draw this figure
+        fit_bands.write_sidecar(
+            os.path.splitext(output_name)[0] + ".h5",
+            output_name,
+            x,
+            rho_central,
+            drho_central,
+            x_fit,
+            np.mean(np.column_stack(amplitude_samples), axis=0),
+            np.mean(np.column_stack(mean_samples), axis=0),
+            component_bands,
+            sum_band,
+            sigma,
+            cauchy_fit,
+            title=f"{ensemble} {rep} {channel} {kernel}",
         )
 
     if flag_chi2:
@@ -1523,25 +1442,26 @@ def perform_fit(
                 flag_chi2 = False
         print(LogMessage(), " Reduced Chi Square (with correlation): ", chi_square_red)
 
-    # Plot the data
-    plt.errorbar(
-        x,
-        rho_central,
-        yerr=drho_central,
-        fmt="o",
-        color="black",
-        markersize=3.0,
-        label="Spectral density",
-        elinewidth=1.2,
-    )
-    """
-    # Save the figure with the specified size
-    plt.savefig(output_name, format="pdf", dpi=300)
-    """
-    # Display the plot
-    # plt.show()
-    plt.close(fig)
-    return None
+    if plot_mode == "now":
+        # Plot the data
+        plt.errorbar(
+            x,
+            rho_central,
+            yerr=drho_central,
+            fmt="o",
+            color="black",
+            markersize=3.0,
+            label="Spectral density",
+            elinewidth=1.2,
+        )
+        """
+        # Save the figure with the specified size
+        plt.savefig(output_name, format="pdf", dpi=300)
+        """
+        # Display the plot
+        # plt.show()
+        plt.close(fig)
+    return row
 
 
 ########################### Preferences ################################
@@ -1591,12 +1511,8 @@ headers.extend(["aE_3", "errorE3"])
 # TODO: match names with spec_dens code outputs in our inputs
 # TODO: sp_dens_code.py --> structure of 'input_fit/'
 
+tasks = []
 for ensemble in args.ensembles:
-    with open(
-        f"../CSVs/{ensemble}_spectral_density_spectrum.csv", "a", newline=""
-    ) as csvfile:
-        csvwriter = csv.writer(csvfile)
-        csvwriter.writerow(headers)
     ensemble_num = ensembles.index(ensemble)
     for rep in reps:
         for k, channel in enumerate(mesonic_channels):
@@ -1630,33 +1546,53 @@ for ensemble in args.ensembles:
                     elif fit_peaks_switch == 1:
                         output_name = f"./fitresults/fit_results_{ensemble}_{rep}_{channel}_{kernel}_kpeaks{new_k_peaks}.pdf"
 
-                    perform_fit(
-                        kernel,
-                        ensemble,
-                        rep,
-                        channel,
-                        ensemble_num,
-                        channel_num,
-                        path,
-                        file_path_input,
-                        output_name,
-                        plot_min_lim,
-                        plot_max_lim,
-                        cauchy_fit,
-                        triple_fit,
-                        four_fit,
-                        print_cov_matrix,
-                        plot_cov_mat,
-                        plot_corr_mat,
-                        flag_chi2,
-                        matrix_4D,
-                        k_peaks[ensemble][channel_num],
-                        kernel,
-                        Nboot_fit[ensemble_num],
-                        fit_peaks_switch,
-                        matrix_2D,
+                    tasks.append(
+                        (
+                            kernel,
+                            ensemble,
+                            rep,
+                            channel,
+                            ensemble_num,
+                            channel_num,
+                            path,
+                            file_path_input,
+                            output_name,
+                            plot_min_lim,
+                            plot_max_lim,
+                            cauchy_fit,
+                            triple_fit,
+                            four_fit,
+                            print_cov_matrix,
+                            plot_cov_mat,
+                            plot_corr_mat,
+                            flag_chi2,
+                            matrix_4D,
+                            k_peaks[ensemble][channel_num],
+                            kernel,
+                            Nboot_fit[ensemble_num],
+                            fit_peaks_switch,
+                            matrix_2D,
+                            old_k_peaks,
+                            new_k_peaks,
+                            plot_mode,
+                        )
                     )
 
+# Every fit is independent; starmap returns the rows in the order of tasks,
+# so the CSVs do not depend on which fit finishes first
+with multiprocessing.get_context("fork").Pool(processes=args.threads) as pool:
+    rows = pool.starmap(perform_fit, tasks, chunksize=1)
+
+for ensemble in args.ensembles:
+    with open(
+        f"../CSVs/{ensemble}_spectral_density_spectrum.csv", "a", newline=""
+    ) as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(headers)
+        for task, row in zip(tasks, rows):
+            if task[1] == ensemble:
+                csvwriter.writerow(row)
+
 
 # Avoid needing to work out the full tangle of output files,
 # while still allowing a workflow dependency on completing this rule
@@ -0,0 +1,157 @@
+import multiprocessing
+import os
+import shutil
+
+from lsdensities.InverseProblemWrapper import InverseProblemWrapper
+from lsdensities.utils.rhoUtils import LogMessage
+
+# Results that scanParameters and estimate_sys_error fill in for one energy
+RESULT_FIELDS = [
+    "lambdaResultHLT",
+    "rhoResultHLT",
+    "drho_result",
+    "gt_HLT",
+    "aa0",
+    "minNLL",
+    "lambdaResultBayes",
+    "rhoResultBayes",
+    "drho_bayes",
+    "gt_Bayes",
+    "rho_sys_err_HLT",
+    "rho_quadrature_err_HLT",
+    "rho_sys_err_Bayes",
+    "rho_quadrature_err_Bayes",
+]
+# Lambda scan history, one list per energy, kept for stabilityPlot
+SCAN_FIELDS = [
+    "lambda_list",
+    "rho_list",
+    "errBoot_list",
+    "errBayes_list",
+    "gAA0g_list",
+    "likelihood_list",
+]
+ALPHA_LABELS = ["A", "B", "C"]
+
+# Wrapper whose energies are being scanned. Set before the pool forks, so
+# that every worker sees the same copy-on-write S, Cov[C] and samples.
+_shared = None
+
+
+def energy_workers(cores, concurrent_tasks):
+    """Processes each findRho can use when concurrent_tasks run side by side."""
+    return max(1, cores // max(1, min(cores, concurrent_tasks)))
+
+
+def _energy_logpath(logpath, e_i):
+    return os.path.join(logpath, f".energy{e_i}")
+
+
+def _scan_energy(e_i):
+    HLT = _shared
+    # Each worker has its own copy of par: redirect _store to a private log
+    logpath = HLT.par.logpath
+    HLT.par.logpath = _energy_logpath(logpath, e_i)
+    os.makedirs(HLT.par.logpath, exist_ok=True)
+    try:
+        HLT.scanParameters(HLT.espace[e_i])
+        HLT.estimate_sys_error(e_i)
+    finally:
+        HLT.par.logpath = logpath
+    results = {name: getattr(HLT, name)[e_i] for name in RESULT_FIELDS}
+    scans = {name: getattr(HLT, name)[e_i] for name in HLT.scan_fields()}
+    return e_i, results, scans
+
+
+class ParallelInverseProblemWrapper(InverseProblemWrapper):
+    """
+    InverseProblemWrapper scanning its energies on a pool of workers.
+
+    The lambda scan at each energy only reads S, Cov[C] and the samples, so
+    the energies are independent. Workers are forked once the matrices are
+    prepared and share them; each returns its results, which are stored and
+    written to ResultHLT.txt, ResultBayes.txt and the InverseProblemLOG
+    files in energy order, as in the serial run.
+    """
+
+    def __init__(self, *args, workers=1, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.workers = workers
+
+    def scan_fields(self):
+        fields = list(SCAN_FIELDS)
+        for label in ALPHA_LABELS[1 : self.par.Na]:
+            fields += [
+                f"{name}_alpha{label}" for name in SCAN_FIELDS if name != "lambda_list"
+            ]
+        return fields
+
+    def _write_results(self, e_i):
+        with open(os.path.join(self.par.logpath, "ResultHLT.txt"), "a") as output:
+            print(
+                self.espace[e_i],
+                self.lambdaResultHLT[e_i],
+                float(self.rhoResultHLT[e_i]),
+                float(self.drho_result[e_i]),
+                float(self.rho_sys_err_HLT[e_i]),
+                float(self.rho_quadrature_err_HLT[e_i]),
+                float(self.aa0[e_i]),
+                file=output,
+            )
+        with open(os.path.join(self.par.logpath, "ResultBayes.txt"), "a") as output:
+            print(
+                self.espace[e_i],
+                self.lambdaResultBayes[e_i],
+                float(self.rhoResultBayes[e_i]),
+                float(self.drho_bayes[e_i]),
+                float(self.rho_sys_err_Bayes[e_i]),
+                float(self.rho_quadrature_err_Bayes[e_i]),
+                float(self.minNLL[e_i]),
+                file=output,
+            )
+
+    def _collect_logs(self, e_i):
+        energy_logpath = _energy_logpath(self.par.logpath, e_i)
+        for label in ALPHA_LABELS[: self.par.Na]:
+            fname = f"InverseProblemLOG_Alpha{label}.log"
+            with open(os.path.join(energy_logpath, fname)) as energy_log:
+                with open(os.path.join(self.par.logpath, fname), "a") as output:
+                    shutil.copyfileobj(energy_log, output)
+        shutil.rmtree(energy_logpath)
+
+    def run(self, savePlots=True, livePlots=False):
+        workers = min(self.workers, self.par.Ne)
+        if workers <= 1:
+            return super().run(savePlots=savePlots, livePlots=livePlots)
+
+        with open(os.path.join(self.par.logpath, "ResultHLT.txt"), "w") as output:
+            print(
+                "# Energy \t Lambda(HLT) \t Rho(HLT) \t Stat(HLT) \t Sys(HLT) \t Quadrature \t A/A0",
+                file=output,
+            )
+        with open(os.path.join(self.par.logpath, "ResultBayes.txt"), "w") as output:
+            print(
+                "# Energy \t Lambda(Bayes) \t Rho(Bayes) \t Stat(Bayes) \t Sys(Bayes) \t Quadrature \t NLL",
+                file=output,
+            )
+
+        print(LogMessage(), f"Scanning {self.par.Ne} energies on {workers} processes")
+        global _shared
+        _shared = self
+        try:
+            with multiprocessing.get_context("fork").Pool(processes=workers) as pool:
+                # imap returns in energy order, so results are written as
+                # soon as all lower energies are done
+                for e_i, results, scans in pool.imap(
+                    _scan_energy, range(self.par.Ne), chunksize=1
+                ):
+                    for name, value in results.items():
+                        getattr(self, name)[e_i] = value
+                    for name, value in scans.items():
+                        getattr(self, name)[e_i] = value
+                    self._collect_logs(e_i)
+                    self._write_results(e_i)
+        finally:
+            _shared = None
+
+        return 0
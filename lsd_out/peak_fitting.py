@@ -0,0 +1,216 @@
+import numpy as np
+from lmfit import Minimizer
+from lsdensities.utils.rhoUtils import LogMessage
+
+
+def peak_components(x, amplitudes, means, sigma, cauchy=False):
+    """
+    Gaussian or Cauchy peaks of width sigma at every x.
+
+    amplitudes and means have shape (..., n_peaks); the result has shape
+    (..., n_peaks, len(x)), so that a whole set of bootstrap parameters is
+    evaluated in one array expression.
+    """
+    amplitudes = np.asarray(amplitudes, dtype=float)[..., None]
+    means = np.asarray(means, dtype=float)[..., None]
+    dx = np.asarray(x, dtype=float) - means
+    if cauchy:
+        return amplitudes * (sigma / (dx**2 + sigma**2))
+    return amplitudes * np.exp(-(dx**2) / (2 * sigma**2))
+
+
+def peak_sum(x, amplitudes, means, sigma, cauchy=False):
+    """Sum of the peaks, with shape (..., len(x))."""
+    return peak_components(x, amplitudes, means, sigma, cauchy).sum(axis=-2)
+
+
+def whitening(cholesky_cov):
+    """
+    Inverse of the Cholesky factor of the covariance.
+
+    Computed once per fit instead of at every evaluation of the residual.
+    """
+    return np.linalg.inv(cholesky_cov)
+
+
+def peak_parameters(params, n_peaks):
+    """Amplitudes and means of an lmfit Parameters set with amplitude_i, mean_i."""
+    amplitudes = np.array(
+        [params[f"amplitude_{i}"].value for i in range(1, n_peaks + 1)]
+    )
+    means = np.array([params[f"mean_{i}"].value for i in range(1, n_peaks + 1)])
+    return amplitudes, means
+
+
+def correlated_residual(params, x, data, whitening_matrix, n_peaks, sigma, cauchy):
+    """lmfit residual: the whitened difference between data and the peak model."""
+    amplitudes, means = peak_parameters(params, n_peaks)
+    model = peak_sum(x, amplitudes, means, sigma, cauchy)
+    return whitening_matrix @ np.abs(data - model)
+
+
+def _model_and_jacobian(x, amplitudes, means, sigma, cauchy):
+    """
+    Peak sum and its derivatives for a batch of parameter sets.
+
+    amplitudes and means have shape (nboot, n_peaks). Returns the model,
+    (nboot, len(x)), and its Jacobian, (nboot, len(x), 2 * n_peaks), with
+    the amplitudes first and the means after them.
+    """
+    dx = x - means[..., None]
+    if cauchy:
+        shape = sigma / (dx**2 + sigma**2)
+        dshape = 2 * dx * shape / (dx**2 + sigma**2)
+    else:
+        shape = np.exp(-(dx**2) / (2 * sigma**2))
+        dshape = shape * dx / sigma**2
+    model = (amplitudes[..., None] * shape).sum(axis=-2)
+    jacobian = np.concatenate([shape, amplitudes[..., None] * dshape], axis=-2)
+    return model, jacobian.swapaxes(-1, -2)
+
+
+class _Bounds:
+    """
+    lmfit's transformation of bounded parameters,
+    p = min + (sin(u) + 1) (max - min) / 2, so that unconstrained steps in u
+    keep p within its bounds.
+    """
+
+    def __init__(self, lower, upper):
+        self.lower = lower
+        self.upper = upper
+        self.bounded = np.isfinite(lower) & np.isfinite(upper)
+        self.half_width = np.where(self.bounded, (upper - lower) / 2, 1.0)
+
+    def to_internal(self, p):
+        p = np.clip(p, self.lower, self.upper)
+        ratio = np.where(self.bounded, (p - self.lower) / self.half_width - 1, 0.0)
+        return np.where(self.bounded, np.arcsin(np.clip(ratio, -1, 1)), p)
+
+    def to_external(self, u):
+        return np.where(self.bounded, self.lower + (np.sin(u) + 1) * self.half_width, u)
+
+    def derivative(self, u):
+        return np.where(self.bounded, np.cos(u) * self.half_width, 1.0)
+
+
+def _residuals(u, bounds, x, data, whitening_matrix, n_peaks, sigma, cauchy):
+    p = bounds.to_external(u)
+    model, jacobian = _model_and_jacobian(
+        x, p[:, :n_peaks], p[:, n_peaks:], sigma, cauchy
+    )
+    difference = data - model
+    residual = np.abs(difference) @ whitening_matrix.T
+    # d|data - model| / dp = -sign(data - model) d model / dp
+    jacobian = whitening_matrix @ (-np.sign(difference)[..., None] * jacobian)
+    return residual, jacobian * bounds.derivative(u)[:, None, :]
+
+
+def fit_bootstraps(
+    params,
+    x,
+    samples,
+    whitening_matrix,
+    n_peaks,
+    sigma,
+    cauchy,
+    max_iterations=1000,
+    ftol=1.5e-8,
+    xtol=1.5e-8,
+    gtol=1e-10,
+):
+    """
+    Fit every bootstrap sample of rho at once.
+
+    Minimises the same residual as correlated_residual, starting every
+    sample from the values in params and keeping them within its bounds,
+    with a Levenberg-Marquardt iteration vectorised over the (nboot, 2 *
+    n_peaks) parameters and an analytic Jacobian. A sample converges once an
+    accepted step changes its cost by less than ftol or its parameters by
+    less than xtol, or once its gradient is below gtol. Samples for which it
+    does not converge are refitted one by one with lmfit; samples whose
+    lmfit refit also fails are set back to the starting values in params.
+
+    The residual |data - model| is not smooth, so on noisy samples this
+    iteration and lmfit's leastsq can stop in different local minima: the
+    distribution over bootstraps agrees, but single samples may not (see
+    check_batched_peak_fit.py). Fit one by one with lmfit where the
+    per-sample values themselves matter.
+
+    Returns a dictionary with one array of nboot values per parameter, and
+    a boolean array marking the samples whose fit failed.
+    """
+    names = [f"amplitude_{i}" for i in range(1, n_peaks + 1)]
+    names += [f"mean_{i}" for i in range(1, n_peaks + 1)]
+    bounds = _Bounds(
+        np.array([params[name].min for name in names], dtype=float),
+        np.array([params[name].max for name in names], dtype=float),
+    )
+    nboot = len(samples)
+    u = np.tile(
+        bounds.to_internal(np.array([params[name].value for name in names])),
+        (nboot, 1),
+    )
+    residual, jacobian = _residuals(
+        u, bounds, x, samples, whitening_matrix, n_peaks, sigma, cauchy
+    )
+    cost = (residual**2).sum(axis=-1)
+    damping = np.full(nboot, 1e-3)
+    active = np.ones(nboot, dtype=bool)
+    converged = np.zeros(nboot, dtype=bool)
+
+    for _ in range(max_iterations):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+        jtj = jacobian[idx].swapaxes(-1, -2) @ jacobian[idx]
+        gradient = (jacobian[idx].swapaxes(-1, -2) @ residual[idx][..., None])[..., 0]
+        scale = np.maximum(np.diagonal(jtj, axis1=-2, axis2=-1), 1e-300)
+        step = -np.linalg.solve(
+            jtj + damping[idx, None, None] * (scale[..., None] * np.eye(len(names))),
+            gradient[..., None],
+        )[..., 0]
+        trial = u[idx] + step
+        trial_residual, trial_jacobian = _residuals(
+            trial, bounds, x, samples[idx], whitening_matrix, n_peaks, sigma, cauchy
+        )
+        trial_cost = (trial_residual**2).sum(axis=-1)
+
+        better = trial_cost < cost[idx]
+        decrease = (cost[idx] - trial_cost) / np.maximum(cost[idx], 1e-300)
+        small_step = np.linalg.norm(step, axis=-1) <= xtol * (
+            np.linalg.norm(u[idx], axis=-1) + xtol
+        )
+        accepted = idx[better]
+        u[accepted] = trial[better]
+        residual[accepted] = trial_residual[better]
+        jacobian[accepted] = trial_jacobian[better]
+        cost[accepted] = trial_cost[better]
+        damping[idx] = np.where(better, damping[idx] / 10, damping[idx] * 10)
+
+        # A rejected step only shrinks because the damping grew, so the size
+        # of a step counts only once it is accepted; a stationary point is
+        # recognised by the gradient instead
+        stationary = np.all(
+            np.abs(gradient) <= gtol * np.sqrt(scale * cost[idx, None]), axis=-1
+        )
+        done = (better & ((decrease <= ftol) | small_step)) | stationary
+        converged[idx[done]] = True
+        active[idx[done | (damping[idx] > 1e16)]] = False
+
+    fitted = bounds.to_external(u)
+    failed = np.zeros(nboot, dtype=bool)
+    for k in np.flatnonzero(~converged):
+        try:
+            result = Minimizer(
+                correlated_residual,
+                params,
+                fcn_args=(x, samples[k], whitening_matrix, n_peaks, sigma, cauchy),
+            ).minimize()
+        except Exception as e:
+            print(LogMessage(), f"Bootstrap fit {k} failed: {e}")
+            fitted[k] = [params[name].value for name in names]
+            failed[k] = True
+            continue
+        fitted[k] = [result.params[name].value for name in names]
+    return {name: fitted[:, i] for i, name in enumerate(names)}, failed
@@ -1,30 +1,28 @@
 import datetime
 
-import lsdensities.utils.rhoUtils as u
 from lsdensities.utils.rhoUtils import (
     init_precision,
     LogMessage,
     end,
     Inputs,
     create_out_paths,
+    generate_seed,
     plot_markers,
     CB_colors,
     timesfont,
 )
 from lsdensities.utils.rhoParser import parseArgumentPrintSamples
-from lsdensities.correlator.correlatorUtils import symmetrisePeriodicCorrelator
-from lsdensities.utils.rhoParallelUtils import ParallelBootstrapLoop
 from mpmath import mp, mpf
 from lsdensities.core import A0E_mp, Smatrix_mp
-from lsdensities.abw import gAg, gBg
-from lsdensities.transform import h_Et_mp_Eslice, y_combine_sample_Eslice_mp_ToFile
 import os
-import time
-from lsdensities.utils.rhoMath import invert_matrix_ge
 import matplotlib.pyplot as plt
 import csv
-import read_hdf
 import translate
+import resample_cache
+import batched_hlt
+import sample_files
+import adaptive_precision
+from correlator_store import CorrelatorStore
 
 #   Take input for Rho
 import numpy as np
@@ -111,6 +109,8 @@ def printSamples(
     mpi,
     rhopath,
     part_outdir,
+    adaptive_prec=False,
+    text_samples=False,
 ):
     print(LogMessage(), "Initialising")
     # args = parseArgumentPrintSamples()
@@ -132,9 +132,11 @@ def printSamples(
         mpi,
         rhopath,
     )
+    # Same seed as findRho, which is what identifies its resampled correlator
+    seed = generate_seed(par)
 
     #   Reading datafile, storing correlator
-    rawcorr, par.time_extent, par.num_samples = u.read_datafile(par.datapath)
+    rawcorr, par.time_extent, par.num_samples = translate.read_datafile(par.datapath)
 
     rho_file = rhopath
     inputrhofile = np.genfromtxt(rho_file, comments="#")
@@ -157,87 +159,40 @@ def printSamples(
     par.report()
     par.plotpath, par.logpath = create_out_paths2(outdir)
 
-    #   Here is the correlator
-    rawcorr.evaluate()
-    rawcorr.tmax = par.tmax
-
-    #   Symmetrise
-    if par.periodicity == "COSH":
-        print(LogMessage(), "Folding correlator")
-        symCorr = symmetrisePeriodicCorrelator(corr=rawcorr, par=par)
-        symCorr.evaluate()
-
-    #   Here is the resampling
-    if par.periodicity == "EXP":
-        corr = u.Obs(
-            T=par.time_extent, tmax=par.tmax, nms=par.num_boot, is_resampled=True
-        )
-    if par.periodicity == "COSH":
-        corr = u.Obs(
-            T=symCorr.T,
-            tmax=symCorr.tmax,
-            nms=par.num_boot,
-            is_resampled=True,
-        )
-
-    if par.periodicity == "COSH":
-        # resample = ParallelBootstrapLoop(par, rawcorr.sample, is_folded=False)
-        resample = ParallelBootstrapLoop(par, symCorr.sample, is_folded=False)
-    if par.periodicity == "EXP":
-        resample = ParallelBootstrapLoop(par, rawcorr.sample, is_folded=False)
-
-    corr.sample = resample.run()
-    corr.evaluate()
-
-    #   Covariance
-    print(LogMessage(), "Evaluate covariance")
-    corr.evaluate_covmatrix(plot=False)
-    corr.corrmat_from_covmat(plot=False)
-
-    #   Make it into a mp sample
-    print(LogMessage(), "Converting correlator into mpmath type")
-    corr.fill_mp_sample()
+    #   Folded and resampled correlator, as left in the cache by findRho
+    corr = resample_cache.get_resampled_correlator(par, rawcorr, seed)
     print(LogMessage(), "Cond[Cov C] = {:3.3e}".format(float(mp.cond(corr.mpcov))))
     cNorm = mpf(str(corr.central[1] ** 2))
 
+    if adaptive_prec:
+        digits = adaptive_precision.estimate_digits(par, corr, prec)
+        # Check the smallest lambda, where S + factor * B is closest to S
+        e_i = int(np.argmin(lambda_e))
+        if not adaptive_precision.precision_is_sufficient(
+            par, corr, cNorm, espace[e_i], lambda_e[e_i], digits, prec
+        ):
+            print(LogMessage(), f"Falling back to {prec} digits")
+            digits = prec
+        init_precision(digits)
+
     # from HLT class
     A0set = A0E_mp(espace, par, alpha_=0, e0_=par.mpe0)
 
-    for _e in range(par.Ne):
-        estar_ = espace[_e]
-        fname = "lsdensitiesamplesE" + str(estar_) + "sig" + str(par.sigma)
-        fpath = os.path.join(par.logpath, fname)
-        _Bnorm = cNorm / (estar_ * estar_)
-        _factor = (lambda_e[_e] * A0set[_e]) / _Bnorm
-        S_ = Smatrix_mp(
-            tmax_=par.tmax,
-            alpha_=0,
-            e0_=par.mpe0,
-            type=par.periodicity,
-            T=par.time_extent,
-        )
-        _M = S_ + (_factor * corr.mpcov)
-        start_time = time.time()
-        _Minv = invert_matrix_ge(_M)
-        end_time = time.time()
-        print(
-            LogMessage(),
-            "\t \t lambdaToRho ::: Matrix inverted in {:4.4f}".format(
-                end_time - start_time
-            ),
-            "s",
-        )
-        _g_t_estar = h_Et_mp_Eslice(_Minv, par, estar_, alpha_=0)
-        rho[_e], drho[_e] = y_combine_sample_Eslice_mp_ToFile(
-            fpath, _g_t_estar, corr.mpsample, par
-        )
-
-        gag_estar = gAg(S_, _g_t_estar, estar_, 0, par)
-
-        gBg_estar = gBg(_g_t_estar, corr.mpcov, _Bnorm)
-
-        print(LogMessage(), "\t \t  B / Bnorm = ", float(gBg_estar))
-        print(LogMessage(), "\t \t  A / A0 = ", float(gag_estar / A0set[_e]))
+    # Energy independent, built once for all energies
+    S_ = Smatrix_mp(
+        tmax_=par.tmax,
+        alpha_=0,
+        e0_=par.mpe0,
+        type=par.periodicity,
+        T=par.time_extent,
+    )
+    rho, drho, samples = batched_hlt.lambda_to_rho_all_energies(
+        par, corr, S_, A0set, cNorm, espace, lambda_e, text_samples=text_samples
+    )
+    # All energies of the channel in one file, read by sample_files.read_samples
+    sample_files.write_packed(
+        par.logpath, espace, samples, sigma=par.sigma, rho=in_rho, drho=in_stat
+    )
 
     plt.errorbar(
         x=espace,
@@ -293,6 +248,7 @@ def main():
         "chimera_out_64x20x20x20nc4nf2nas3b6.5mf0.70mas1.01_APE0.4N50_smf0.2as0.12_s1",
         "chimera_out_64x32x32x32nc4nf2nas3b6.5mf0.72mas1.01_APE0.4N50_smf0.24as0.12_s1",
     ]
+    store = CorrelatorStore(file_path, ensembles, roots)
     # Representations considered
     reps = ["fund", "anti"]
     # Kernel in HLT
@@ -359,41 +315,11 @@ def main():
                     for k, channel in enumerate(mesonic_channels):
                         Nsource = matrix_4D[index][4][k]
                         Nsink = matrix_4D[index][5][k]
-                        group_prefixes = {
-                            "gi": ["g1", "g2", "g3"],
-                            "g0gi": ["g0g1", "g0g2", "g0g3"],
-                            "g5gi": ["g5g1", "g5g2", "g5g3"],
-                            "g0g5gi": ["g0g5g1", "g0g5g2", "g0g5g3"],
-                        }
-                        prefix = group_prefixes.get(channel, [channel])
-                        datasets = []
-                        for g in prefix:
-                            dataset_path = f"{roots[index]}/source_N{Nsource}_sink_N{Nsink}/{rep} TRIPLET {g}"
-                            group1 = f"source_N{Nsource}_sink_N{Nsink}"
-                            group2 = f"{rep} TRIPLET {g}"
-                            datasets.append(
-                                read_hdf.extract_dataset(
-                                    file_path, group2, roots[index], group1
-                                )
-                            )
-                            with open("paths.log", "a") as file:
-                                print(dataset_path, file=file)
-                        dataset = sum(datasets) / len(datasets) if datasets else None
-                        if channel == "id" or channel == "g5":
-                            group2 = f"{rep} TRIPLET {channel}"
-                            dataset_path = (
-                                f"{roots[index]}/{channel}/{rep} TRIPLET {channel}"
-                            )
-                            group1 = f"source_N{Nsource}_sink_N{Nsink}"
-                            dataset = read_hdf.extract_dataset(
-                                file_path, group2, roots[index], group1
-                            )
-                            with open("paths.log", "a") as file:
-                                print(dataset_path, file=file)
+                        dataset = store.get(ensemble, rep, channel, Nsource, Nsink)
                         if dataset is not None:
-                            translate.save_matrix_to_file2(
+                            translate.save_matrix_to_npy(
                                 dataset,
-                                f"corr_to_analyse_{channel}_{rep}_{ensemble}_Nsource{Nsource}_Nsink{Nsink}.txt",
+                                f"corr_to_analyse_{channel}_{rep}_{ensemble}_Nsource{Nsource}_Nsink{Nsink}.npy",
                             )
                         mpi = matrix_4D[index][1][k]
                         if kernel == "HALFNORMGAUSS":
@@ -410,7 +336,7 @@ def main():
                         sigma = tmp
                         decimal_part = tmp / matrix_4D[index][1][k] % 1
                         decimal_as_int = int(decimal_part * 100)
-                        datapath = f"./corr_to_analyse_{channel}_{rep}_{ensemble}_Nsource{Nsource}_Nsink{Nsink}.txt"
+                        datapath = f"./corr_to_analyse_{channel}_{rep}_{ensemble}_Nsource{Nsource}_Nsink{Nsink}.npy"
                         if kernel == "HALFNORMGAUSS":
                             kernel2 = "GAUSS"
                         elif kernel == "CAUCHY":
@@ -446,6 +372,11 @@ def main():
                         emax = 2.2
                         periodicity = "COSH"
                         prec = 105
+                        # Run at the lowest precision the conditioning allows, up to prec
+                        adaptive_prec = True
+                        # Also write one lsdensitiesamplesE<E>sig<sigma> text
+                        # file per energy, as older versions did
+                        text_samples = False
                         nboot = 300
                         e0 = 0.0
                         Na = 1
@@ -468,8 +399,12 @@ def main():
                             mpi,
                             spdens_outdir,
                             part_outdir,
+                            adaptive_prec=adaptive_prec,
+                            text_samples=text_samples,
                         )
 
+    store.close()
+
     # Avoid needing to work out the full tangle of output files,
     # while still allowing a workflow dependency on completing this rule
     with open("print_samples_mesons_complete", "w") as completion_tag_file:
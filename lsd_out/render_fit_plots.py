@@ -0,0 +1,78 @@
+import argparse
+import glob
+import multiprocessing
+import os
+
+import matplotlib.pyplot as plt
+from lsdensities.utils.rhoUtils import LogMessage
+
+import fit_bands
+
+parser = argparse.ArgumentParser(
+    description="Draw the spectral density fits stored by fit_data_* --plots-later"
+)
+parser.add_argument(
+    "sidecars",
+    nargs="*",
+    help="HDF5 sidecars to draw (default: every one in ./fitresults)",
+)
+parser.add_argument("--threads", type=int, default=1)
+args = parser.parse_args()
+
+# Same colours as the figures drawn directly by perform_fit
+COMPONENT_COLORS = ["chocolate", "olive", "orange", "pink"]
+SUM_COLOR = "gray"
+
+
+def render(sidecar_path):
+    sidecar = fit_bands.read_sidecar(sidecar_path)
+    x = sidecar["x"]
+
+    fig = plt.figure(figsize=(7, 4.5))
+    for central, lower, upper, color in zip(
+        sidecar["components/central"],
+        sidecar["components/lower"],
+        sidecar["components/upper"],
+        COMPONENT_COLORS,
+    ):
+        plt.plot(x, central, color=color, linewidth=1.6)
+        plt.fill_between(x, lower, upper, color=color, alpha=0.2)
+    plt.plot(x, sidecar["sum/central"], color=SUM_COLOR, linewidth=1.8)
+    plt.fill_between(
+        x,
+        sidecar["sum/lower"],
+        sidecar["sum/upper"],
+        color=SUM_COLOR,
+        alpha=0.25,
+        label="Error Bands",
+    )
+    plt.errorbar(
+        sidecar["data/x"],
+        sidecar["data/rho"],
+        yerr=sidecar["data/drho"],
+        fmt="o",
+        color="black",
+        markersize=3.0,
+        label="Spectral density",
+        elinewidth=1.2,
+    )
+    plt.title(sidecar["title"])
+    plt.grid(linestyle="dashed", alpha=0.6)
+
+    output_name = sidecar["output_name"]
+    if os.path.dirname(output_name):
+        os.makedirs(os.path.dirname(output_name), exist_ok=True)
+    plt.savefig(output_name, format="pdf", dpi=300)
+    plt.close(fig)
+    return output_name
+
+
+def main():
+    sidecars = args.sidecars or sorted(glob.glob("./fitresults/*.h5"))
+    with multiprocessing.Pool(processes=args.threads) as pool:
+        for output_name in pool.imap_unordered(render, sidecars):
+            print(LogMessage(), "Saved", output_name)
+
+
+if __name__ == "__main__":
+    main()
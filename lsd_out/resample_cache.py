@@ -0,0 +1,131 @@
+import hashlib
+import os
+import pickle
+import random
+
+import numpy as np
+
+import lsdensities.utils.rhoUtils as u
+from lsdensities.utils.rhoUtils import LogMessage
+from lsdensities.correlator.correlatorUtils import symmetrisePeriodicCorrelator
+from lsdensities.utils.rhoParallelUtils import ParallelBootstrapLoop
+
+CACHE_DIR = "./resample_cache"
+
+# Everything findRho derives from the raw correlator before the HLT inversion
+CACHED_FIELDS = [
+    "T",
+    "tmax",
+    "nms",
+    "sample",
+    "central",
+    "err",
+    "sigma",
+    "cov",
+    "corrmat",
+    "mpsample",
+    "mpcov",
+    "mpcentral",
+]
+
+
+def cache_path(par, seed, cache_dir=CACHE_DIR):
+    """
+    Location of the resampled correlator for par.datapath.
+
+    The key covers the content of the input file, the seed used for the
+    bootstrap and the working precision of the mpmath matrices, together with
+    the parameters that change the resampling itself.
+    """
+    key = hashlib.sha256()
+    with open(par.datapath, "rb") as datafile:
+        for chunk in iter(lambda: datafile.read(1 << 20), b""):
+            key.update(chunk)
+    key.update(
+        f"{seed}{par.prec}{par.num_boot}{par.periodicity}{par.tmax}".encode("utf-8")
+    )
+    return os.path.join(cache_dir, key.hexdigest() + ".pkl")
+
+
+def load(path):
+    if not os.path.isfile(path):
+        return None
+    with open(path, "rb") as cache_file:
+        fields = pickle.load(cache_file)
+    print(LogMessage(), "Loaded resampled correlator from", path)
+    corr = u.Obs(
+        T=fields["T"], tmax=fields["tmax"], nms=fields["nms"], is_resampled=True
+    )
+    for name in CACHED_FIELDS:
+        setattr(corr, name, fields[name])
+    return corr
+
+
+def save(corr, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write then rename, so that a concurrent reader never sees a partial file
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as cache_file:
+        pickle.dump(
+            {name: getattr(corr, name) for name in CACHED_FIELDS},
+            cache_file,
+            protocol=pickle.HIGHEST_PROTOCOL,
+        )
+    os.replace(tmp_path, path)
+
+
+def resample(par, rawcorr):
+    """Fold and bootstrap the raw correlator, then evaluate its covariance."""
+    rawcorr.evaluate()
+    rawcorr.tmax = par.tmax
+    if par.periodicity == "COSH":
+        print(LogMessage(), "Folding correlator")
+        symCorr = symmetrisePeriodicCorrelator(corr=rawcorr, par=par)
+        symCorr.evaluate()
+
+    #   Resampling
+    if par.periodicity == "EXP":
+        corr = u.Obs(
+            T=par.time_extent, tmax=par.tmax, nms=par.num_boot, is_resampled=True
+        )
+        resample = ParallelBootstrapLoop(par, rawcorr.sample, is_folded=False)
+    if par.periodicity == "COSH":
+        corr = u.Obs(
+            T=symCorr.T,
+            tmax=symCorr.tmax,
+            nms=par.num_boot,
+            is_resampled=True,
+        )
+        resample = ParallelBootstrapLoop(par, symCorr.sample, is_folded=False)
+
+    corr.sample = resample.run()
+    corr.evaluate()
+
+    #   Covariance
+    print(LogMessage(), "Evaluate covariance")
+    corr.evaluate_covmatrix(plot=False)
+    corr.corrmat_from_covmat(plot=False)
+
+    #   Turn correlator into mpmath variable
+    print(LogMessage(), "Converting correlator into mpmath type")
+    corr.fill_mp_sample()
+    return corr
+
+
+def get_resampled_correlator(par, rawcorr, seed, cache_dir=CACHE_DIR):
+    """
+    Resampled correlator with covariance and mpmath matrices filled in.
+
+    Taken from the cache when findRho already produced it for the same input,
+    seed and precision; computed and stored otherwise, with the random state
+    seeded from seed as findRho does, so that the stored bootstrap does not
+    depend on the caller.
+    """
+    path = cache_path(par, seed, cache_dir)
+    corr = load(path)
+    if corr is None:
+        random.seed(seed)
+        np.random.seed(random.randint(0, 2 ** (32) - 1))
+        corr = resample(par, rawcorr)
+        save(corr, path)
+    return corr
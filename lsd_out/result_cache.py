@@ -0,0 +1,79 @@
+import datetime
+import hashlib
+import json
+import os
+
+MANIFEST = "manifest.json"
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as datafile:
+        for chunk in iter(lambda: datafile.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def result_key(datapath, hltParams, **parameters):
+    """
+    Hash identifying an HLT result.
+
+    Covers the bytes of the input correlator, every AlgorithmParameters
+    field and the remaining run parameters (sigma, kernel, energy grid,
+    nboot, precision, ...), so that changing any of them gives a new key.
+    """
+    description = {
+        "input": file_digest(datapath),
+        "hltParams": {name: str(value) for name, value in vars(hltParams).items()},
+        "parameters": {name: str(value) for name, value in parameters.items()},
+    }
+    return (
+        hashlib.sha256(
+            json.dumps(description, sort_keys=True).encode("utf-8")
+        ).hexdigest(),
+        description,
+    )
+
+
+def produced_files(outdir):
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(outdir):
+        for filename in filenames:
+            filepath = os.path.join(dirpath, filename)
+            relative_path = os.path.relpath(filepath, outdir)
+            if relative_path != MANIFEST:
+                files[relative_path] = os.path.getsize(filepath)
+    return files
+
+
+def is_cached(outdir, key):
+    """True if outdir holds a complete result for key, as recorded in its manifest."""
+    manifest_path = os.path.join(outdir, MANIFEST)
+    if not os.path.isfile(manifest_path):
+        return False
+    with open(manifest_path) as manifest_file:
+        try:
+            manifest = json.load(manifest_file)
+        except json.JSONDecodeError:
+            return False
+    if manifest.get("key") != key:
+        return False
+    for relative_path, size in manifest["files"].items():
+        filepath = os.path.join(outdir, relative_path)
+        if not os.path.isfile(filepath) or os.path.getsize(filepath) != size:
+            return False
+    return True
+
+
+def write_manifest(outdir, key, description):
+    """Record the outputs of a completed run; only then does it count as cached."""
+    manifest = {
+        "key": key,
+        "created": datetime.datetime.now().astimezone().isoformat(),
+        **description,
+        "files": produced_files(outdir),
+    }
+    tmp_path = os.path.join(outdir, f"{MANIFEST}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+    os.replace(tmp_path, os.path.join(outdir, MANIFEST))
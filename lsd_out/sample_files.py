@@ -0,0 +1,91 @@
+import os
+import re
+
+import h5py
+import numpy as np
+
+# printSamples writes the bootstrap samples of rho at each energy E to a text
+# file lsdensitiesamplesE<E>sig<sigma>, one "<bootstrap> <rho>" line each
+SAMPLE_FILE_PATTERN = re.compile(r"E([\d.]+)sig")
+# All the energies of a sample directory in a single file
+PACKED_NAME = "lsdensitiesamples.h5"
+
+
+def sample_energy(file_name):
+    """Energy in the name of a sample file, None for any other file."""
+    match = SAMPLE_FILE_PATTERN.search(file_name)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+def read_sample_file(file_path, nboot=None):
+    """rho of the first nboot bootstraps (all if None) of one text sample file."""
+    with open(file_path, "rb") as sample_file:
+        values = np.array(sample_file.read().split(), dtype=float)
+    return values.reshape(-1, 2)[:nboot, 1]
+
+
+def read_text_directory(path, nboot=None):
+    """Energies and (nboot, n_energy) samples from the text files in path."""
+    file_names = [
+        file_name
+        for file_name in os.listdir(path)
+        if sample_energy(file_name) is not None
+        and os.path.isfile(os.path.join(path, file_name))
+    ]
+    file_names.sort(key=sample_energy)
+    energies = np.array([sample_energy(file_name) for file_name in file_names])
+    samples = np.column_stack(
+        [
+            read_sample_file(os.path.join(path, file_name), nboot)
+            for file_name in file_names
+        ]
+    )
+    return energies, samples
+
+
+def write_packed(path, energies, samples, sigma=None, rho=None, drho=None):
+    """
+    Store the samples of all energies in one HDF5 file.
+
+    samples has shape (nboot, n_energy), with energies in ascending order;
+    rho and drho are the central values and statistical errors at each
+    energy. If path is a directory, the file is PACKED_NAME inside it.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, PACKED_NAME)
+    with h5py.File(path, "w") as packed:
+        packed["energies"] = np.asarray(energies, dtype=float)
+        packed["samples"] = np.asarray(samples, dtype=float)
+        if sigma is not None:
+            packed.attrs["sigma"] = sigma
+        if rho is not None:
+            packed["rho"] = np.asarray(rho, dtype=float)
+        if drho is not None:
+            packed["drho"] = np.asarray(drho, dtype=float)
+    return path
+
+
+def read_packed(path, nboot=None):
+    """Energies and (nboot, n_energy) samples from a write_packed file."""
+    with h5py.File(path, "r") as packed:
+        energies = packed["energies"][()]
+        samples = packed["samples"][:nboot]
+    return energies, samples
+
+
+def read_samples(path, nboot=None):
+    """
+    Energies and bootstrap samples of rho, with shape (nboot, n_energy).
+
+    path is either a packed file, a directory holding PACKED_NAME, or a
+    directory of lsdensitiesamplesE<E>sig<sigma> text files. The energies
+    are in ascending order; only the first nboot bootstraps are kept unless
+    nboot is None.
+    """
+    if os.path.isfile(path):
+        return read_packed(path, nboot)
+    if os.path.isfile(os.path.join(path, PACKED_NAME)):
+        return read_packed(os.path.join(path, PACKED_NAME), nboot)
+    return read_text_directory(path, nboot)
@@ -3,7 +3,6 @@ import datetime
 import pathlib
 
 import os
-import re
 import numpy as np
 import matplotlib.pyplot as plt
 from lmfit import Model, Parameters, Minimizer
@@ -11,6 +10,9 @@ from scipy.special import erf
 from scipy.linalg import cholesky, cho_solve
 import csv
 
+import fit_bands
+import sample_files
+
 parser = argparse.ArgumentParser()
 parser.add_argument("--plot_styles", default="paperdraft.mplstyle")
 args = parser.parse_args()
@@ -115,52 +117,15 @@ def read_csv2(file_path):
     return matrix_2D
 
 
-def read_files_from_directory(directory):
-    files = os.listdir(directory)
-    files = [f for f in files if os.path.isfile(os.path.join(directory, f))]
-    files.sort()
-    return files
-
-
-def read_file_content(file_path):
-    with open(file_path, "r") as file:
-        content = file.readlines()
-    values = [float(line.split()[1]) for line in content]
-    return values
-
-
-def extract_energy_from_filename(filename):
-    match = re.search(r"E([\d.]+)sig", filename)
-    if match:
-        return float(match.group(1))
-    return None
-
-
 def fill_spectral_density_array(dir1, dir2, mpi):
-    files1 = read_files_from_directory(dir1)
-    files2 = read_files_from_directory(dir2)
+    energy_values, samples1 = sample_files.read_samples(dir1)
+    _, samples2 = sample_files.read_samples(dir2)
 
-    num_files = len(files1)
-    sample_content = read_file_content(os.path.join(dir1, files1[0]))
-    num_bootstraps = len(sample_content)
-    spectral_density = np.zeros((num_bootstraps, 2, num_files))
-
-    energy_values = []
-
-    for file_index, (file1, file2) in enumerate(zip(files1, files2)):
-        content1 = read_file_content(os.path.join(dir1, file1))
-        content2 = read_file_content(os.path.join(dir2, file2))
-        energy = extract_energy_from_filename(file1)
-        energy_values.append(energy)
-
-        if np.mean(content1) < 0:
-            content1 = [-elements for elements in content1]
-        if np.mean(content2) < 0:
-            content2 = [-elements for elements in content2]
-
-        for bootstrap_index in range(num_bootstraps):
-            spectral_density[bootstrap_index][0][file_index] = content1[bootstrap_index]
-            spectral_density[bootstrap_index][1][file_index] = content2[bootstrap_index]
+    # Flip the sign of the energies with a negative mean
+    samples1 = np.where(samples1.mean(axis=0) < 0, -samples1, samples1)
+    samples2 = np.where(samples2.mean(axis=0) < 0, -samples2, samples2)
+    spectral_density = np.stack([samples1, samples2], axis=1)
+    energy_values = list(energy_values)
 
     # Find the index k where energy_values first exceeds 1.2
     k = next(
@@ -302,21 +267,41 @@ def fit_spectral_density_2_single_fixed_params(
     return avg_params, std_params, fit_params
 
 
-"""
-def plot_with_errors_single(kernel, sigma, energy, avg_spectral_density1, avg_spectral_density2, fit_params_1, fit_params_2, num_bootstraps, spectral_density, mpi):
+def plot_with_errors_single(
+    kernel,
+    sigma,
+    energy,
+    avg_spectral_density1,
+    avg_spectral_density2,
+    fit_params_1,
+    fit_params_2,
+    num_bootstraps,
+    spectral_density,
+    mpi,
+):
     # Increase resolution for smoother curves
     energy_fine = np.linspace(min(energy) - 0.3, max(energy) + 0.3, 500)
 
-    # Calculate the fit curves and error bands for spectral_density_1
-    fit_curves_1 = np.array([spectral_density_1_single(kernel, sigma, energy_fine, *params) for params in fit_params_1])
-    mean_fit_curve_1 = np.mean(fit_curves_1, axis=0)
-    std_fit_curve_1 = np.std(fit_curves_1, axis=0)
+    # Fit curves of all bootstraps at once, (num_bootstraps, len(energy_fine))
+    fit_params_1 = np.asarray(fit_params_1)
+    fit_params_2 = np.asarray(fit_params_2)
+    band_1 = fit_bands.band_statistics(
+        spectral_density_1_single(
+            kernel, sigma, energy_fine, fit_params_1[:, 0:1], fit_params_1[:, 1:2]
+        )
+    )
+    mean_fit_curve_1 = band_1.mean
+    std_fit_curve_1 = band_1.std
 
     # Calculate the fit curves and error bands for spectral_density_2
     E0 = fit_params_1[0][1]  # Use the E0 from the first set of parameters
-    fit_curves_2 = np.array([spectral_density_2_single(kernel, sigma, energy_fine, c0, E0, fit_params_1[0][0]) for c0 in fit_params_2])
-    mean_fit_curve_2 = np.mean(fit_curves_2, axis=0)
-    std_fit_curve_2 = np.std(fit_curves_2, axis=0)
+    band_2 = fit_bands.band_statistics(
+        spectral_density_2_single(
+            kernel, sigma, energy_fine, fit_params_2[:, 0:1], E0, fit_params_1[0][0]
+        )
+    )
+    mean_fit_curve_2 = band_2.mean
+    std_fit_curve_2 = band_2.std
 
     # Error calculation for the data points
     error_spectral_density1 = np.std(spectral_density[:, 0, :], axis=0)
@@ -324,32 +309,75 @@ def plot_with_errors_single(kernel, sigma, energy, avg_spectral_density1, avg_sp
 
     plt.figure(figsize=(11, 5))
 
-
     # Plot for spectral_density_1
     plt.subplot(1, 2, 1)
-    plt.errorbar(energy, avg_spectral_density1, yerr=error_spectral_density1, fmt='o', label='Data for spectral_density_1', elinewidth=1.8, markersize=6.1, markerfacecolor='none', color=CB_color_cycle[0])
-    plt.plot(energy_fine, mean_fit_curve_1, color=CB_color_cycle[1], label='Mean Fit for spectral_density_1', linewidth=2.1)
-    plt.fill_between(energy_fine, mean_fit_curve_1 - std_fit_curve_1, mean_fit_curve_1 + std_fit_curve_1, color=CB_color_cycle[1], alpha=0.15)
-    plt.title('$N_{\\rm source} = 80$, $N_{\\rm sink} = 80$', fontsize=16)
-    plt.grid(linestyle='--')
-    plt.xlabel('$E/m_0$', fontsize=16)
-    plt.ylabel('$\\rho_{80, 80} (E)$', fontsize=16)
-
+    plt.errorbar(
+        energy,
+        avg_spectral_density1,
+        yerr=error_spectral_density1,
+        fmt="o",
+        label="Data for spectral_density_1",
+        elinewidth=1.8,
+        markersize=6.1,
+        markerfacecolor="none",
+        color=CB_color_cycle[0],
+    )
+    plt.plot(
+        energy_fine,
+        mean_fit_curve_1,
+        color=CB_color_cycle[1],
+        label="Mean Fit for spectral_density_1",
+        linewidth=2.1,
+    )
+    plt.fill_between(
+        energy_fine,
+        mean_fit_curve_1 - std_fit_curve_1,
+        mean_fit_curve_1 + std_fit_curve_1,
+        color=CB_color_cycle[1],
+        alpha=0.15,
+    )
+    plt.title("$N_{\\rm source} = 80$, $N_{\\rm sink} = 80$", fontsize=16)
+    plt.grid(linestyle="--")
+    plt.xlabel("$E/m_0$", fontsize=16)
+    plt.ylabel("$\\rho_{80, 80} (E)$", fontsize=16)
 
     # Plot for spectral_density_2
     plt.subplot(1, 2, 2)
-    plt.errorbar(energy, avg_spectral_density2, yerr=error_spectral_density2, fmt='o', label='Data for spectral_density_2', elinewidth=1.8, markersize=6.1, markerfacecolor='none', color=CB_color_cycle[0])
-    plt.plot(energy_fine, mean_fit_curve_2, color=CB_color_cycle[2], label='Mean Fit for spectral_density_2', linewidth=2.1)
-    plt.fill_between(energy_fine, mean_fit_curve_2 - std_fit_curve_2, mean_fit_curve_2 + std_fit_curve_2, color=CB_color_cycle[2], alpha=0.15)
-    plt.title('$N_{\\rm source} = 80$, $N_{\\rm sink} = 0$', fontsize=16)
-    plt.grid(linestyle='--')
-    plt.xlabel('$E/m_0$', fontsize=16)
-    plt.ylabel('$\\rho_{40, 80} (E)$', fontsize=16)
+    plt.errorbar(
+        energy,
+        avg_spectral_density2,
+        yerr=error_spectral_density2,
+        fmt="o",
+        label="Data for spectral_density_2",
+        elinewidth=1.8,
+        markersize=6.1,
+        markerfacecolor="none",
+        color=CB_color_cycle[0],
+    )
+    plt.plot(
+        energy_fine,
+        mean_fit_curve_2,
+        color=CB_color_cycle[2],
+        label="Mean Fit for spectral_density_2",
+        linewidth=2.1,
+    )
+    plt.fill_between(
+        energy_fine,
+        mean_fit_curve_2 - std_fit_curve_2,
+        mean_fit_curve_2 + std_fit_curve_2,
+        color=CB_color_cycle[2],
+        alpha=0.15,
+    )
+    plt.title("$N_{\\rm source} = 80$, $N_{\\rm sink} = 0$", fontsize=16)
+    plt.grid(linestyle="--")
+    plt.xlabel("$E/m_0$", fontsize=16)
+    plt.ylabel("$\\rho_{40, 80} (E)$", fontsize=16)
 
     plt.tight_layout()
-    plt.savefig(f"spectral_density_corr_mpi{mpi}.pdf", format='pdf', bbox_inches='tight')
-    #plt.show()
-"""
+    plt.savefig(
+        f"spectral_density_corr_mpi{mpi}.pdf", format="pdf", bbox_inches="tight"
+    )
+    # plt.show()
 
 
 def main():
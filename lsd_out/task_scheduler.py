@@ -0,0 +1,85 @@
+import functools
+import math
+import time
+
+import multiprocess
+from lsdensities.core import Smatrix_mp
+from lsdensities.utils.rhoUtils import LogMessage
+from mpmath import mp, mpf
+
+import adaptive_precision
+
+
+def time_extent(root):
+    """T from an HDF5 ensemble root such as chimera_out_96x20x20x20nc4..."""
+    return int(root.split("_")[2].split("x")[0])
+
+
+@functools.lru_cache(maxsize=None)
+def expected_precision(T, max_prec, e0=0.0, periodicity="COSH"):
+    """
+    Digits that the adaptive precision of findRho uses for time extent T.
+
+    adaptive_precision.estimate_digits takes the worse of the conditioning
+    of S and of Cov[C]. S depends only on T, so its part is known before
+    any task runs; Cov[C], and with it the effect of the smearing (80-80
+    against 80-0), is only known once the correlator is resampled, so it is
+    left out and the result is a lower bound.
+    """
+    with mp.workdps(max_prec):
+        S_ = Smatrix_mp(tmax_=T // 2, alpha_=0, e0_=mpf(e0), type=periodicity, T=T)
+        digits = (
+            math.ceil(float(mp.log10(mp.cond(S_)))) + adaptive_precision.GUARD_DIGITS
+        )
+    return min(digits, max_prec)
+
+
+def estimate_cost(T, nboot, prec, adaptive_prec=False):
+    """
+    Relative cost of one findRho call.
+
+    Dominated by the repeated inversions of the (T/2) x (T/2) HLT matrix, with
+    mpmath multiplication growing roughly as prec^1.6, plus the bootstrap
+    combinations, linear in nboot. With adaptive_prec, prec is the cap and
+    the precision is that of expected_precision.
+    """
+    if adaptive_prec:
+        prec = expected_precision(T, prec)
+    tmax = T // 2
+    return tmax**3 * prec**1.6 + nboot * tmax * prec**1.6
+
+
+def _timed_call(args):
+    function, label, task = args
+    start_time = time.time()
+    function(task)
+    return label, time.time() - start_time
+
+
+def run_longest_first(function, tasks, costs, labels, processes):
+    """
+    Apply function to every task on a pool, most expensive first.
+
+    Tasks are handed out one at a time (chunksize 1), so that a worker that
+    finishes early picks up the next task instead of idling while the
+    slowest chunk completes.
+    """
+    order = sorted(range(len(tasks)), key=lambda i: costs[i], reverse=True)
+    start_time = time.time()
+    with multiprocess.Pool(processes=processes) as pool:
+        for done, (label, elapsed) in enumerate(
+            pool.imap_unordered(
+                _timed_call,
+                [(function, labels[i], tasks[i]) for i in order],
+                chunksize=1,
+            ),
+            start=1,
+        ):
+            print(
+                LogMessage(),
+                f"Task {done}/{len(tasks)} ({label}) finished in {elapsed:.1f} s",
+            )
+    print(
+        LogMessage(),
+        f"{len(tasks)} tasks finished in {time.time() - start_time:.1f} s",
+    )
@@ -1,4 +1,5 @@
 import numpy as np
+import lsdensities.utils.rhoUtils as u
 
 
 def save_matrix_to_file(matrix, output_file):
@@ -19,3 +20,31 @@ def save_matrix_to_file2(matrix, output_file):
         for col in range(N):
             for row in range(R):
                 output_file.write(f"{row % R} {matrix[row, col]}\n")
+
+
+def save_matrix_to_npy(matrix, output_file):
+    # Binary counterpart of save_matrix_to_file2: the (time, configuration)
+    # dataset is stored transposed, as the (configuration, time) sample that
+    # lsdensities works with, so that it can be memory-mapped on read
+    np.save(output_file, np.ascontiguousarray(np.asarray(matrix, dtype=np.float64).T))
+
+
+def read_datafile(datapath, resampled=False):
+    """
+    Drop-in replacement for lsdensities.utils.rhoUtils.read_datafile.
+
+    .npy files written by save_matrix_to_npy are memory-mapped; anything
+    else is handed to the lsdensities text reader.
+    """
+    if not datapath.endswith(".npy"):
+        return u.read_datafile(datapath, resampled=resampled)
+
+    sample = np.load(datapath, mmap_mode="r")
+    header_nms, header_T = sample.shape
+    print(u.LogMessage(), "Reading file :::", "Time extent ", header_T)
+    print(u.LogMessage(), "Reading file :::", "Measurements ", header_nms)
+    mcorr_ = u.Obs(
+        T=header_T, tmax=header_T - 1, nms=header_nms, is_resampled=resampled
+    )
+    mcorr_.sample = sample
+    return mcorr_, header_T, header_nms
@@ -0,0 +1,174 @@
+import numpy as np
+
+
+def fit_times(plateau_start, plateau_end, tp=None):
+    """Time slices that corrfitter's Corr2 fits for tmin, tmax and tp."""
+    if tp is not None:
+        plateau_end = min(plateau_end, abs(tp) // 2)
+    return np.arange(plateau_start, plateau_end + 1)
+
+
+def is_symmetric(C_boot, t, tp, sign=1):
+    """
+    Whether C(t) = sign * C(tp - t) for every sample, in which case the
+    average of the two that corrfitter fits with tp is just C(t).
+    """
+    if tp is None:
+        return True
+    return np.allclose(
+        C_boot[:, t], sign * C_boot[:, (tp - t) % tp], rtol=1e-12, atol=0
+    )
+
+
+def whitening(cov, t):
+    """Inverse of the Cholesky factor of the covariance of the fitted C(t)."""
+    return np.linalg.inv(np.linalg.cholesky(cov[np.ix_(t, t)]))
+
+
+def time_dependence(t, E, tp=None, sign=1):
+    """
+    e^{-E t} + sign * e^{-E (tp - t)}, or e^{-E t} without tp, and its
+    derivative with respect to log(E), for a column of energies E.
+    """
+    shape = np.exp(-E * t)
+    dshape = -t * shape
+    if tp is not None:
+        shape = shape + sign * np.exp(-E * (tp - t))
+        dshape = dshape - sign * (tp - t) * np.exp(-E * (tp - t))
+    return shape, dshape * E
+
+
+def levenberg_marquardt(
+    residuals, params, max_iterations=200, tolerance=1e-10, gradient_tolerance=1e-6
+):
+    """
+    Minimise the sum of squared residuals for many independent problems.
+
+    params has shape (nsamples, nparams); residuals(params, idx) returns the
+    residuals, (len(idx), ndata), and their Jacobian, (len(idx), ndata,
+    nparams), of the problems idx at params. Every problem has its own
+    damping and converges once an accepted step is below tolerance, or when
+    no step is accepted any more at a point where the cosine between the
+    residuals and each column of the Jacobian is below gradient_tolerance.
+    Returns the parameters and whether each problem converged.
+    """
+    params = params.copy()
+    num_sample, num_params = params.shape
+    residual, jacobian = residuals(params, np.arange(num_sample))
+    chi2 = (residual**2).sum(axis=1)
+    damping = np.full(num_sample, 1e-3)
+    active = np.ones(num_sample, dtype=bool)
+    converged = np.zeros(num_sample, dtype=bool)
+
+    for _ in range(max_iterations):
+        idx = np.flatnonzero(active)
+        if len(idx) == 0:
+            break
+        jtj = jacobian[idx].swapaxes(1, 2) @ jacobian[idx]
+        gradient = (jacobian[idx].swapaxes(1, 2) @ residual[idx, :, np.newaxis])[..., 0]
+        diagonal = np.diagonal(jtj, axis1=1, axis2=2)
+        step = -np.linalg.solve(
+            jtj + damping[idx, None, None] * diagonal[:, :, None] * np.eye(num_params),
+            gradient[..., np.newaxis],
+        )[..., 0]
+        with np.errstate(over="ignore", invalid="ignore"):
+            trial_residual, trial_jacobian = residuals(params[idx] + step, idx)
+            trial_chi2 = (trial_residual**2).sum(axis=1)
+
+        better = trial_chi2 < chi2[idx]
+        accepted = idx[better]
+        params[accepted] += step[better]
+        residual[accepted] = trial_residual[better]
+        jacobian[accepted] = trial_jacobian[better]
+        chi2[accepted] = trial_chi2[better]
+        damping[idx] = np.where(better, damping[idx] / 10, damping[idx] * 10)
+
+        # Rejected steps only get small because the damping grows, so they
+        # do not count as converging; a problem whose steps are all rejected
+        # has converged only if it is at a stationary point
+        small_step = np.abs(step).max(axis=1) < tolerance * (
+            1 + np.abs(params[idx]).max(1)
+        )
+        stalled = damping[idx] > 1e12
+        stationary = np.all(
+            np.abs(gradient)
+            <= gradient_tolerance * np.sqrt(diagonal * chi2[idx, np.newaxis]),
+            axis=1,
+        )
+        done = (better & small_step) | (stalled & stationary)
+        converged[idx[done]] = True
+        active[idx[done | stalled]] = False
+
+    return params, converged
+
+
+def fit_single_state(C_boot, cov, t, p0, tp=None):
+    """
+    Correlated fit of a^2 (e^{-E t} + e^{-E (tp - t)}) to every sample.
+
+    Minimises the same chi^2 as a one-state corrfitter fit with a = b and
+    flat priors on log(a) and log(E), for all samples at once, starting
+    from p0. The inverse covariance is factorised once. Returns E, a and
+    whether each sample converged.
+    """
+    data = C_boot[:, t]
+    W = whitening(cov, t)
+
+    def residuals(params, idx):
+        a2 = np.exp(2 * params[:, 0, np.newaxis])
+        shape, dshape = time_dependence(t, np.exp(params[:, 1, np.newaxis]), tp)
+        model = a2 * shape
+        jacobian = np.stack([2 * model, a2 * dshape], axis=-1)
+        return (model - data[idx]) @ W.T, W @ jacobian
+
+    params, converged = levenberg_marquardt(
+        residuals, np.tile([p0["log(a)"][0], p0["log(dE)"][0]], (len(data), 1))
+    )
+    return np.exp(params[:, 1]), np.exp(params[:, 0]), converged
+
+
+def fit_simultaneous(Css, Csp, cov_ss, cov_sp, t, p0, tp=None, sinh=False):
+    """
+    Simultaneous fit of a^2 (e^{-E t} + e^{-E (tp - t)}) to Css and
+    a b (e^{-E t} +/- e^{-E (tp - t)}) to Csp, for every sample.
+
+    The same chi^2 as the one-state corrfitter fit of simultaneous_model,
+    with Css and Csp uncorrelated and flat priors on log(a), log(b) and
+    log(E), minimised for all samples at once from p0. Returns E, a, b and
+    whether each sample converged.
+    """
+    data_ss = Css[:, t]
+    data_sp = Csp[:, t]
+    W_ss = whitening(cov_ss, t)
+    W_sp = whitening(cov_sp, t)
+    sign = -1 if sinh else 1
+
+    def residuals(params, idx):
+        a = np.exp(params[:, 0, np.newaxis])
+        b = np.exp(params[:, 1, np.newaxis])
+        E = np.exp(params[:, 2, np.newaxis])
+        shape_ss, dshape_ss = time_dependence(t, E, tp)
+        shape_sp, dshape_sp = time_dependence(t, E, tp, sign)
+        model_ss = a * a * shape_ss
+        model_sp = a * b * shape_sp
+        jacobian_ss = np.stack(
+            [2 * model_ss, np.zeros_like(model_ss), a * a * dshape_ss], axis=-1
+        )
+        jacobian_sp = np.stack([model_sp, model_sp, a * b * dshape_sp], axis=-1)
+        residual = np.concatenate(
+            [(model_ss - data_ss[idx]) @ W_ss.T, (model_sp - data_sp[idx]) @ W_sp.T],
+            axis=1,
+        )
+        jacobian = np.concatenate([W_ss @ jacobian_ss, W_sp @ jacobian_sp], axis=1)
+        return residual, jacobian
+
+    start = [p0["log(a)"][0], p0["log(b)"][0], p0["log(dE)"][0]]
+    params, converged = levenberg_marquardt(
+        residuals, np.tile(start, (len(data_ss), 1))
+    )
+    return (
+        np.exp(params[:, 2]),
+        np.exp(params[:, 0]),
+        np.exp(params[:, 1]),
+        converged,
+    )
@@ -21,7 +21,37 @@ def get_rng(name):
     return np.random.default_rng(seed)
 
 
+# Count matrices already drawn, by ensemble name and number of configurations
+_resampling_plans = {}
+
+
+def get_resampling_plan(name, num_configs):
+    """
+    How many times each configuration enters each bootstrap sample.
+
+    Drawn from get_rng(name) with the same indices as sample_bootstrap_1d,
+    once per ensemble; the (BOOTSTRAP_SAMPLE_COUNT, num_configs) matrix is
+    then reused for every observable of that ensemble.
+    """
+    key = (name, num_configs)
+    if key not in _resampling_plans:
+        configurations = get_rng(name).integers(
+            num_configs, size=(BOOTSTRAP_SAMPLE_COUNT, num_configs)
+        )
+        rows = np.arange(BOOTSTRAP_SAMPLE_COUNT)[:, np.newaxis]
+        counts = np.bincount(
+            (rows * num_configs + configurations).ravel(),
+            minlength=BOOTSTRAP_SAMPLE_COUNT * num_configs,
+        )
+        _resampling_plans[key] = counts.reshape(
+            BOOTSTRAP_SAMPLE_COUNT, num_configs
+        ).astype(float)
+    return _resampling_plans[key]
+
+
 class BootstrapSampleSet:
+    __slots__ = ("mean", "samples")
+
     def __init__(self, mean, samples):
         self.mean = mean
 
@@ -32,46 +62,75 @@ class BootstrapSampleSet:
         else:
             self.samples = np.asarray(samples)
 
-    def __add__(self, other):
-        if isinstance(other, BootstrapSampleSet):
+    @classmethod
+    def empty(cls, shape=(), filename=None):
+        """
+        An uninitialised set, with a mean of the given shape and samples of
+        shape (BOOTSTRAP_SAMPLE_COUNT, *shape). If filename is given, the
+        samples are a memory map of that file rather than held in memory.
+        """
+        shape = (BOOTSTRAP_SAMPLE_COUNT, *shape)
+        if filename is None:
+            samples = np.empty(shape)
+        else:
+            samples = np.memmap(filename, dtype=float, mode="w+", shape=shape)
+        return cls(np.empty(shape[1:]), samples)
+
+    def apply(self, ufunc, *others, out=None):
+        """
+        Apply a NumPy ufunc to the mean and samples of this and any other
+        sets or constants. With out, the result is written into the arrays
+        of out (which may be self, or views of a larger set) instead of
+        new ones; a mean that is not an array is replaced instead.
+        """
+        means = [o.mean if isinstance(o, BootstrapSampleSet) else o for o in others]
+        samples = [
+            o.samples if isinstance(o, BootstrapSampleSet) else o for o in others
+        ]
+        if out is None:
             return BootstrapSampleSet(
-                self.mean + other.mean, self.samples + other.samples
+                ufunc(self.mean, *means), ufunc(self.samples, *samples)
             )
+
+        ufunc(self.samples, *samples, out=out.samples)
+        if isinstance(out.mean, np.ndarray):
+            ufunc(self.mean, *means, out=out.mean)
         else:
-            return BootstrapSampleSet(self.mean + other, self.samples + other)
+            out.mean = ufunc(self.mean, *means)
+        return out
+
+    def add(self, other, out=None):
+        return self.apply(np.add, other, out=out)
+
+    def subtract(self, other, out=None):
+        return self.apply(np.subtract, other, out=out)
+
+    def multiply(self, other, out=None):
+        return self.apply(np.multiply, other, out=out)
+
+    def divide(self, other, out=None):
+        return self.apply(np.divide, other, out=out)
+
+    def __add__(self, other):
+        return self.add(other)
 
     def __radd__(self, other):
         return self + other
 
     def __sub__(self, other):
-        if isinstance(other, BootstrapSampleSet):
-            return BootstrapSampleSet(
-                self.mean - other.mean, self.samples - other.samples
-            )
-        else:
-            return BootstrapSampleSet(self.mean - other, self.samples - other)
+        return self.subtract(other)
 
     def __rsub__(self, other):
         return self - other
 
     def __mul__(self, other):
-        if isinstance(other, BootstrapSampleSet):
-            return BootstrapSampleSet(
-                self.mean * other.mean, self.samples * other.samples
-            )
-        else:
-            return BootstrapSampleSet(self.mean * other, self.samples * other)
+        return self.multiply(other)
 
     def __rmul__(self, other):
         return self * other
 
     def __truediv__(self, other):
-        if isinstance(other, BootstrapSampleSet):
-            return BootstrapSampleSet(
-                self.mean / other.mean, self.samples / other.samples
-            )
-        else:
-            return BootstrapSampleSet(self.mean / other, self.samples / other)
+        return self.divide(other)
 
     def __rtruediv__(self, other):
         return BootstrapSampleSet(other / self.mean, other / self.samples)
@@ -85,8 +144,8 @@ class BootstrapSampleSet:
     def __getitem__(self, key):
         return BootstrapSampleSet(self.mean[key], self.samples[:, key])
 
-    def arccosh(self):
-        return BootstrapSampleSet(np.arccosh(self.mean), np.arccosh(self.samples))
+    def arccosh(self, out=None):
+        return self.apply(np.arccosh, out=out)
 
     def std(self):
         return self.samples.std(axis=0)
@@ -119,6 +178,20 @@ def sample_bootstrap_1d(values, *args, **kwargs):
     )
 
 
+def sample_bootstrap_plan(values, name):
+    """
+    sample_bootstrap_1d(values, get_rng(name)) as a single matrix product.
+
+    Agrees with it up to rounding, as the configurations are summed in a
+    different order.
+    """
+    values_array = np.asarray(values)
+    counts = get_resampling_plan(name, values_array.shape[0])
+    return BootstrapSampleSet(
+        values_array.mean(axis=0), counts @ values_array / values_array.shape[0]
+    )
+
+
 def bootstrap_finalize(samples):
     if isinstance(samples, BootstrapSampleSet):
         return samples.to_ufloat()
@@ -130,7 +203,9 @@ __all__ = [
     "basic_bootstrap",
     "sample_bootstrap_0d",
     "sample_bootstrap_1d",
+    "sample_bootstrap_plan",
     "bootstrap_finalize",
     "BOOTSTRAP_SAMPLE_COUNT",
     "get_rng",
+    "get_resampling_plan",
 ]
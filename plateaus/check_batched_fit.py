@@ -0,0 +1,142 @@
+import argparse
+import time
+
+import gvar as gv
+import numpy as np
+
+from . import fitting
+
+# Compare the batched fits of fit_single_state_samples and
+# fit_simultaneous_samples with the per-sample corrfitter fits they replace,
+# on synthetic one-state correlators with correlated noise.
+# Usage: python -m plateaus.check_batched_fit
+
+
+def get_args():
+    parser = argparse.ArgumentParser(
+        description="Compare batched and per-sample corrfitter plateau fits"
+    )
+    parser.add_argument("--nboot", type=int, default=100)
+    parser.add_argument("--Nt", type=int, default=24)
+    parser.add_argument("--noise", type=float, default=0.01)
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=1e-3,
+        help="Largest accepted sample difference, in standard deviations",
+    )
+    return parser.parse_args()
+
+
+def synthetic_samples(E, amplitude, t, tp, sign, nboot, noise, rng):
+    """
+    Samples of amplitude (e^{-E t} + sign e^{-E (tp - t)}), or of
+    amplitude e^{-E t} without tp, with noise correlated between nearby t
+    and, with tp, the symmetry of the data about tp / 2.
+    """
+    half = np.arange(len(t) // 2 + 1) if tp else t
+    distance = np.abs(half[:, None] - half[None, :])
+    correlation = 0.7**distance
+    fluctuation = rng.multivariate_normal(np.zeros(len(half)), correlation, nboot)
+    if tp:
+        fluctuation = np.concatenate(
+            [fluctuation, fluctuation[:, len(t) - len(half) : 0 : -1]], axis=1
+        )
+        shape = np.exp(-E * t) + sign * np.exp(-E * (tp - t))
+    else:
+        shape = np.exp(-E * t)
+    return amplitude * shape * (1 + noise * fluctuation)
+
+
+def compare(name, batched, reference, tolerance):
+    worst = 0.0
+    for label, new, old in zip(["E", "a", "b"], batched, reference):
+        difference = np.abs(new - old).max() / old.std()
+        worst = max(worst, difference)
+        print(f"{name:>16} {label}: largest sample difference {difference:.2e} sigma")
+    return worst <= tolerance
+
+
+def main():
+    args = get_args()
+    rng = np.random.default_rng(1)
+    t = np.arange(args.Nt)
+    E, a, b = 0.5, 0.8, 0.5
+    plateau_start, plateau_end = 4, 10
+    agree = True
+
+    for name, tp, sinh in [
+        ("cosh", args.Nt, False),
+        ("cosh-sinh", args.Nt, True),
+        ("exp", None, False),
+    ]:
+        sign = -1 if sinh else 1
+        Css = synthetic_samples(E, a * a, t, tp, 1, args.nboot, args.noise, rng)
+        Csp = synthetic_samples(E, a * b, t, tp, sign, args.nboot, args.noise, rng)
+        cov_ss = np.cov(Css.T)
+        cov_sp = np.cov(Csp.T)
+        fit_model = fitting.simultaneous_model(
+            plateau_start, plateau_end, tp=tp, sinh=sinh
+        )
+        p0 = {
+            "log(a)": np.log([a]),
+            "log(b)": np.log([b]),
+            "log(dE)": np.log([E]),
+        }
+        mean_fit = fitting.fit_correlator_simultaneous(
+            dict(
+                Gab=gv.gvar(Csp.mean(axis=0), cov_sp),
+                Gaa=gv.gvar(Css.mean(axis=0), cov_ss),
+            ),
+            fit_model,
+            1,
+            p0,
+        )[:3]
+
+        results = {}
+        for batched in [True, False]:
+            start = time.perf_counter()
+            results[batched] = fitting.fit_simultaneous_samples(
+                Css,
+                Csp,
+                cov_ss,
+                cov_sp,
+                fit_model,
+                p0,
+                mean_fit,
+                plateau_start,
+                plateau_end,
+                tp,
+                sinh,
+                batched=batched,
+            )
+            print(
+                f"{name:>16}: {'batched' if batched else 'corrfitter'} "
+                f"{time.perf_counter() - start:.2f} s"
+            )
+        agree &= compare(name, results[True], results[False], args.tolerance)
+
+        if sinh:
+            continue
+        results = {}
+        for batched in [True, False]:
+            results[batched] = fitting.fit_single_state_samples(
+                Css,
+                cov_ss,
+                plateau_start,
+                plateau_end,
+                tp,
+                {"log(a)": p0["log(a)"], "log(dE)": p0["log(dE)"]},
+                batched=batched,
+            )
+        agree &= compare(
+            f"{name} single", results[True], results[False], args.tolerance
+        )
+
+    if not agree:
+        raise ValueError("Batched and corrfitter fits disagree.")
+    print("Fits agree.")
+
+
+if __name__ == "__main__":
+    main()
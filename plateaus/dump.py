@@ -2,7 +2,9 @@
 
 from collections import defaultdict
 import json
+import os
 
+import h5py
 import numpy as np
 import pandas as pd
 from uncertainties import ufloat, UFloat
@@ -40,7 +42,75 @@ def dump_samples(data, fp):
             to_write[f"{k}_samples"] = v.samples.tolist()
         else:
             to_write[k] = v
-    return json.dump(to_write, fp)
+    result = json.dump(to_write, fp)
+    if os.path.splitext(fp.name)[1] == ".json":
+        # Written after the JSON, so that read_sample_file can tell the copy
+        # is up to date from the modification times
+        fp.flush()
+        dump_samples_hdf5(data, sample_store_filename(fp.name))
+    return result
+
+
+def sample_store_filename(filename):
+    """The HDF5 file that dump_samples writes next to a JSON sample file."""
+    return os.path.splitext(filename)[0] + ".h5"
+
+
+def dump_samples_hdf5(data, filename):
+    """
+    Write the same keys as dump_samples to an HDF5 file.
+
+    The samples of all BootstrapSampleSets are packed into the rows of a
+    single "samples" dataset of shape (rows, BOOTSTRAP_SAMPLE_COUNT), so that
+    each set's samples are contiguous on disk and a file costs one dataset
+    however many sets it holds. All other entries are kept as JSON in the
+    "metadata" attribute, and the first row, shape and central value of each
+    set in the "layout" attribute.
+    """
+    metadata = {}
+    layout = {}
+    samples = []
+    start = 0
+    for k, v in data.items():
+        if isinstance(v, BootstrapSampleSet):
+            set_samples = np.asarray(v.samples, dtype=float)
+            shape = set_samples.shape[1:]
+            layout[f"{k}_samples"] = [
+                start,
+                list(shape),
+                np.asarray(v.mean, dtype=float).tolist(),
+            ]
+            samples.append(set_samples.reshape(len(set_samples), -1).T)
+            start += samples[-1].shape[0]
+        elif isinstance(v, np.ndarray):
+            metadata[k] = v.tolist()
+        elif isinstance(v, np.int64):
+            metadata[k] = int(v)
+        else:
+            metadata[k] = v
+
+    with h5py.File(filename, "w") as f:
+        f.attrs["metadata"] = json.dumps(metadata)
+        f.attrs["layout"] = json.dumps(layout)
+        if layout:
+            f["samples"] = np.concatenate(samples)
+
+
+def memmap_dataset(filename, dataset):
+    """
+    An HDF5 dataset mapped straight from the file on disk.
+
+    The map is copy-on-write: the array can be modified like one read into
+    memory, without changing the file. Only contiguous datasets have a
+    single offset; anything else (chunked, compressed or empty) is read into
+    memory instead.
+    """
+    offset = dataset.id.get_offset()
+    if offset is None or dataset.chunks is not None or dataset.size == 0:
+        return dataset[()]
+    return np.memmap(
+        filename, mode="c", dtype=dataset.dtype, shape=dataset.shape, offset=offset
+    ).view(np.ndarray)
 
 
 def combine_df_ufloats(df):
@@ -118,7 +188,52 @@ def read_files(filenames, index_name="ensemble_name"):
     return combine_df_ufloats(result)
 
 
-def read_sample_file(filename):
+def read_sample_store(filename):
+    """
+    Contents of a dump_samples_hdf5 file, in the form of read_sample_file.
+
+    Samples are views of a copy-on-write memory map of the file, so only the
+    pages that are used are read.
+    """
+    with h5py.File(filename, "r") as f:
+        raw_data = json.loads(f.attrs["metadata"])
+        layout = json.loads(f.attrs["layout"])
+        if not layout:
+            return raw_data
+        samples = memmap_dataset(filename, f["samples"])
+
+    data = {}
+    for samples_field, (start, shape, value) in layout.items():
+        size = int(np.prod(shape))
+        data[samples_field] = BootstrapSampleSet(
+            np.asarray(value) if shape else value,
+            samples[start : start + size].T.reshape(-1, *shape),
+        )
+
+    return {**data, **raw_data}
+
+
+def read_sample_file(filename, backend="auto"):
+    """
+    Read a file from dump_samples.
+
+    backend is "json" to parse the JSON file, "hdf5" to read its HDF5 copy,
+    or "auto" to read the HDF5 copy when there is one no older than the JSON
+    file. HDF5 files may also be given directly.
+    """
+    if backend not in ("auto", "json", "hdf5"):
+        raise ValueError(f"Unknown sample file backend {backend}")
+    if os.path.splitext(filename)[1] == ".h5":
+        return read_sample_store(filename)
+
+    store_filename = sample_store_filename(filename)
+    if backend == "hdf5" or (
+        backend == "auto"
+        and os.path.exists(store_filename)
+        and os.path.getmtime(store_filename) >= os.path.getmtime(filename)
+    ):
+        return read_sample_store(store_filename)
+
     with open(filename, "r") as f:
         raw_data = json.load(f)
 
@@ -135,10 +250,10 @@ def read_sample_file(filename):
     return {**data, **raw_data}
 
 
-def read_sample_files(filenames, group_key="ensemble_name"):
+def read_sample_files(filenames, group_key="ensemble_name", backend="auto"):
     results = {}
     for filename in filenames:
-        file_data = read_sample_file(filename)
+        file_data = read_sample_file(filename, backend=backend)
         if file_data.get(group_key) not in results:
             results[file_data.get(group_key)] = file_data
         else:
@@ -1,9 +1,16 @@
+import itertools
+import logging
+
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy import linalg
 from . import fitting
 from .bootstrap import BootstrapSampleSet, BOOTSTRAP_SAMPLE_COUNT
 
+logger = logging.getLogger(__name__)
+
+# track_states scores all n! orderings of the states at once
+MAX_TRACKED_STATES = 6
+
 
 def extract_meson_mass(C_tmp, plateau_start, plateau_end):
     E_fit, A_fit, chisquare = fitting.fit_cosh_bootstrap(
@@ -24,37 +31,106 @@ def meson_decay_constant(Css, Csp, plateau_start, plateau_end):
     return E_fit, A_fit, round(chisquare, 2)
 
 
-def gevp_fixT(Cmat_mean, Cmat, t0, ti, tf):
-    Mshape = Cmat.shape
+def symmetrise(C):
+    return (C + C.swapaxes(-1, -2)) / 2
 
-    Lambda_n_sample = np.zeros(shape=(Mshape[0], Mshape[1], Mshape[2]))
-    Lambda_n_mean = np.zeros(shape=(1, Mshape[1], Mshape[2]))
 
-    T_dot = np.arange(ti, tf, 1, dtype=int)
-    for t in T_dot:
-        for N in range(Mshape[0]):
-            value, vector = linalg.eig(
-                Cmat[N, t], Cmat[N, t0], overwrite_a=True, overwrite_b=True
-            )
+def gevp_eigensystem(C, C0):
+    """
+    Solve C v = lambda C0 v for stacks of matrices at once.
+
+    C has shape (..., n, n) and C0 broadcasts against it; both are replaced
+    by their symmetric parts, and C0 must be positive definite. With
+    C0 = L L^T, the problem becomes the symmetric eigenproblem of
+    L^-1 C L^-T, which numpy solves for the whole stack in one call.
+    Returns the eigenvalues in ascending order and the orthonormal
+    eigenvectors of L^-1 C L^-T as columns.
+    """
+    L_inv = np.linalg.inv(np.linalg.cholesky(symmetrise(C0)))
+    whitened = L_inv @ symmetrise(C) @ L_inv.swapaxes(-1, -2)
+    return np.linalg.eigh(symmetrise(whitened))
+
 
-            for n in range(Mshape[2]):
-                Lambda_n_sample[N, t, n] = np.real(value[n])
+def gevp_eigenvalues_general(C, C0):
+    """Real parts of the eigenvalues of C0^-1 C, ascending, for stacks of matrices."""
+    C0 = np.broadcast_to(C0, C.shape)
+    return np.sort(np.real(np.linalg.eigvals(np.linalg.solve(C0, C))), axis=-1)
 
-        #### mean set ####
-        value_m, vector_m = linalg.eig(
-            Cmat_mean[0, t], Cmat_mean[0, t0], overwrite_a=True, overwrite_b=True
+
+def track_states(eigenvalues, eigenvectors):
+    """
+    Order the states at each t by overlap with the previous time slice.
+
+    eigenvalues has shape (..., nt, n) and eigenvectors (..., nt, n, n).
+    The states at the first time slice are ordered by decreasing
+    eigenvalue; at every later one, the permutation of the eigenvectors
+    with the largest total overlap with the previous ones is chosen.
+    """
+    num_states = eigenvalues.shape[-1]
+    if num_states > MAX_TRACKED_STATES:
+        raise ValueError(
+            f"Cannot track {num_states} states; at most {MAX_TRACKED_STATES} "
+            "are supported."
+        )
+    permutations = np.array(list(itertools.permutations(range(num_states))))
+    order = np.argsort(-eigenvalues[..., 0, :], axis=-1)
+    tracked = np.empty_like(eigenvalues)
+    tracked[..., 0, :] = np.take_along_axis(eigenvalues[..., 0, :], order, axis=-1)
+    previous = np.take_along_axis(eigenvectors[..., 0, :, :], order[..., None, :], -1)
+    for t in range(1, eigenvalues.shape[-2]):
+        overlaps = np.abs(previous.swapaxes(-1, -2) @ eigenvectors[..., t, :, :])
+        scores = overlaps[..., np.arange(num_states), permutations].sum(axis=-1)
+        order = permutations[np.argmax(scores, axis=-1)]
+        tracked[..., t, :] = np.take_along_axis(eigenvalues[..., t, :], order, axis=-1)
+        previous = np.take_along_axis(
+            eigenvectors[..., t, :, :], order[..., None, :], -1
         )
+    return tracked
+
+
+def gevp_time_slices(C, t0, ti, tf, track_vectors=False):
+    """
+    Eigenvalues of C(t) v = lambda C(t0) v for ti <= t < tf, in decreasing
+    order or, with track_vectors, following the eigenvectors in t.
+
+    C has shape (nsamples, T, n, n); the result is (nsamples, T, n), zero
+    outside the range of t. By default these are the real parts of the
+    eigenvalues of C(t0)^-1 C(t), as the measured matrices are not exactly
+    symmetric. Tracking needs orthonormal eigenvectors, so with
+    track_vectors the symmetric parts of C(t) and C(t0) are used instead,
+    except in the samples where C(t0) is not positive definite; those
+    keep the general eigenvalues in decreasing order.
+    """
+    Lambda_n = np.zeros(shape=C.shape[:3])
+    C_t = C[:, ti:tf]
+    C_t0 = C[:, t0, np.newaxis]
+    if not track_vectors:
+        Lambda_n[:, ti:tf] = gevp_eigenvalues_general(C_t, C_t0)[..., ::-1]
+        return Lambda_n
+
+    positive = np.all(np.linalg.eigvalsh(symmetrise(C_t0)) > 0, axis=(-2, -1))
+    if not positive.all():
+        logger.warning(
+            f"C(t0) is not positive definite in {np.count_nonzero(~positive)} "
+            "samples; their eigenvalues are not tracked"
+        )
+        Lambda_n[~positive, ti:tf] = gevp_eigenvalues_general(
+            C_t[~positive], C_t0[~positive]
+        )[..., ::-1]
+        if not positive.any():
+            return Lambda_n
+
+    values, vectors = gevp_eigensystem(C_t[positive], C_t0[positive])
+    Lambda_n[positive, ti:tf] = track_states(values, vectors)
+    return Lambda_n
 
-        for n in range(Mshape[2]):
-            Lambda_n_mean[0, t, n] = np.real(value_m[n])
 
-    Lambda_n_sample.sort(axis=2)
-    Lambda_n_mean.sort(axis=2)
+def gevp_fixT(Cmat_mean, Cmat, t0, ti, tf, track_vectors=False):
+    samples = gevp_time_slices(Cmat, t0, ti, tf, track_vectors=track_vectors)
+    mean = gevp_time_slices(Cmat_mean, t0, ti, tf, track_vectors=track_vectors)
 
-    samples = Lambda_n_sample[:, :, ::-1]
-    mean = Lambda_n_mean[:, :, ::-1]
     eigenvalues = []
-    for n in range(Mshape[2]):
+    for n in range(Cmat.shape[2]):
         eigenvalues.append(BootstrapSampleSet(mean[:, :, n], samples[:, :, n]))
 
     return eigenvalues
@@ -9,6 +9,9 @@ import warnings
 warnings.filterwarnings("ignore")
 
 from .bootstrap import BootstrapSampleSet
+from . import batched_fit
+
+logger = logging.getLogger(__name__)
 
 max_iterations_for_curve_fit = 5000
 
@@ -67,10 +70,10 @@ def fit_exp_std(C_boot, plateau_start, plateau_end):
     cov = np.cov(C_boot[0:-1].T)
 
     if np.isnan(cov.sum()):
-        logging.warning("cov contain nan")
+        logger.warning("cov contain nan")
 
     if np.isnan(cov.T.sum()):
-        logging.warning("cov contain nan")
+        logger.warning("cov contain nan")
 
     correlator_set = dict(Gab=gv.gvar(C_boot[-1], cov))
 
@@ -111,10 +114,10 @@ def fit_cosh_std(C_boot, plateau_start, plateau_end, lattice_t):
     cov = np.cov(C_boot[0:-1].T)
 
     if np.isnan(cov.sum()):
-        logging.warning("cov contain nan")
+        logger.warning("cov contain nan")
 
     if np.isnan(cov.T.sum()):
-        logging.warning("cov contain nan")
+        logger.warning("cov contain nan")
 
     correlator_set = dict(Gab=gv.gvar(C_boot[-1], cov))
 
@@ -133,12 +136,60 @@ def fit_cosh_std(C_boot, plateau_start, plateau_end, lattice_t):
     return gv.mean(E[0]), gv.sdev(E[0]), chi2 / dof
 
 
+def fit_single_state_samples(
+    C_boot, cov, plateau_start, plateau_end, tp, p0, batched=True
+):
+    """
+    E and a of a one-state fit to each bootstrap sample.
+
+    All samples are fitted together by batched_fit; corrfitter is only run
+    for those that do not converge there, or for all of them when the data
+    are not symmetric about tp / 2 or batched is False.
+    """
+    num_sample = C_boot.shape[0]
+    E_sample = np.zeros(num_sample)
+    a_sample = np.zeros(num_sample)
+    converged = np.zeros(num_sample, dtype=bool)
+
+    t_fit = batched_fit.fit_times(plateau_start, plateau_end, tp)
+    if batched and batched_fit.is_symmetric(C_boot, t_fit, tp):
+        try:
+            E_sample, a_sample, converged = batched_fit.fit_single_state(
+                C_boot, cov, t_fit, p0, tp
+            )
+        except np.linalg.LinAlgError as e:
+            logger.warning(f"Batched fit failed, fitting samples one by one: {e}")
+    if batched and not converged.all():
+        logger.warning(
+            f"Fitting {np.count_nonzero(~converged)} of {num_sample} samples "
+            "with corrfitter"
+        )
+
+    for n in np.flatnonzero(~converged):
+        correlator_set = dict(Gab=gv.gvar(C_boot[n], cov))
+
+        E, a, _, _ = fit_correlator_without_bootstrap(
+            correlator_set,
+            0,
+            plateau_start,
+            plateau_end,
+            1,
+            tp,
+            p0,
+            plotting=False,
+            printing=False,
+        )
+        E_sample[n] = gv.mean(E[0])
+        a_sample[n] = gv.mean(a[0])
+
+    return E_sample, a_sample
+
+
 def fit_cosh_bootstrap(C, plateau_start, plateau_end):
     """This function fits the correlators with a cosh function"""
 
     C_boot = C.samples
 
-    num_sample = C_boot.shape[0]
     lattice_t = C_boot.shape[1]
 
     def func(t, a, M):
@@ -155,29 +206,11 @@ def fit_cosh_bootstrap(C, plateau_start, plateau_end):
         {"log(a)": np.array([np.log(abs(x0[0]))]), "log(dE)": np.array([np.log(x0[1])])}
     )
 
-    E_sample = np.zeros(num_sample)
-    a_sample = np.zeros(num_sample)
-    chi2_dof = np.zeros(num_sample)
-
     cov = np.cov(C_boot.T)
 
-    for n in range(num_sample):
-        correlator_set = dict(Gab=gv.gvar(C_boot[n], cov))
-
-        E, a, chi2, dof = fit_correlator_without_bootstrap(
-            correlator_set,
-            0,
-            plateau_start,
-            plateau_end,
-            1,
-            lattice_t,
-            p0,
-            plotting=False,
-            printing=False,
-        )
-        E_sample[n] = gv.mean(E[0])
-        a_sample[n] = gv.mean(a[0])
-        chi2_dof[n] = chi2 / dof
+    E_sample, a_sample = fit_single_state_samples(
+        C_boot, cov, plateau_start, plateau_end, lattice_t, p0
+    )
 
     correlator_set = dict(Gab=gv.gvar(C.mean[0], cov))
     E_mean, a_mean, chi2, dof = fit_correlator_without_bootstrap(
@@ -219,32 +252,11 @@ def fit_exp_bootstrap(C, plateau_start, plateau_end):
         {"log(a)": np.array([np.log(abs(x0[0]))]), "log(dE)": np.array([np.log(x0[1])])}
     )
 
-    # load the ensamble info
-    num_sample = C_boot.shape[0]
-
-    E_sample = np.zeros(num_sample)
-    a_sample = np.zeros(num_sample)
-    chi2_dof = np.zeros(num_sample)
-
     cov = np.cov(C_boot.T)
 
-    for n in range(num_sample):
-        correlator_set = dict(Gab=gv.gvar(C_boot[n], cov))
-
-        E, a, chi2, dof = fit_correlator_without_bootstrap(
-            correlator_set,
-            0,
-            plateau_start,
-            plateau_end,
-            1,
-            None,
-            p0,
-            plotting=False,
-            printing=False,
-        )
-        E_sample[n] = gv.mean(E[0])
-        a_sample[n] = gv.mean(a[0])
-        chi2_dof[n] = chi2 / dof
+    E_sample, a_sample = fit_single_state_samples(
+        C_boot, cov, plateau_start, plateau_end, None, p0
+    )
 
     correlator_set = dict(Gab=gv.gvar(C.mean[0], cov))
     E_mean, a_mean, chi2, dof = fit_correlator_without_bootstrap(
@@ -321,6 +333,76 @@ def fit_correlator_simultaneous(
     return E, a, b, chi2, dof
 
 
+def fit_simultaneous_samples(
+    Css,
+    Csp,
+    cov_ss,
+    cov_sp,
+    fit_model,
+    p0,
+    mean_fit,
+    plateau_start,
+    plateau_end,
+    tp,
+    sinh,
+    batched=True,
+):
+    """
+    E, a and b of a one-state simultaneous fit to each bootstrap sample.
+
+    All samples are fitted together by batched_fit, starting from the
+    parameters (E, a, b) of the fit to the mean. corrfitter, started from
+    p0 as before, is only run for the samples that do not converge there,
+    or for all of them when the data do not have the symmetry about tp / 2
+    that the model assumes. With batched False, every sample is fitted by
+    corrfitter, as the reference for the batched fit.
+    """
+    num_sample = Css.shape[0]
+    E_sample = np.zeros(num_sample)
+    a_sample = np.zeros(num_sample)
+    b_sample = np.zeros(num_sample)
+    converged = np.zeros(num_sample, dtype=bool)
+
+    t_fit = batched_fit.fit_times(plateau_start, plateau_end, tp)
+    if (
+        batched
+        and batched_fit.is_symmetric(Css, t_fit, tp)
+        and batched_fit.is_symmetric(Csp, t_fit, tp, -1 if sinh else 1)
+    ):
+        E_mean, a_mean, b_mean = mean_fit
+        warm_start = {
+            "log(a)": np.log(gv.mean(a_mean)),
+            "log(b)": np.log(gv.mean(b_mean)),
+            "log(dE)": np.log(gv.mean(E_mean)),
+        }
+        try:
+            E_sample, a_sample, b_sample, converged = batched_fit.fit_simultaneous(
+                Css, Csp, cov_ss, cov_sp, t_fit, warm_start, tp, sinh
+            )
+        except np.linalg.LinAlgError as e:
+            logger.warning(f"Batched fit failed, fitting samples one by one: {e}")
+    if batched and not converged.all():
+        logger.warning(
+            f"Fitting {np.count_nonzero(~converged)} of {num_sample} samples "
+            "with corrfitter"
+        )
+
+    for n in np.flatnonzero(~converged):
+        correlator_set = dict(Gab=gv.gvar(Csp[n], cov_sp), Gaa=gv.gvar(Css[n], cov_ss))
+
+        E, a, b, _, _ = fit_correlator_simultaneous(
+            correlator_set,
+            fit_model,
+            1,
+            p0,
+        )
+        E_sample[n] = gv.mean(E[0])
+        a_sample[n] = gv.mean(a[0])
+        b_sample[n] = gv.mean(b[0])
+
+    return E_sample, a_sample, b_sample
+
+
 def fit_coshsinh_simultaneous(Corr_ss, Corr_sp, plateau_start, plateau_end, lattice_t):
     """This function fits the correlators with cosh and sinh functions simultaneously"""
 
@@ -341,30 +423,9 @@ def fit_coshsinh_simultaneous(Corr_ss, Corr_sp, plateau_start, plateau_end, latt
     Css = Corr_ss.samples
     Csp = Corr_sp.samples
 
-    num_sample = Css.shape[0]
-
-    E_sample = np.zeros(num_sample)
-    a_sample = np.zeros(num_sample)
-    b_sample = np.zeros(num_sample)
-    chi2_dof = np.zeros(num_sample)
-
     cov_ss = np.cov(Css.T)
     cov_sp = np.cov(Csp.T)
 
-    for n in range(num_sample):
-        correlator_set = dict(Gab=gv.gvar(Csp[n], cov_sp), Gaa=gv.gvar(Css[n], cov_ss))
-
-        E, a, b, chi2, dof = fit_correlator_simultaneous(
-            correlator_set,
-            fit_model,
-            number_of_state_to_fit,
-            p0,
-        )
-        E_sample[n] = gv.mean(E[0])
-        a_sample[n] = gv.mean(a[0])
-        b_sample[n] = gv.mean(b[0])
-        chi2_dof[n] = chi2 / dof
-
     correlator_set = dict(
         Gab=gv.gvar(Corr_sp.mean, cov_sp), Gaa=gv.gvar(Corr_ss.mean, cov_ss)
     )
@@ -378,6 +439,20 @@ def fit_coshsinh_simultaneous(Corr_ss, Corr_sp, plateau_start, plateau_end, latt
         printing=False,
     )
 
+    E_sample, _, b_sample = fit_simultaneous_samples(
+        Css,
+        Csp,
+        cov_ss,
+        cov_sp,
+        fit_model,
+        p0,
+        (E_mean, a_mean, b_mean),
+        plateau_start,
+        plateau_end,
+        lattice_t,
+        True,
+    )
+
     E_fit = BootstrapSampleSet(gv.mean(E_mean[0]), E_sample)
     B_fit = BootstrapSampleSet(gv.mean(b_mean[0]), b_sample)
 
@@ -467,30 +542,9 @@ def fit_cosh_simultaneous(Corr_ss, Corr_sp, plateau_start, plateau_end, lattice_
     Css = Corr_ss.samples
     Csp = Corr_sp.samples
 
-    num_sample = Css.shape[0]
-
-    E_sample = np.zeros(num_sample)
-    a_sample = np.zeros(num_sample)
-    b_sample = np.zeros(num_sample)
-    chi2_dof = np.zeros(num_sample)
-
     cov_ss = np.cov(Css.T)
     cov_sp = np.cov(Csp.T)
 
-    for n in range(num_sample):
-        correlator_set = dict(Gab=gv.gvar(Csp[n], cov_sp), Gaa=gv.gvar(Css[n], cov_ss))
-
-        E, a, b, chi2, dof = fit_correlator_simultaneous(
-            correlator_set,
-            fit_model,
-            number_of_state_to_fit,
-            p0,
-        )
-        E_sample[n] = gv.mean(E[0])
-        a_sample[n] = gv.mean(a[0])
-        b_sample[n] = gv.mean(b[0])
-        chi2_dof[n] = chi2 / dof
-
     correlator_set = dict(
         Gab=gv.gvar(Corr_sp.mean, cov_sp), Gaa=gv.gvar(Corr_ss.mean, cov_ss)
     )
@@ -504,6 +558,20 @@ def fit_cosh_simultaneous(Corr_ss, Corr_sp, plateau_start, plateau_end, lattice_
         printing=False,
     )
 
+    E_sample, _, b_sample = fit_simultaneous_samples(
+        Css,
+        Csp,
+        cov_ss,
+        cov_sp,
+        fit_model,
+        p0,
+        (E_mean, a_mean, b_mean),
+        plateau_start,
+        plateau_end,
+        lattice_t,
+        False,
+    )
+
     E_fit = BootstrapSampleSet(gv.mean(E_mean[0]), E_sample)
     B_fit = BootstrapSampleSet(gv.mean(b_mean[0]), b_sample)
 
@@ -562,30 +630,9 @@ def fit_exp_simultaneous(Corr_ss, Corr_sp, plateau_start, plateau_end):
     Css = Corr_ss.samples
     Csp = Corr_sp.samples
 
-    num_sample = Css.shape[0]
-
-    E_sample = np.zeros(num_sample)
-    a_sample = np.zeros(num_sample)
-    b_sample = np.zeros(num_sample)
-    chi2_dof = np.zeros(num_sample)
-
     cov_ss = np.cov(Css.T)
     cov_sp = np.cov(Csp.T)
 
-    for n in range(num_sample):
-        correlator_set = dict(Gab=gv.gvar(Csp[n], cov_sp), Gaa=gv.gvar(Css[n], cov_ss))
-
-        E, a, b, chi2, dof = fit_correlator_simultaneous(
-            correlator_set,
-            fit_model,
-            number_of_state_to_fit,
-            p0,
-        )
-        E_sample[n] = gv.mean(E[0])
-        a_sample[n] = gv.mean(a[0])
-        b_sample[n] = gv.mean(b[0])
-        chi2_dof[n] = chi2 / dof
-
     correlator_set = dict(
         Gab=gv.gvar(Corr_sp.mean, cov_sp), Gaa=gv.gvar(Corr_ss.mean, cov_ss)
     )
@@ -599,6 +646,20 @@ def fit_exp_simultaneous(Corr_ss, Corr_sp, plateau_start, plateau_end):
         printing=False,
     )
 
+    E_sample, _, b_sample = fit_simultaneous_samples(
+        Css,
+        Csp,
+        cov_ss,
+        cov_sp,
+        fit_model,
+        p0,
+        (E_mean, a_mean, b_mean),
+        plateau_start,
+        plateau_end,
+        None,
+        False,
+    )
+
     E_fit = BootstrapSampleSet(gv.mean(E_mean[0]), E_sample)
     B_fit = BootstrapSampleSet(gv.mean(b_mean[0]), b_sample)
 
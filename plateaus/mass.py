@@ -5,7 +5,7 @@ import matplotlib.pyplot as plt
 import re
 import numpy as np
 
-from .bootstrap import get_rng, sample_bootstrap_1d, BootstrapSampleSet
+from .bootstrap import sample_bootstrap_plan, BootstrapSampleSet
 from .read_hdf5 import filter_configurations, get_meson_h5_representation
 
 
@@ -55,6 +55,14 @@ def get_args():
         default=None,
         help="Fixed time slice for GEVP",
     )
+    parser.add_argument(
+        "--gevp_track_vectors",
+        action="store_true",
+        help=(
+            "Order the GEVP states by eigenvector overlap between time slices "
+            "rather than by eigenvalue (at most 6 states)"
+        ),
+    )
     parser.add_argument(
         "--E0_plateau_start",
         type=int,
@@ -121,6 +129,11 @@ def get_args():
         default=None,
         help="Where to output the bootstrap samples for meson mass",
     )
+    parser.add_argument(
+        "--sample_database",
+        default=None,
+        help="HDF5 sample database to also add the bootstrap samples to",
+    )
     parser.add_argument(
         "--effmass_plot_file",
         default=None,
@@ -199,7 +212,7 @@ def get_correlator_samples(
     # C = ensemble[measurement][:, filtered_indices]
     C = ensemble[measurement][:, :]  # TO DO: how shall we deal with jumpping configs
 
-    return sample_bootstrap_1d(C.T, get_rng(ensemble.name))
+    return sample_bootstrap_plan(C.T, ensemble.name)
 
 
 def bin_meson_correlator_samples(
@@ -233,7 +246,53 @@ def bin_meson_correlator_samples(
     else:
         C_flod = fold_correlators(C.T)
 
-    return sample_bootstrap_1d(C_flod, get_rng(ensemble.name))
+    return sample_bootstrap_plan(C_flod, ensemble.name)
+
+
+def bin_meson_correlator_matrix_samples(ensemble, measurement, smearing_Ns):
+    """
+    Bootstrap samples of the matrix of correlators between all the source
+    and sink smearings in smearing_Ns, as a (nboot, Nt, n, n) array.
+
+    Every dataset is read once, and all elements are folded as one array
+    and resampled together with the ensemble's resampling plan, as
+    bin_meson_correlator_samples does for each of them.
+    """
+    rep = get_meson_h5_representation(measurement.split("_")[0])
+    target_channels = get_channel_tags(measurement.split("_")[1])
+    size = len(smearing_Ns)
+
+    # (n, n, Nt, Nconf), averaged over the channels
+    C = np.array(
+        [
+            [
+                np.mean(
+                    [
+                        ensemble[f"source_N{Nsource}_sink_N{Nsink}/{rep} {channel}"][
+                            :, :
+                        ]
+                        for channel in target_channels
+                    ],
+                    axis=0,
+                )
+                for Nsink in smearing_Ns
+            ]
+            for Nsource in smearing_Ns
+        ]
+    )
+    # (Nconf, n, n, Nt), with time last for the folding
+    C = C.transpose(3, 0, 1, 2)
+    if target_channels[0] == "g5_g0g5_re":
+        C_flod = -fold_correlators_cross(C)
+    else:
+        C_flod = fold_correlators(C)
+
+    Nconf, Nt = C_flod.shape[0], C_flod.shape[-1]
+    corr = sample_bootstrap_plan(C_flod.reshape(Nconf, -1), ensemble.name)
+    return BootstrapSampleSet(
+        corr.mean.reshape(size, size, Nt).transpose(2, 0, 1)[np.newaxis],
+        corr.samples.reshape(-1, size, size, Nt).transpose(0, 3, 1, 2),
+    )
 
 
 def get_channel_tags(ch):
@@ -252,18 +311,26 @@ def get_channel_tags(ch):
 
 
 def fold_correlators(C):
-    return (C + np.roll(np.flip(C, axis=1), 1, axis=1)) / 2
+    return (C + np.roll(np.flip(C, axis=-1), 1, axis=-1)) / 2
 
 
 def fold_correlators_cross(C):
-    C_fold = (C - np.roll(np.flip(C, axis=1), 1, axis=1)) / 2
+    C_fold = (C - np.roll(np.flip(C, axis=-1), 1, axis=-1)) / 2
 
-    C_fold[:, 0] = C[:, 0]
+    C_fold[..., 0] = C[..., 0]
 
     return C_fold
 
 
-def bin_projection_baryon(corr_e, corr_o):
+def bin_projection_baryon(corr_e, corr_o, out=None):
+    """
+    Even and odd parity projections of a baryon correlator.
+
+    out is an optional pair of sets to write the two projections into;
+    otherwise new ones are allocated. Either way each projection is
+    computed in place, without intermediate arrays.
+    """
+
     def flip_boundary(C, t):
         if t == 2:
             return C
@@ -283,8 +350,17 @@ def bin_projection_baryon(corr_e, corr_o):
     corr_even_flip = flip_temporal(corr_even)
     corr_odd_flip = flip_temporal(corr_odd)
 
-    corr_Ebin = (corr_even - corr_odd_flip) / 2
-    corr_Obin = (corr_even_flip - corr_odd) / 2
+    if out is None:
+        out = (
+            BootstrapSampleSet.empty(np.shape(corr_even.mean)),
+            BootstrapSampleSet.empty(np.shape(corr_odd.mean)),
+        )
+    corr_Ebin, corr_Obin = out
+
+    corr_even.subtract(corr_odd_flip, out=corr_Ebin)
+    corr_Ebin.divide(2, out=corr_Ebin)
+    corr_even_flip.subtract(corr_odd, out=corr_Obin)
+    corr_Obin.divide(2, out=corr_Obin)
 
     return corr_Ebin, corr_Obin
 
@@ -310,8 +386,10 @@ def get_baryon_corr(ensemble, args, Nsource, Nsink, channel_parity):
         )
 
         corr_even, corr_odd = bin_projection_baryon(corr_e, corr_o)
+        corr_even.multiply(args.Ns**3, out=corr_even)
+        corr_odd.multiply(args.Ns**3, out=corr_odd)
 
-        return corr_even * args.Ns**3, corr_odd * args.Ns**3
+        return corr_even, corr_odd
 
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
@@ -335,3 +413,9 @@ def get_meson_corr(ensemble, args, Nsource, Nsink, channel):
     except Exception as e:
         print(f"An unexpected error occurred: {e}")
         return None
+
+
+def get_meson_corr_matrix(ensemble, args, smearing_Ns, channel):
+    return (
+        bin_meson_correlator_matrix_samples(ensemble, channel, smearing_Ns) * args.Ns**3
+    )
@@ -13,6 +13,7 @@ from .mass import (
     get_args,
 )
 from .read_hdf5 import get_ensemble
+from .sample_database import add_samples
 from .plots_common import plot_baryon_gevp_energy_states
 
 
@@ -57,7 +58,12 @@ def gevp_extraction(ensemble, args):
         logging.waring("NO such parity: ")
 
     eigenvalues = extract.gevp_fixT(
-        corr_mat.mean, corr_mat.samples, args.gevp_t0, args.gevp_t0 + 1, args.Nt
+        corr_mat.mean,
+        corr_mat.samples,
+        args.gevp_t0,
+        args.gevp_t0 + 1,
+        args.Nt,
+        track_vectors=args.gevp_track_vectors,
     )
 
     return eigenvalues
@@ -99,6 +105,8 @@ def main():
             data_to_save[f"gevp_{args.channel}_E{n}_mass"] = mass
 
         dump_samples(data_to_save, args.output_file_samples)
+        if args.sample_database:
+            add_samples(args.sample_database, data_to_save)
 
 
 if __name__ == "__main__":
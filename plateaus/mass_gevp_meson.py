@@ -4,41 +4,32 @@
 import h5py
 import numpy as np
 
-from .bootstrap import BootstrapSampleSet, BOOTSTRAP_SAMPLE_COUNT
 from .dump import dump_dict, dump_samples
 from . import extract
 from .mass import (
-    get_meson_corr,
+    get_meson_corr_matrix,
     get_args,
 )
 from .read_hdf5 import get_ensemble
+from .sample_database import add_samples
 from .plots_common import plot_meson_gevp_energy_states
 
 
 def get_meson_Cmat_single(ensemble, args, Nmin, Nmax, Nd, channel):
-    source_Ns = [str(i) for i in np.arange(Nmin, Nmax + 1, Nd)]
-    sink_Ns = [str(i) for i in np.arange(Nmin, Nmax + 1, Nd)]
+    smearing_Ns = [str(i) for i in np.arange(Nmin, Nmax + 1, Nd)]
 
-    size = len(source_Ns)
-
-    mat_sample = np.zeros(shape=(BOOTSTRAP_SAMPLE_COUNT, args.Nt, size, size))
-    mat_mean = np.zeros(shape=(1, args.Nt, size, size))
-
-    # print(mat.shape)
-
-    for i in range(size):
-        for j in range(size):
-            corr = get_meson_corr(ensemble, args, source_Ns[i], sink_Ns[j], channel)
-            mat_sample[:, :, i, j] = corr.samples
-            mat_mean[:, :, i, j] = corr.mean
-
-    return BootstrapSampleSet(mat_mean, mat_sample)
+    return get_meson_corr_matrix(ensemble, args, smearing_Ns, channel)
 
 
 def gevp_meson_extraction(ensemble, args):
     corr_mat = get_meson_Cmat_single(ensemble, args, 0, 80, 40, args.channel)
     eigenvalues = extract.gevp_fixT(
-        corr_mat.mean, corr_mat.samples, args.gevp_t0, args.gevp_t0 + 1, args.Nt
+        corr_mat.mean,
+        corr_mat.samples,
+        args.gevp_t0,
+        args.gevp_t0 + 1,
+        args.Nt,
+        track_vectors=args.gevp_track_vectors,
     )
 
     return eigenvalues
@@ -80,6 +71,8 @@ def main():
             data_to_save[f"gevp_{args.channel}_E{n}_mass"] = mass
 
         dump_samples(data_to_save, args.output_file_samples)
+        if args.sample_database:
+            add_samples(args.sample_database, data_to_save)
 
 
 if __name__ == "__main__":
@@ -12,6 +12,7 @@ from .mass import (
     get_args,
 )
 from .read_hdf5 import get_ensemble
+from .sample_database import add_samples
 
 
 def ps_extraction(ensemble, args):
@@ -88,6 +89,8 @@ def main():
         data_to_save[f"{args.channel}_matrix_element"] = matrix_element
 
         dump_samples(data_to_save, args.output_file_samples)
+        if args.sample_database:
+            add_samples(args.sample_database, data_to_save)
 
 
 if __name__ == "__main__":
@@ -9,6 +9,7 @@ import itertools
 from format_multiple_errors import format_multiple_errors as ferr
 
 from .dump import read_sample_files
+from .sample_database import SampleDatabase
 from .bootstrap import BOOTSTRAP_SAMPLE_COUNT
 
 markers = itertools.cycle(["o", "s", "v"])
@@ -61,10 +62,15 @@ def get_standard_plot_args(fit_results=False, external_data=False):
 
     parser.add_argument(
         "data_filenames",
-        nargs="+",
+        nargs="*",
         metavar="sample_filename",
         help="Filenames of sample files containing data to plot",
     )
+    parser.add_argument(
+        "--sample_database",
+        default=None,
+        help="Sample database to read the data from, instead of sample files",
+    )
     parser.add_argument(
         "--fit_results",
         nargs="+",
@@ -93,7 +99,11 @@ def get_standard_plot_args(fit_results=False, external_data=False):
 def standard_plot_main(plot_function, **args_options):
     args = get_standard_plot_args(**args_options)
     plt.style.use(args.plot_styles)
-    data = read_sample_files(args.data_filenames)
+    if args.sample_database is not None:
+        with SampleDatabase(args.sample_database) as database:
+            data = database.records()
+    else:
+        data = read_sample_files(args.data_filenames)
 
     external_data = (
         pd.read_csv(args.external_data) if args.external_data is not None else None
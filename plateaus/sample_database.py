@@ -0,0 +1,169 @@
+from argparse import ArgumentParser
+from contextlib import ExitStack
+import fcntl
+import json
+
+import h5py
+import numpy as np
+
+from .bootstrap import BootstrapSampleSet
+from .dump import read_sample_file
+
+
+def _set_attribute(h5_object, key, value):
+    # Rewriting an attribute leaves its old space unused in the file
+    encoded = json.dumps(value)
+    if h5_object.attrs.get(key) != encoded:
+        h5_object.attrs[key] = encoded
+
+
+class SampleDatabase:
+    """
+    Bootstrap samples of every ensemble and observable in one HDF5 file.
+
+    Each ensemble is a group, with its metadata (beta, Nt, ...) as JSON
+    attributes; each observable is a contiguous dataset of samples in it,
+    with its central value as the "value" attribute. Observables are named
+    as the keys given to dump_samples, e.g. "gevp_f_ps_E0_mass".
+
+    Writers hold an exclusive lock on filename + ".lock", and readers a
+    shared one, so that jobs finishing in parallel can add to the same
+    file. Each add only writes the group of its ensemble, and samples that
+    keep their shape are overwritten where they are, so rerunning a job
+    does not grow the file. Use as a context manager, or call close().
+    """
+
+    def __init__(self, filename, mode="r"):
+        self.filename = filename
+        with ExitStack() as stack:
+            lock = stack.enter_context(open(f"{filename}.lock", "a"))
+            fcntl.flock(lock, fcntl.LOCK_SH if mode == "r" else fcntl.LOCK_EX)
+            self._file = stack.enter_context(h5py.File(filename, mode))
+            # Closes the file, then releases the lock, even if closing fails
+            self._resources = stack.pop_all()
+
+    def close(self):
+        self._resources.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __contains__(self, key):
+        ensemble, observable = key
+        return f"{ensemble}/{observable}" in self._file
+
+    def ensembles(self):
+        return list(self._file)
+
+    def observables(self, ensemble):
+        return list(self._file[ensemble])
+
+    def metadata(self, ensemble):
+        return {
+            key: json.loads(value) for key, value in self._file[ensemble].attrs.items()
+        }
+
+    def get(self, ensemble, observable):
+        """The samples of one observable, read into memory."""
+        dataset = self._file[ensemble][observable]
+        value = json.loads(dataset.attrs["value"])
+        return BootstrapSampleSet(
+            np.asarray(value) if isinstance(value, list) else value,
+            dataset[()],
+        )
+
+    def add(self, data, group_key="ensemble_name"):
+        """
+        Store the dictionary of one dump_samples call, replacing any
+        observables and metadata already there. The ensemble is
+        data[group_key].
+        """
+        group = self._file.require_group(str(data[group_key]))
+        for k, v in data.items():
+            if isinstance(v, BootstrapSampleSet):
+                samples = np.asarray(v.samples, dtype=float)
+                if k in group and group[k].shape == samples.shape:
+                    group[k][...] = samples
+                else:
+                    if k in group:
+                        del group[k]
+                    group[k] = samples
+                _set_attribute(
+                    group[k], "value", np.asarray(v.mean, dtype=float).tolist()
+                )
+                continue
+
+            if isinstance(v, np.ndarray):
+                v = v.tolist()
+            elif isinstance(v, np.integer):
+                v = int(v)
+            _set_attribute(group, k, v)
+
+    def records(self, ensembles=None):
+        """
+        Contents of each ensemble in the form returned by read_sample_files,
+        with sample keys ending in "_samples".
+        """
+        return [
+            {
+                **{
+                    f"{observable}_samples": self.get(ensemble, observable)
+                    for observable in self.observables(ensemble)
+                },
+                **self.metadata(ensemble),
+            }
+            for ensemble in (self.ensembles() if ensembles is None else ensembles)
+        ]
+
+
+def add_samples(filename, data, group_key="ensemble_name"):
+    """Add the dictionary of one dump_samples call to the database at filename."""
+    with SampleDatabase(filename, "a") as database:
+        database.add(data, group_key=group_key)
+
+
+def add_sample_files(filename, sample_filenames, group_key="ensemble_name", mode="a"):
+    """Add the files written by dump_samples to the database at filename."""
+    with SampleDatabase(filename, mode) as database:
+        for sample_filename in sample_filenames:
+            data = read_sample_file(sample_filename)
+            database.add(
+                {
+                    k.removesuffix("_samples")
+                    if isinstance(v, BootstrapSampleSet)
+                    else k: v
+                    for k, v in data.items()
+                },
+                group_key=group_key,
+            )
+
+
+def get_args():
+    parser = ArgumentParser(
+        description="Collect sample files into a single sample database."
+    )
+
+    parser.add_argument(
+        "sample_filenames",
+        nargs="+",
+        metavar="sample_filename",
+        help="Filename of a sample file written by dump_samples",
+    )
+    parser.add_argument(
+        "--output_file",
+        required=True,
+        help="Where to place the sample database.",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = get_args()
+    add_sample_files(args.output_file, args.sample_filenames, mode="w")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,10 +2,12 @@ import pandas as pd
 import numpy as np
 import json
 import math
+from functools import lru_cache
 
 
+@lru_cache(maxsize=None)
 def read_json(file_path):
-    """Reads a JSON file and returns the parsed data."""
+    """Reads a JSON file and returns the parsed data, parsing each file only once."""
     with open(file_path, "r") as file:
         data = json.load(file)
     return data
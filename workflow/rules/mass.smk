@@ -172,16 +172,30 @@ def mass_gevp_samples(wildcards):
     ]
 
 
-rule mass_plot:
+rule sample_database:
     params:
         module=lambda wildcards, input: input.script.replace("/", ".")[:-3],
     input:
         gevp_data=mass_gevp_samples,
-        extraction_data=extraction_samples,  #passing more data than the code needs to generate all the results. To be changed...
+        extraction_data=extraction_samples,
+        script="plateaus/sample_database.py",
+    output:
+        database=sample_database,
+    conda:
+        "../envs/flow_analysis.yml"
+    shell:
+        "python -m {params.module} {input.gevp_data} {input.extraction_data} --output_file {output.database}"
+
+
+rule mass_plot:
+    params:
+        module=lambda wildcards, input: input.script.replace("/", ".")[:-3],
+    input:
+        database=sample_database,
         script="plateaus/plots/gevp_meson.py",
     output:
         plot="intermediary_data/test_mass_plot.pdf",
     conda:
         "../envs/flow_analysis.yml"
     shell:
-        "python -m {params.module} {input.gevp_data} {input.extraction_data} --plot_file {output.plot}"
+        "python -m {params.module} --sample_database {input.database} --plot_file {output.plot}"
@@ -107,7 +107,7 @@ rule fit_data_mesons:
     conda:
         "../envs/spectral_densities.yml"
     shell:
-        "cd lsd_out && python ../{input.script} --ensembles {wildcards.ensemble}"
+        "cd lsd_out && python ../{input.script} --ensembles {wildcards.ensemble} --threads {threads} {fit_plot_flag}"
 
 
 rule fit_data_CB:
@@ -122,7 +122,27 @@ rule fit_data_CB:
     conda:
         "../envs/spectral_densities.yml"
     shell:
-        "cd lsd_out && python ../{input.script} --ensembles {wildcards.ensemble}"
+        "cd lsd_out && python ../{input.script} --ensembles {wildcards.ensemble} --threads {threads} {fit_plot_flag}"
+
+
+rule render_fit_plots:
+    threads: 20
+    input:
+        script="lsd_out/render_fit_plots.py",
+        meson_spectra=expand(
+            "CSVs/{ensemble}_spectral_density_spectrum.csv",
+            ensemble=ensembles,
+        ),
+        cb_spectra=expand(
+            "CSVs/{ensemble}_chimerabaryons_spectral_density_spectrum.csv",
+            ensemble=ensembles,
+        ),
+    output:
+        completion_tag=touch("lsd_out/render_fit_plots_complete"),
+    conda:
+        "../envs/spectral_densities.yml"
+    shell:
+        "cd lsd_out && python ../{input.script} --threads {threads}"
 
 
 use rule analysis_template_with_plot as simultaneous_fits_mesons with: